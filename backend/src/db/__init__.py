@@ -1,4 +1,3 @@
 from ..utils.supaBaseClient import supabase
 
 __all__ = ["supabase"]
-
@@ -4,25 +4,33 @@ Importador de lotes y finca desde un GeoJSON a Supabase.
 - Crea roles y usuarios (Auth y tabla usuario)
 - Crea finca "Finca Yariguies" si no existe
 - Inserta geojson_finca y lotes (no inserta 'area' para evitar errores de tipo)
+
+Los usuarios de Auth y los lotes existentes se consultan una sola vez, las
+áreas se calculan para toda la colección con un solo transformador y los lotes
+nuevos se insertan por bloques. Volver a ejecutarlo no duplica nada: los
+lotes que la finca ya tiene (por nombre) se omiten, y cada lote nuevo lleva su
+lote_id generado aquí: un bloque reintentado que ya se había escrito se
+ignora como duplicado.
+
+Uso (desde backend/): python -m src.db.import_lotes_supabase [--geojson ruta]
 """
 import os
 import json
+import time
+import uuid
+from collections import Counter
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import Optional, Any
 from supabase import create_client, Client
 from shapely.geometry import shape
-from shapely.ops import transform
+import numpy as np
+import shapely
 import pyproj
+from src.utils.bulk_writer import bulk_insert
 
-
-
-# shapely para cálculo de áreas (opcional)
-try:
-    from shapely.geometry import shape
-    SHAPELY_AVAILABLE = True
-except Exception:
-    SHAPELY_AVAILABLE = False
+# Un solo transformador a metros (Web Mercator) para todas las áreas
+TO_METERS = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
 
 # ---------- CONFIG ----------
 GEOJSON_DEFAULT_PATH = r"C:\Users\luisa\Downloads\lotes.geojson"
@@ -70,11 +78,28 @@ def sb_select_one(sb: Client, table: str, field: str, value, cols="*"):
     return data[0] if data else None
 
 def sb_insert(sb, table: str, data: dict):
-    """Inserta datos en Supabase y devuelve el resultado."""
+    """Inserta una fila en Supabase y devuelve la fila insertada."""
     res = sb.table(table).insert(data).execute()
     if hasattr(res, "error") and res.error:
         raise Exception(res.error.message)
-    return res.data
+    return res.data[0] if isinstance(res.data, list) and res.data else res.data
+
+def sb_select_all(sb: Client, table: str, cols: str, page_size=1000, order_by=None, **filters):
+    """
+    Todas las filas de table (paginando con range(): PostgREST limita max-rows).
+    Las páginas van ordenadas por order_by (por defecto la llave <table>_id) para
+    que el offset no salte ni repita filas.
+    """
+    rows = []
+    while True:
+        query = sb.table(table).select(cols)
+        for field, value in filters.items():
+            query = query.eq(field, value)
+        query = query.order(order_by or f"{table}_id")
+        page = query.range(len(rows), len(rows) + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
 
 
 # ---------- DB / AUTH ----------
@@ -87,19 +112,35 @@ def ensure_role(sb: Client, nombre: str, descripcion=""):
     print(f"🆕 Rol creado: {nombre}")
     return new["rol_usuario_id"]
 
-def ensure_auth_user(sb: Client, correo: str, password: str):
+def list_auth_users(sb: Client, per_page=1000) -> dict:
+    """{correo en minúsculas: auth_id} de todos los usuarios de Auth, en una sola pasada."""
+    users, page = [], 1
     try:
-        raw = sb.auth.admin.list_users()
+        while True:
+            try:
+                batch = _normalize_list_users_result(sb.auth.admin.list_users(page=page, per_page=per_page))
+            except TypeError:
+                # Versiones del cliente sin paginación: una sola llamada
+                batch = _normalize_list_users_result(sb.auth.admin.list_users())
+                users.extend(batch)
+                break
+            users.extend(batch)
+            if len(batch) < per_page:
+                break
+            page += 1
     except Exception as e:
         raise RuntimeError(f"Error al listar usuarios Auth: {e}")
+    return {
+        _get_email_from_user_obj(u).lower(): _get_id_from_user_obj(u)
+        for u in users if _get_email_from_user_obj(u)
+    }
 
-    users = _normalize_list_users_result(raw)
-    for u in users:
-        email = _get_email_from_user_obj(u)
-        if email and email.lower() == correo.lower():
-            uid = _get_id_from_user_obj(u)
-            print(f"✅ Auth user existente: {correo} (id={uid})")
-            return uid
+def ensure_auth_user(sb: Client, correo: str, password: str, auth_users: dict):
+    """auth_id del usuario (de auth_users, el resultado de list_auth_users); lo crea si no existe."""
+    uid = auth_users.get(correo.lower())
+    if uid:
+        print(f"✅ Auth user existente: {correo} (id={uid})")
+        return uid
 
     try:
         created = sb.auth.admin.create_user({"email": correo, "password": password, "email_confirm": True})
@@ -113,6 +154,7 @@ def ensure_auth_user(sb: Client, correo: str, password: str):
         created_user_obj = getattr(created, "user", None) or created
 
     new_id = _get_id_from_user_obj(created_user_obj)
+    auth_users[correo.lower()] = new_id
     print(f"🆕 Auth user creado: {correo} (id={new_id})")
     return new_id
 
@@ -150,35 +192,55 @@ def ensure_geojson_finca(sb: Client, finca_id: str, data: dict):
     print("🆕 geojson_finca creado.")
     return inserted
 
-def compute_area(feat):
-    if not SHAPELY_AVAILABLE:
-        return None
-    try:
-        geom = shape(feat["geometry"])
-        return float(geom.area)
-    except Exception:
-        return None
-
-def ensure_lote(sb, finca_id, nombre_lote, geometry_geojson):
-    """Crea lote con geometría y área calculada."""
-    # Convertir a objeto shapely
-    geom = shape(geometry_geojson)
-
-    # Proyección a metros (para calcular área en m²)
-    project = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True).transform
-    geom_m = transform(project, geom)
-    area_m2 = geom_m.area
-
-    # Insertar lote con geometría válida
-    payload = {
-        "finca_id": finca_id,
-        "nombre": nombre_lote,
-        "area": json.dumps(geometry_geojson),  # guardado como JSON
-    }
-
-    inserted = sb_insert(sb, "lote", payload)
-    print(f"🆕 Lote creado: {nombre_lote} | Área: {area_m2:.2f} m²")
-    return inserted
+def lote_name(feat, i):
+    props = feat.get("properties", {}) or {}
+    return str(props.get("Lote") or props.get("lote") or props.get("nombre") or props.get("Name") or f"Lote_{i+1}")
+
+def compute_areas(features):
+    """Área en m² de cada feature (NaN si la geometría no es válida), en una sola pasada."""
+    geoms = []
+    for feat in features:
+        try:
+            geoms.append(shape(feat["geometry"]))
+        except Exception:
+            geoms.append(None)
+    geoms = np.array(geoms, dtype=object)
+    # Todas las coordenadas de la colección se proyectan en una sola llamada
+    projected = shapely.transform(geoms, lambda c: np.column_stack(TO_METERS.transform(c[:, 0], c[:, 1])))
+    return shapely.area(projected)
+
+def import_lotes(sb: Client, finca_id: str, features: list):
+    """
+    Inserta por bloques los lotes de features que la finca todavía no tiene.
+    Los nombres repetidos en el archivo se respetan: solo se agrega lo que falta
+    frente a lo que ya hay con ese nombre. Devuelve (insertados, omitidos).
+    """
+    start = time.perf_counter()
+    areas = compute_areas(features)
+    existentes = Counter(r["nombre"] for r in sb_select_all(sb, "lote", "nombre", finca_id=finca_id))
+
+    rows = []
+    omitidos = 0
+    for i, feat in enumerate(features):
+        nombre_lote = lote_name(feat, i)
+        if existentes[nombre_lote] > 0:
+            existentes[nombre_lote] -= 1
+            omitidos += 1
+            continue
+        rows.append({
+            "lote_id": str(uuid.uuid4()),
+            "finca_id": finca_id,
+            "nombre": nombre_lote,
+            "area": json.dumps(feat["geometry"]),  # guardado como JSON
+        })
+
+    if rows:
+        bulk_insert("lote", rows, client=sb, on_conflict="lote_id")
+    validas = areas[~np.isnan(areas)]
+    print(f"🆕 Lotes creados: {len(rows)} | ya existentes: {omitidos} | "
+          f"área total: {validas.sum():.2f} m² ({len(areas) - len(validas)} geometrías inválidas) | "
+          f"{time.perf_counter() - start:.1f}s")
+    return len(rows), omitidos
 
 
 # ---------- MAIN ----------
@@ -197,8 +259,9 @@ def main(geojson_path: Optional[str] = None):
 
     # 2) Usuarios (Auth + tabla)
     usuarios = {}
+    auth_users = list_auth_users(sb)
     for u in EXAMPLE_USERS:
-        auth_id = ensure_auth_user(sb, u["correo"], u["password"])
+        auth_id = ensure_auth_user(sb, u["correo"], u["password"], auth_users)
         usr = ensure_usuario_table(sb, u["nombre"], u["correo"], u["rol"], auth_id)
         usuarios[u["rol"]] = usr
 
@@ -211,17 +274,8 @@ def main(geojson_path: Optional[str] = None):
         geojson = json.load(f)
     ensure_geojson_finca(sb, finca["finca_id"], geojson)
 
-    # 5) Lotes: crear sin enviar 'area', pero calcular y mostrar area localmente (si shapely está disponible)
-    for i, feat in enumerate(geojson.get("features", [])):
-        props = feat.get("properties", {}) or {}
-        nombre_lote = props.get("Lote") or props.get("lote") or props.get("nombre") or props.get("Name") or f"Lote_{i+1}"
-        area = compute_area(feat)
-        if area is not None:
-            print(f"ℹ️ Area calculada (CRS del GeoJSON) para '{nombre_lote}': {area}")
-        else:
-            print(f"ℹ️ Area no calculada para '{nombre_lote}' (shapely no disponible o geometría inválida).")
-        ensure_lote(sb, finca["finca_id"], str(nombre_lote), feat["geometry"])
-
+    # 5) Lotes: crear sin enviar 'area', pero calcular y mostrar el área total localmente
+    import_lotes(sb, finca["finca_id"], geojson.get("features", []))
 
     print("✅ Importación completa (sin insertar campo 'area' para evitar errores de tipo).")
 
@@ -0,0 +1,54 @@
+-- Variante por lotes de insert_cultivo_from_geojson (usada por upload_cultivos.py --batch-size).
+--
+-- Recibe un arreglo [{"nombre", "especie", "feature"}, ...] y llama a
+-- insert_cultivo_from_geojson para cada elemento dentro de su propio bloque
+-- BEGIN/EXCEPTION: un feature con error no deshace los demás.
+-- Devuelve una fila por cultivo insertado (idx = posición en el arreglo), una
+-- fila con cultivo_id nulo si el feature no cayó en ningún lote, y una sola
+-- fila con error si falló. Las filas de cada feature se guardan aparte y solo
+-- se emiten cuando su llamada terminó sin error: un feature que falla a mitad
+-- no deja en el resultado filas de inserts que se deshicieron.
+--
+-- Los tipos de cultivo_id / lote_id deben coincidir con los que devuelve
+-- insert_cultivo_from_geojson.
+create or replace function public.insert_cultivos_from_geojson(features jsonb)
+returns table (idx integer, cultivo_id uuid, lote_id uuid, error text)
+language plpgsql
+as $$
+declare
+    item jsonb;
+    pos integer := 0;
+    cultivos uuid[];
+    lotes uuid[];
+    fallo text;
+begin
+    for item in select value from jsonb_array_elements(features) loop
+        cultivos := null;
+        lotes := null;
+        fallo := null;
+        begin
+            select array_agg(r.cultivo_id), array_agg(r.lote_id)
+            into cultivos, lotes
+            from public.insert_cultivo_from_geojson(
+                item->>'nombre', item->>'especie', item->'feature'
+            ) r;
+        exception when others then
+            fallo := sqlerrm;
+        end;
+
+        if fallo is not null then
+            idx := pos; cultivo_id := null; lote_id := null; error := fallo;
+            return next;
+        elsif cultivos is null then
+            idx := pos; cultivo_id := null; lote_id := null; error := null;
+            return next;
+        else
+            for i in 1 .. array_length(cultivos, 1) loop
+                idx := pos; cultivo_id := cultivos[i]; lote_id := lotes[i]; error := null;
+                return next;
+            end loop;
+        end if;
+        pos := pos + 1;
+    end loop;
+end;
+$$;
@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from src.services import arboles, cultivos, lotes, update_clusters, notificaciones, stats, zone_analysis, cleanup
+from starlette.concurrency import run_in_threadpool
+from src.utils.supaBaseClient import close_clients
+from src.services import arboles, cultivos, lotes, update_clusters, notificaciones, stats, zone_analysis, cleanup, tiles
 
 app = FastAPI(title="CocoaApp API")
 
@@ -29,18 +31,24 @@ app.include_router(notificaciones.router, prefix="/notifications", tags=["Notifi
 app.include_router(stats.router, prefix="/stats", tags=["Estadísticas"])
 app.include_router(zone_analysis.router, prefix="/zone-analysis", tags=["Análisis de Zonas"])
 app.include_router(cleanup.router, prefix="/cleanup", tags=["Limpieza"])
+app.include_router(tiles.router, prefix="/tiles", tags=["Teselas"])
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Cerrar las conexiones del pool de Supabase
+    close_clients()
 
 @app.get("/")
 def root():
     return {"message": "CocoaApp Backend running"}
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint que verifica conexión a Supabase"""
     try:
         from src.db import supabase
         # Prueba simple de conexión
-        response = supabase.table("finca").select("finca_id").limit(1).execute()
+        response = await run_in_threadpool(supabase.table("finca").select("finca_id").limit(1).execute)
         if hasattr(response, 'error') and response.error:
             return {
                 "status": "error",
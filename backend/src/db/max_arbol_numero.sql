@@ -0,0 +1,13 @@
+-- Mayor número N usado en los nombres "Arbol N" (activos o desactivados), o 0.
+--
+-- Lo usa el modo incremental de /update_clusters para numerar los clusters
+-- nuevos a continuación sin traer la tabla arbol completa. Si la función no
+-- existe, el servicio lee solo los nombres y calcula el máximo localmente.
+create or replace function public.max_arbol_numero()
+returns integer
+language sql
+stable
+as $$
+    select coalesce(max((substring(a.nombre from '^Arbol (\d+)$'))::integer), 0)
+    from public.arbol a;
+$$;
@@ -0,0 +1,75 @@
+-- Conteos de la jerarquía por finca para GET /stats (resumen_general y por_finca).
+--
+-- Una sola consulta agrupada: por cada finca (opcionalmente solo p_finca_id y,
+-- dentro de ella, solo el lote p_lote_id) devuelve cuántos lotes, cultivos,
+-- árboles y frutos tiene, con una fila por estado de fruto (GROUP BY finca,
+-- estado). Las fincas sin frutos salen en una fila con estado nulo y
+-- frutos_estado = 0; los frutos sin estado (o con un estado que no existe) salen
+-- con estado nulo y el servicio los cuenta como 'Desconocido'.
+--
+-- Los tipos de los ids deben coincidir con los de las tablas finca / estado_cacao.
+create or replace function public.stats_conteos(p_finca_id uuid default null, p_lote_id uuid default null)
+returns table (
+    finca_id uuid,
+    nombre text,
+    lotes bigint,
+    cultivos bigint,
+    arboles bigint,
+    frutos bigint,
+    estado_cacao_id uuid,
+    estado text,
+    frutos_estado bigint
+)
+language sql
+stable
+as $$
+    with f as (
+        select fi.finca_id, fi.nombre
+        from public.finca fi
+        where p_finca_id is null or fi.finca_id = p_finca_id
+    ),
+    l as (
+        select lo.lote_id, lo.finca_id
+        from public.lote lo
+        join f on f.finca_id = lo.finca_id
+        where p_lote_id is null or lo.lote_id = p_lote_id
+    ),
+    c as (
+        select cu.cultivo_id, l.finca_id
+        from public.cultivo cu
+        join l on l.lote_id = cu.lote_id
+    ),
+    a as (
+        select ar.arbol_id, c.finca_id
+        from public.arbol ar
+        join c on c.cultivo_id = ar.cultivo_id
+    ),
+    fr as (
+        select fu.estado_cacao_id, a.finca_id
+        from public.fruto fu
+        join a on a.arbol_id = fu.arbol_id
+    ),
+    por_estado as (
+        select fr.finca_id, fr.estado_cacao_id, es.nombre as estado, count(*) as n
+        from fr
+        left join public.estado_cacao es on es.estado_cacao_id = fr.estado_cacao_id
+        group by fr.finca_id, fr.estado_cacao_id, es.nombre
+    )
+    select
+        f.finca_id,
+        f.nombre,
+        coalesce(nl.n, 0),
+        coalesce(nc.n, 0),
+        coalesce(na.n, 0),
+        coalesce(nf.n, 0),
+        pe.estado_cacao_id,
+        pe.estado,
+        coalesce(pe.n, 0)
+    from f
+    left join (select l.finca_id, count(*) as n from l group by l.finca_id) nl on nl.finca_id = f.finca_id
+    left join (select c.finca_id, count(*) as n from c group by c.finca_id) nc on nc.finca_id = f.finca_id
+    left join (select a.finca_id, count(*) as n from a group by a.finca_id) na on na.finca_id = f.finca_id
+    left join (select fr.finca_id, count(*) as n from fr group by fr.finca_id) nf on nf.finca_id = f.finca_id
+    left join por_estado pe on pe.finca_id = f.finca_id
+    order by f.nombre, f.finca_id, pe.estado;
+$$;
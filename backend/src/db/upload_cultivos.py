@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
-import os, json
+"""
+Sube cultivos desde un GeoJSON con la RPC insert_cultivo_from_geojson.
+
+Las llamadas van en paralelo (--workers). Con --batch-size N se usa la RPC por
+lotes insert_cultivos_from_geojson (insert_cultivos_from_geojson.sql), que
+recibe N features por llamada y devuelve el resultado de cada uno; si la
+función no existe en la base se vuelve a las llamadas de a un feature.
+"""
+import os, json, time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
 GEOJSON_DEFAULT = r"C:\Users\luisa\Downloads\cultivos_output (1).json"
+WORKERS = 8
 
 def load_env():
     load_dotenv()
@@ -27,7 +37,52 @@ def call_rpc_insert(sb: Client, nombre: str, especie: str, feature_obj: dict):
         raise RuntimeError(res.error)
     return res.data or []
 
-def main(geojson_path: str = None):
+def call_rpc_insert_batch(sb: Client, items: list):
+    """
+    Inserta varios features con una sola llamada. items: [(nombre, especie, feature)].
+    Devuelve, por cada item, la lista de filas insertadas o un error (str).
+    """
+    payload = [{"nombre": n, "especie": e, "feature": f} for n, e, f in items]
+    res = sb.rpc("insert_cultivos_from_geojson", {"features": payload}).execute()
+    if getattr(res, "error", None):
+        raise RuntimeError(res.error)
+    # Un feature con error no tiene filas de cultivo, sin importar el orden en que lleguen
+    errores = {r["idx"]: r["error"] for r in res.data or [] if r.get("error")}
+    resultados = [errores.get(i, []) for i in range(len(items))]
+    for r in res.data or []:
+        if r["idx"] not in errores and r.get("cultivo_id") is not None:
+            resultados[r["idx"]].append(r)
+    return resultados
+
+def insert_one(sb: Client, item):
+    #Resultado de un feature: filas insertadas o el error como excepción.
+    nombre, especie, feat = item
+    try:
+        # enviamos el feature completo (la función SQL extrae geometry si viene como Feature)
+        return call_rpc_insert(sb, nombre, especie, feat)
+    except Exception as e:
+        return e
+
+def insert_batch(sb: Client, items: list):
+    try:
+        return [RuntimeError(r) if isinstance(r, str) else r for r in call_rpc_insert_batch(sb, items)]
+    except Exception as e:
+        if "PGRST202" in str(e) or "Could not find the function" in str(e):
+            raise  # la función por lotes no existe: se cae a llamadas individuales
+        return [e] * len(items)
+
+def insert_all(sb: Client, items: list, workers=WORKERS, batch_size=None):
+    """Resultados de items en el mismo orden, con a lo sumo workers llamadas simultáneas."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if batch_size:
+            batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+            try:
+                return [r for batch in pool.map(lambda b: insert_batch(sb, b), batches) for r in batch]
+            except Exception as e:
+                print(f"⚠️ RPC por lotes no disponible ({e}); se usan llamadas individuales")
+        return list(pool.map(lambda item: insert_one(sb, item), items))
+
+def main(geojson_path: str = None, workers: int = WORKERS, batch_size: int = None):
     geojson_path = Path(geojson_path or GEOJSON_DEFAULT)
     if not geojson_path.exists():
         raise SystemExit(f"No se encontró {geojson_path}")
@@ -43,6 +98,7 @@ def main(geojson_path: str = None):
     skipped = 0
     errors = 0
 
+    items = []
     for i, feat in enumerate(features):
         props = feat.get("properties") or {}
         nombre = props.get("nombre") or props.get("name") or props.get("cultivo_id") or f"Cultivo_{i+1}"
@@ -52,30 +108,35 @@ def main(geojson_path: str = None):
             print(f"⚠️ Feature {i+1} sin geometry — se omite")
             skipped += 1
             continue
+        items.append((nombre, especie, feat))
 
-        try:
-            # enviamos el feature completo (la función SQL extrae geometry si viene como Feature)
-            res = call_rpc_insert(sb, nombre, especie, feat)
-            if res:
-                for r in res:
-                    print(f"✅ Insertado cultivo {nombre} -> cultivo_id={r.get('cultivo_id')} lote_id={r.get('lote_id')}")
-                inserted += 1
-            else:
-                print(f"ℹ️ No se encontró lote para '{nombre}', omitiendo")
-                skipped += 1
-        except Exception as e:
-            print(f"❌ Error insertando '{nombre}': {e}")
+    start = time.perf_counter()
+    for (nombre, _, _), res in zip(items, insert_all(sb, items, workers, batch_size)):
+        if isinstance(res, Exception):
+            print(f"❌ Error insertando '{nombre}': {res}")
             errors += 1
+        elif res:
+            for r in res:
+                print(f"✅ Insertado cultivo {nombre} -> cultivo_id={r.get('cultivo_id')} lote_id={r.get('lote_id')}")
+            inserted += 1
+        else:
+            print(f"ℹ️ No se encontró lote para '{nombre}', omitiendo")
+            skipped += 1
+    seconds = time.perf_counter() - start
 
     print("----- resumen -----")
     print(f"Total features: {len(features)}")
     print(f"Insertados: {inserted}")
     print(f"Omitidos (sin lote): {skipped}")
     print(f"Errores: {errors}")
+    print(f"Tiempo: {seconds:.1f}s ({len(items) / seconds if seconds > 0 else 0:.0f} features/s)")
 
 if __name__ == "__main__":
     import argparse
     p = argparse.ArgumentParser()
     p.add_argument("--geojson", "-g", default=GEOJSON_DEFAULT)
+    p.add_argument("--workers", "-w", type=int, default=WORKERS, help="Llamadas RPC simultáneas")
+    p.add_argument("--batch-size", "-b", type=int, default=None,
+                   help="Features por llamada a insert_cultivos_from_geojson (RPC por lotes)")
     args = p.parse_args()
-    main(args.geojson)
+    main(args.geojson, args.workers, args.batch_size)
@@ -2,13 +2,24 @@
 """
 upload_arboles_y_frutos.py
 Sube los árboles del archivo arboles_output.json y sus frutos asociados.
+
+Los estados se resuelven con una sola consulta, las filas se arman en memoria y
+se insertan por bloques (primero todos los árboles, después los frutos). Las
+inserciones ignoran las filas que ya existen, así que si la carga se corta
+basta con volver a ejecutarla: retoma donde quedó sin duplicar. Una fila que la
+base rechaza (tipo, llave foránea...) no detiene la carga: se aísla del resto de
+su bloque y se informa su id.
+
+Uso (desde backend/): python -m src.db.upload_frutos_arbole [--json ruta]
 """
 
 import os
 import json
+import time
 from pathlib import Path
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from src.utils.bulk_writer import bulk_insert
 
 JSON_PATH = r"C:\Users\luisa\Downloads\arboles_output (1).json"
 
@@ -20,41 +31,55 @@ def load_env():
         raise SystemExit("❌ Faltan variables SUPABASE_URL o SUPABASE_SERVICE_ROLE_KEY")
     return create_client(url, key)
 
-def get_estado_id(sb: Client, nombre_estado: str) -> str:
-    """Busca el ID del estado en la tabla estado_cacao"""
-    data = sb.table("estado_cacao").select("estado_cacao_id").eq("nombre", nombre_estado).execute()
-    if not data.data:
-        raise ValueError(f"No se encontró estado_cacao '{nombre_estado}'")
-    return data.data[0]["estado_cacao_id"]
+def load_estados(sb: Client) -> dict:
+    """{nombre: estado_cacao_id} de todos los estados (son pocas filas)."""
+    data = sb.table("estado_cacao").select("estado_cacao_id, nombre").execute()
+    return {e["nombre"]: e["estado_cacao_id"] for e in data.data or []}
 
-def insert_arbol(sb: Client, arbol: dict, estado_id: str):
-    """Inserta un árbol en la tabla arbol"""
-    ubicacion = json.dumps(arbol["ubicacion"])  # GeoJSON como JSONB
-    data = {
-        "arbol_id": arbol["arbol_id"],
-        "cultivo_id": arbol["cultivo_id"],
-        "nombre": arbol["nombre"],
-        "especie": "Cacao",
-        "ubicacion": ubicacion,
-        "estado_cacao_id": estado_id,
-        "estado": True
-    }
-    res = sb.table("arbol").insert(data).execute()
-    return res
+def build_rows(arboles: list, estados: dict):
+    """
+    Filas de arbol y fruto listas para insertar, y los errores de las que no se
+    pueden armar (estado desconocido). Un árbol con error se omite con sus frutos.
+    """
+    arbol_rows, fruto_rows, errores = [], [], []
+    for a in arboles:
+        estado_arbol = a.get("estado_arbol", "Desconocido")
+        if estado_arbol not in estados:
+            errores.append(f"'{a['nombre']}': no se encontró estado_cacao '{estado_arbol}'")
+            continue
+        arbol_rows.append({
+            "arbol_id": a["arbol_id"],
+            "cultivo_id": a["cultivo_id"],
+            "nombre": a["nombre"],
+            "especie": "Cacao",
+            "ubicacion": json.dumps(a["ubicacion"]),  # GeoJSON como JSONB
+            "estado_cacao_id": estados[estado_arbol],
+            "estado": True
+        })
+        for f in a.get("frutos", []):
+            if f["estado_fruto"] not in estados:
+                errores.append(f"fruto {f['fruto_id']} de '{a['nombre']}': no se encontró estado_cacao '{f['estado_fruto']}'")
+                continue
+            fruto_rows.append({
+                "fruto_id": f["fruto_id"],
+                "arbol_id": a["arbol_id"],
+                "especie": f["especie"],
+                "estado_cacao_id": estados[f["estado_fruto"]]
+            })
+    return arbol_rows, fruto_rows, errores
 
-def insert_fruto(sb: Client, fruto: dict, arbol_id: str, estado_id: str):
-    """Inserta un fruto en la tabla fruto"""
-    data = {
-        "fruto_id": fruto["fruto_id"],
-        "arbol_id": arbol_id,
-        "especie": fruto["especie"],
-        "estado_cacao_id": estado_id
-    }
-    return sb.table("fruto").insert(data).execute()
+def insert_rows(sb: Client, table: str, rows: list, key: str):
+    """Inserta rows por bloques; devuelve (filas insertadas, errores de las filas rechazadas por id)."""
+    stats = bulk_insert(table, rows, client=sb, on_conflict=key, raise_errors=False, bisect=True)
+    errores = [
+        f"{table} {row.get(key)}: {fallo['error']}"
+        for fallo in stats["failed"] for row in fallo["rows"]
+    ]
+    return stats["rows"], errores
 
-def main():
+def main(json_path=JSON_PATH):
     sb = load_env()
-    p = Path(JSON_PATH)
+    p = Path(json_path)
     if not p.exists():
         raise SystemExit(f"No se encontró el archivo {p}")
 
@@ -62,31 +87,38 @@ def main():
         arboles = json.load(f)["arboles"]
 
     print(f"🌳 Procesando {len(arboles)} árboles...")
-    inserted_arboles = 0
-    inserted_frutos = 0
-    errores = 0
-
-    for a in arboles:
-        try:
-            estado_arbol = a.get("estado_arbol", "Desconocido")
-            estado_arbol_id = get_estado_id(sb, estado_arbol)
-            insert_arbol(sb, a, estado_arbol_id)
-            inserted_arboles += 1
-            print(f"✅ Árbol insertado: {a['nombre']}")
-
-            for f in a.get("frutos", []):
-                estado_fruto_id = get_estado_id(sb, f["estado_fruto"])
-                insert_fruto(sb, f, a["arbol_id"], estado_fruto_id)
-                inserted_frutos += 1
+    start = time.perf_counter()
+    arbol_rows, fruto_rows, errores = build_rows(arboles, load_estados(sb))
+    for error in errores:
+        print(f"❌ Error con {error}")
 
-        except Exception as e:
-            errores += 1
-            print(f"❌ Error con '{a['nombre']}': {e}")
+    inserted_arboles = inserted_frutos = 0
+    rechazadas = []
+    # Los frutos apuntan a sus árboles: los árboles van primero
+    if arbol_rows:
+        inserted_arboles, fallidas = insert_rows(sb, "arbol", arbol_rows, "arbol_id")
+        rechazadas += fallidas
+    if fruto_rows:
+        inserted_frutos, fallidas = insert_rows(sb, "fruto", fruto_rows, "fruto_id")
+        rechazadas += fallidas
+    for error in rechazadas:
+        print(f"❌ Fila rechazada: {error}")
+    if rechazadas:
+        print("   Corrija esas filas y vuelva a ejecutar el script: las ya insertadas se omiten.")
+    errores += rechazadas
 
+    seconds = time.perf_counter() - start
+    filas = inserted_arboles + inserted_frutos
     print("----- resumen -----")
-    print(f"Árboles insertados: {inserted_arboles}")
-    print(f"Frutos insertados: {inserted_frutos}")
-    print(f"Errores: {errores}")
+    # Incluye las filas que ya existían (se omiten al reanudar)
+    print(f"Árboles cargados: {inserted_arboles}")
+    print(f"Frutos cargados: {inserted_frutos}")
+    print(f"Errores: {len(errores)}")
+    print(f"Tiempo: {seconds:.1f}s ({filas / seconds if seconds > 0 else 0:.0f} filas/s)")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="Sube árboles y frutos desde arboles_output.json.")
+    parser.add_argument("--json", "-j", default=JSON_PATH)
+    args = parser.parse_args()
+    main(args.json)
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
+"""
+Carga lecturas de un feed de ThingSpeak en fruto_metric y actualiza cada fruto
+con su última lectura.
 
+Uso (desde backend/): python -m src.db.upload_readings [--feed ruta] [--workers N]
+"""
 import os
+import sys
 import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from dotenv import load_dotenv
+from supabase import create_client
+from src.utils import reading_store
+from src.utils.bulk_writer import bulk_insert
 
 load_dotenv()  # lee backend/.env
 
@@ -21,14 +33,33 @@ headers = {
     "Prefer": "return=minimal"
 }
 
+FEED_DEFAULT = r"C:\Users\luisa\Documents\Deploy_CocoaApp\backend\src\db\feed.json"
+BATCH_SIZE = 1000   # filas de fruto_metric por POST
+WORKERS = 4         # peticiones de escritura simultáneas
+
+# Una sola sesión: reutiliza las conexiones keep-alive en lugar de abrir una por petición
+session = requests.Session()
+session.headers.update(headers)
+
+def mount_pool(workers):
+    """Ajusta el pool de la sesión a workers conexiones, para que cada worker reutilice la suya."""
+    adapter = HTTPAdapter(pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
 ### --- funciones auxiliares ----
 
-def get_frutos():
-    """Obtiene todos los frutos disponibles en la BD."""
-    url = f"{SUPABASE_URL}/rest/v1/fruto?select=fruto_id"
-    res = requests.get(url, headers=headers)
-    res.raise_for_status()
-    return [row["fruto_id"] for row in res.json()]
+def get_frutos(page_size=1000):
+    """Obtiene todos los frutos disponibles en la BD (por páginas: PostgREST limita max-rows)."""
+    frutos = []
+    while True:
+        url = f"{SUPABASE_URL}/rest/v1/fruto?select=fruto_id&order=fruto_id&limit={page_size}&offset={len(frutos)}"
+        res = session.get(url)
+        res.raise_for_status()
+        page = [row["fruto_id"] for row in res.json()]
+        frutos.extend(page)
+        if len(page) < page_size:
+            return frutos
 
 def get_or_create_estado(nombre):
     """Busca un estado_cacao; si no existe, lo crea."""
@@ -36,20 +67,33 @@ def get_or_create_estado(nombre):
         return None
 
     url = f"{SUPABASE_URL}/rest/v1/estado_cacao?select=estado_cacao_id&nombre=eq.{nombre}"
-    res = requests.get(url, headers=headers)
+    res = session.get(url)
 
     if res.status_code == 200 and res.json():
         return res.json()[0]["estado_cacao_id"]
 
     # crear estado
     payload = {"nombre": nombre, "descripcion": f"Creado automáticamente: {nombre}"}
-    res = requests.post(f"{SUPABASE_URL}/rest/v1/estado_cacao", headers=headers, data=json.dumps(payload))
+    res = session.post(f"{SUPABASE_URL}/rest/v1/estado_cacao", data=json.dumps(payload))
     res.raise_for_status()
 
     # obtener id recién creado
-    res = requests.get(url, headers=headers)
+    res = session.get(url)
     return res.json()[0]["estado_cacao_id"]
 
+def load_estados(nombres):
+    """{nombre: estado_cacao_id} de los nombres dados; trae todos de una vez y crea solo los que faltan."""
+    res = session.get(f"{SUPABASE_URL}/rest/v1/estado_cacao?select=estado_cacao_id,nombre")
+    res.raise_for_status()
+    estados = {e["nombre"]: e["estado_cacao_id"] for e in res.json()}
+    for nombre in sorted(set(nombres) - set(estados) - {None}):
+        payload = {"nombre": nombre, "descripcion": f"Creado automáticamente: {nombre}"}
+        res = session.post(f"{SUPABASE_URL}/rest/v1/estado_cacao", data=json.dumps(payload),
+                           headers={"Prefer": "return=representation"})
+        res.raise_for_status()
+        estados[nombre] = res.json()[0]["estado_cacao_id"]
+    return estados
+
 def voltage_state(v):
     """Regla de clasificación: voltaje -> estado_cacao."""
     if v is None: return None
@@ -59,6 +103,14 @@ def voltage_state(v):
     if 2 <= v < 3: return "Maduro"
     return "Enfermo"
 
+def parse_entry(e):
+    """(raw, voltaje, capacitancia, created_at) de una entrada del feed de ThingSpeak."""
+    raw = float(e["field1"]) if e.get("field1") else None
+    voltaje = float(e["field2"]) if e.get("field2") else None
+    capacitancia = float(e["field3"]) if e.get("field3") else None
+    created_at = e.get("created_at") or datetime.now(timezone.utc).isoformat()
+    return raw, voltaje, capacitancia, created_at
+
 
 def process_entry(fruto_id, raw, voltaje, capacitancia, created_at):
     """Inserta en fruto_metric y actualiza fruto"""
@@ -70,34 +122,88 @@ def process_entry(fruto_id, raw, voltaje, capacitancia, created_at):
         "capacitancia": capacitancia,
         "created_at": created_at
     }
-    requests.post(f"{SUPABASE_URL}/rest/v1/fruto_metric", headers=headers, data=json.dumps(insert_metric))
+    session.post(f"{SUPABASE_URL}/rest/v1/fruto_metric", data=json.dumps(insert_metric))
 
     # 2) Determinar estado por voltaje
     estado = voltage_state(voltaje)
     estado_cacao_id = get_or_create_estado(estado) if estado else None
 
     # 3) Actualizar fruto (última lectura)
+    session.patch(f"{SUPABASE_URL}/rest/v1/fruto?fruto_id=eq.{fruto_id}",
+                  data=json.dumps(fruto_update(insert_metric, estado_cacao_id)))
+    return insert_metric
+
+def fruto_update(lectura, estado_cacao_id):
+    """Cuerpo del PATCH de fruto con su última lectura."""
     update_body = {
-        "raw": raw,
-        "voltaje": voltaje,
-        "capacitancia": capacitancia,
-        "updated_at": created_at
+        "raw": lectura["raw"],
+        "voltaje": lectura["voltaje"],
+        "capacitancia": lectura["capacitancia"],
+        "updated_at": lectura["created_at"]
     }
-
     if estado_cacao_id:
         update_body["estado_cacao_id"] = estado_cacao_id
+    return update_body
 
-    update_url = f"{SUPABASE_URL}/rest/v1/fruto?fruto_id=eq.{fruto_id}"
-    requests.patch(update_url, headers=headers, data=json.dumps(update_body))
+def update_fruto(fruto_id, body):
+    res = session.patch(f"{SUPABASE_URL}/rest/v1/fruto?fruto_id=eq.{fruto_id}", data=json.dumps(body))
+    res.raise_for_status()
+    return 1
+
+def upload_batched(sb, lecturas, batch_size=BATCH_SIZE, workers=WORKERS):
+    """
+    Modo por lotes: fruto_metric con bulk_insert (bloques de a lo sumo
+    batch_size filas, workers a la vez, con reintentos) y después un solo PATCH
+    por fruto con su última lectura escrita; los estados se resuelven una vez.
+    Devuelve (lecturas escritas, frutos actualizados, errores).
+    """
+    stats = bulk_insert("fruto_metric", lecturas, client=sb, max_rows=batch_size,
+                        max_workers=workers, raise_errors=False)
+    errores = len(stats["failed"])
+    for fallo in stats["failed"]:
+        print(f"❌ Error en bloque de {len(fallo['rows'])} lecturas: {fallo['error']}")
+    no_escritas = {id(l) for fallo in stats["failed"] for l in fallo["rows"]}
+    escritas = [l for l in lecturas if id(l) not in no_escritas]
+
+    # Última lectura de cada fruto (por created_at; en empate, la que aparece después)
+    # y, aparte, la última con voltaje: una lectura sin voltaje no cambia el estado,
+    # igual que en el modo por lectura.
+    def es_posterior(lectura, previa):
+        return previa is None or lectura["created_at"] >= previa["created_at"]
+
+    ultimas, con_voltaje = {}, {}
+    for lectura in escritas:
+        fruto_id = lectura["fruto_id"]
+        if es_posterior(lectura, ultimas.get(fruto_id)):
+            ultimas[fruto_id] = lectura
+        if lectura["voltaje"] is not None and es_posterior(lectura, con_voltaje.get(fruto_id)):
+            con_voltaje[fruto_id] = lectura
+    estado_de = {fruto_id: voltage_state(l["voltaje"]) for fruto_id, l in con_voltaje.items()}
+    estados = load_estados(estado_de.values())
+
+    actualizados = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tareas = {
+            pool.submit(update_fruto, fruto_id, fruto_update(lectura, estados.get(estado_de.get(fruto_id)))): fruto_id
+            for fruto_id, lectura in ultimas.items()
+        }
+        for tarea in as_completed(tareas):
+            try:
+                actualizados += tarea.result()
+            except Exception as e:
+                errores += 1
+                print(f"❌ Error en fruto {tareas[tarea]}: {e}")
+    return escritas, actualizados, errores
 
 
 ### --- Script Principal ----
 
-def main():
-    with open(r"C:\Users\luisa\Documents\Deploy_CocoaApp\backend\src\db\feed.json", "r") as f:
+def main(feed_path=FEED_DEFAULT, batch_size=BATCH_SIZE, workers=WORKERS, por_lectura=False):
+    with open(feed_path, "r") as f:
         feed = json.load(f)
 
     entries = feed["feeds"]  # viene así desde ThingSpeak
+    mount_pool(workers)
 
     frutos = get_frutos()
     if not frutos:
@@ -106,20 +212,48 @@ def main():
 
     print(f"🍫 Frutos disponibles: {len(frutos)}")
 
-    for idx, e in enumerate(entries):
-        fruto_id = frutos[idx % len(frutos)]  # round-robin
-
-        raw = float(e["field1"]) if e.get("field1") else None
-        voltaje = float(e["field2"]) if e.get("field2") else None
-        capacitancia = float(e["field3"]) if e.get("field3") else None
-
-        created_at = e.get("created_at") or datetime.now(timezone.utc).isoformat()
-
-        process_entry(fruto_id, raw, voltaje, capacitancia, created_at)
-
-        print(f"✅ Lectura {idx+1}/{len(entries)} asignada a fruto {fruto_id}")
-
+    lecturas = []
+    errores = 0
+    if por_lectura:
+        for idx, e in enumerate(entries):
+            fruto_id = frutos[idx % len(frutos)]  # round-robin
+            lecturas.append(process_entry(fruto_id, *parse_entry(e)))
+            print(f"✅ Lectura {idx+1}/{len(entries)} asignada a fruto {fruto_id}")
+    else:
+        start = time.perf_counter()
+        for idx, e in enumerate(entries):
+            raw, voltaje, capacitancia, created_at = parse_entry(e)
+            lecturas.append({
+                "fruto_id": frutos[idx % len(frutos)],  # round-robin
+                "raw": raw,
+                "voltaje": voltaje,
+                "capacitancia": capacitancia,
+                "created_at": created_at
+            })
+        total = len(lecturas)
+        lecturas, actualizados, errores = upload_batched(
+            create_client(SUPABASE_URL, SERVICE_KEY), lecturas, batch_size, workers)
+        seconds = time.perf_counter() - start
+        print(f"{'❌' if errores else '✅'} {len(lecturas)}/{total} lecturas y {actualizados} frutos actualizados "
+              f"en {seconds:.1f}s ({len(lecturas) / seconds if seconds > 0 else 0:.0f} lecturas/s)")
+        if errores:
+            print(f"⚠️ {errores} escrituras fallaron")
+
+    # Copia al almacén local (solo lo que sí quedó en la base) en un solo segmento por día
+    if reading_store.ENABLED and lecturas:
+        reading_store.append("fruto_metric", lecturas)
+        print(f"📦 {len(lecturas)} lecturas guardadas en el almacén local")
+
+    if errores:
+        sys.exit(1)
     print("\n🎉 Lecturas cargadas y estados actualizados correctamente en Supabase.")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    p = argparse.ArgumentParser(description="Carga lecturas de un feed de ThingSpeak en fruto_metric y fruto.")
+    p.add_argument("--feed", "-f", default=FEED_DEFAULT)
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Filas de fruto_metric por POST")
+    p.add_argument("--workers", type=int, default=WORKERS, help="Escrituras simultáneas")
+    p.add_argument("--por-lectura", action="store_true", help="Modo anterior: cuatro peticiones por lectura")
+    args = p.parse_args()
+    main(args.feed, args.batch_size, args.workers, args.por_lectura)
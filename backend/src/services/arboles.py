@@ -1,67 +1,108 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from src.db import supabase
+from src.utils.response_cache import cached_response
+from src.utils.fanout import fan_out
+from src.utils.single_flight import shared
+from src.utils.tree_offsets import cultivo_centroids, offsets
+from src.utils.spatial_index import FeatureIndex, get_index, parse_bbox, point_bounds
+from src.utils.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from typing import Optional
 import math
 
 router = APIRouter()
 
-def simple_hash(s: str) -> int:
-    """Hash determinístico simple (igual al del frontend)."""
-    h = 0
-    for ch in s:
-        h = (h << 5) - h + ord(ch)
-        h &= 0xFFFFFFFF
-    return abs(h)
-
-def get_offset_from_hash(arbol_id: str, delta: float = 0.0003):
-    """Offset determinístico para dispersar puntos."""
-    h1 = simple_hash(arbol_id)
-    h2 = simple_hash(arbol_id[::-1])  # reverso del string
-    lat_offset = ((h1 % 1000) / 1000 - 0.5) * delta
-    lng_offset = ((h2 % 1000) / 1000 - 0.5) * delta
-    return lat_offset, lng_offset
-
 @router.get("/")
-async def get_arboles():
-    """Obtiene todos los árboles con frutos y completa ubicaciones."""
+async def get_arboles(
+    request: Request,
+    bbox: Optional[str] = Query(None, description="minx,miny,maxx,maxy (lon/lat)"),
+    finca_id: Optional[str] = Query(None),
+    lote_id: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+):
+    """
+    Obtiene todos los árboles con frutos y completa ubicaciones (cacheado).
+    Con bbox, finca_id o lote_id solo se devuelven los árboles de esa zona.
+    Con limit se pagina por arbol_id y se agrega "next_cursor" (?cursor= para la siguiente página).
+    """
+    if bbox is None and finca_id is None and lote_id is None and limit is None:
+        return await cached_response(request, build_arboles)
     try:
-        # 1. Árboles con frutos
-        arboles_res = supabase.rpc("get_arboles_with_frutos").execute()
-        if hasattr(arboles_res, 'error') and arboles_res.error:
-            raise HTTPException(status_code=500, detail=arboles_res.error.message)
-        arboles = arboles_res.data or []
-
-        # 2. Cultivos
-        cultivos_res = supabase.table("cultivo").select("cultivo_id, nombre, poligono").execute()
-        if hasattr(cultivos_res, 'error') and cultivos_res.error:
-            raise HTTPException(status_code=500, detail=cultivos_res.error.message)
-        cultivos = cultivos_res.data or []
-
-        # 3. Estados cacao
-        estados_res = supabase.table("estado_cacao").select("estado_cacao_id, nombre").execute()
-        if hasattr(estados_res, 'error') and estados_res.error:
-            raise HTTPException(status_code=500, detail=estados_res.error.message)
-        estados = {e["estado_cacao_id"]: e["nombre"] for e in estados_res.data or []}
-
-        # 4. Calcular centroides de cultivos
-        centroides_por_cultivo = {}
-        for c in cultivos:
-            try:
-                coords = c["poligono"]["coordinates"][0]
-                xs = [p[0] for p in coords]
-                ys = [p[1] for p in coords]
-                centro = (sum(xs) / len(xs), sum(ys) / len(ys))
-                centroides_por_cultivo[c["cultivo_id"]] = centro
-            except Exception:
-                pass
+        box = parse_bbox(bbox) if bbox is not None else None
+        after = decode_cursor(cursor, 1)[0] if limit is not None and cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    def build():
+        index = get_index("arboles", build_arboles_index)
+        if limit is None:
+            return {"arboles": index.query(box, finca_id, lote_id)}
+        arboles, last = index.page(limit, after, box, finca_id, lote_id)
+        return {"arboles": arboles, "next_cursor": encode_cursor([last]) if last is not None else None}
+
+    # Las consultas filtradas o paginadas salen del índice en memoria; no se cachean
+    return await cached_response(request, build, ttl=0)
+
+
+def build_arboles():
+    """Arma la respuesta de GET /arboles."""
+    return {"arboles": load_arboles()[0]}
+
+
+def build_arboles_index():
+    """Índice espacial de los árboles por ubicación, con el lote y la finca de su cultivo."""
+    arboles, cultivos = load_arboles()
+    zona_por_cultivo = {
+        c["cultivo_id"]: (c.get("lote_id"), (c.get("lote") or {}).get("finca_id"))
+        for c in cultivos
+    }
+    zonas = [zona_por_cultivo.get(a["cultivo_id"], (None, None)) for a in arboles]
+    return FeatureIndex(
+        arboles,
+        [point_bounds(a["ubicacion"]) for a in arboles],
+        [z[0] for z in zonas],
+        [z[1] for z in zonas],
+        keys=[a["arbol_id"] for a in arboles],
+    )
+
+
+def load_arboles():
+    """Consulta árboles, cultivos y estados; devuelve (árboles normalizados, cultivos)."""
+    try:
+        # 1-3. Árboles con frutos, cultivos y estados cacao (consultas independientes, en paralelo;
+        # las mismas lecturas en curso desde otra petición se comparten)
+        respuestas = fan_out({
+            "arboles": shared("rpc:get_arboles_with_frutos", lambda: supabase.rpc("get_arboles_with_frutos").execute()),
+            "cultivos": shared("cultivo:arboles", lambda: supabase.table("cultivo").select("cultivo_id, nombre, poligono, lote_id, lote:lote_id(finca_id)").execute()),
+            "estados": shared("estado_cacao", lambda: supabase.table("estado_cacao").select("estado_cacao_id, nombre").execute()),
+        }, "load_arboles")
+        for res in respuestas.values():
+            if hasattr(res, 'error') and res.error:
+                raise HTTPException(status_code=500, detail=res.error.message)
+        arboles = respuestas["arboles"].data or []
+        cultivos = respuestas["cultivos"].data or []
+        estados = {e["estado_cacao_id"]: e["nombre"] for e in respuestas["estados"].data or []}
+
+        # 4. Centroides de los cultivos con árboles sin ubicación y sus offsets (memorizados)
+        centroides_por_cultivo = cultivo_centroids(
+            cultivos, {a["cultivo_id"] for a in arboles if not a.get("ubicacion")}
+        )
+        sin_ubicacion = [
+            a["arbol_id"] for a in arboles
+            if not a.get("ubicacion") and a["cultivo_id"] in centroides_por_cultivo
+        ]
+        lat_offsets, lng_offsets = offsets(sin_ubicacion, 0.0003)
+        offset_por_arbol = dict(zip(sin_ubicacion, zip(lat_offsets, lng_offsets)))
 
         # 5. Normalizar arboles
         result = []
         for a in arboles:
             ubicacion = a.get("ubicacion")
             if not ubicacion:
-                centro = centroides_por_cultivo.get(a["cultivo_id"])
-                if centro:
-                    lat_offset, lng_offset = get_offset_from_hash(a["arbol_id"], 0.0003)
+                offset = offset_por_arbol.get(a["arbol_id"])
+                if offset:
+                    centro = centroides_por_cultivo[a["cultivo_id"]]
+                    lat_offset, lng_offset = offset
                     ubicacion = {
                         "type": "Point",
                         "coordinates": [centro[0] + lng_offset, centro[1] + lat_offset],
@@ -86,7 +127,9 @@ async def get_arboles():
             })
 
 
-        return {"arboles": result}
+        return result, cultivos
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
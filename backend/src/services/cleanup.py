@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from src.db import supabase
+from src.utils.response_cache import invalidate
 from typing import Dict, Any
 
 router = APIRouter()
@@ -41,6 +42,9 @@ def cleanup_duplicates():
             if hasattr(delete_cultivos_response, 'error') and delete_cultivos_response.error:
                 raise HTTPException(status_code=500, detail=f"Error al eliminar cultivos: {delete_cultivos_response.error}")
             deleted_cultivos = len(cultivos_0)
+
+        if deleted_arboles or deleted_cultivos:
+            invalidate("limpieza de duplicados")
         
         return {
             "status": "success",
@@ -1,12 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from src.db import supabase
+from src.utils.response_cache import cached_response
+from src.utils.simplify import MAX_ZOOM, resolve_tolerance, simplify_geometry
+from typing import Optional
 
 router = APIRouter()
 
 
 @router.get("/") 
-async def get_cultivos():
-    """Obtiene todos los cultivos en formato GeoJSON"""
+async def get_cultivos(
+    request: Request,
+    zoom: Optional[int] = Query(None, ge=0, le=MAX_ZOOM),
+    tolerance: Optional[float] = Query(None, gt=0),
+):
+    """
+    Obtiene todos los cultivos en formato GeoJSON (cacheado).
+    Con zoom o tolerance los polígonos vienen simplificados y cuantizados.
+    """
+    tol = resolve_tolerance(zoom, tolerance)
+    return await cached_response(request, lambda: build_cultivos(tol))
+
+
+def build_cultivos(tolerance=None):
     try:
         response = supabase.table("cultivo").select("cultivo_id, nombre, especie, poligono").execute()
         if hasattr(response, 'error') and response.error:
@@ -15,7 +30,7 @@ async def get_cultivos():
         features = [
             {
                 "type": "Feature",
-                "geometry": c["poligono"],
+                "geometry": simplify_geometry(("cultivo", c["cultivo_id"]), c["poligono"], tolerance),
                 "properties": {
                     "cultivo_id": c["cultivo_id"],
                     "nombre": c["nombre"],
@@ -1,14 +1,25 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from src.utils.supaBaseClient import supabase
-from starlette.concurrency import run_in_threadpool
+from src.utils.response_cache import cached_response
+from src.utils.simplify import MAX_ZOOM, resolve_tolerance, simplify_geometry
+from typing import Optional
 
 router = APIRouter()
 
 
 @router.get("/") 
-async def get_lotes():
+async def get_lotes(
+    request: Request,
+    zoom: Optional[int] = Query(None, ge=0, le=MAX_ZOOM),
+    tolerance: Optional[float] = Query(None, gt=0),
+):
+    tol = resolve_tolerance(zoom, tolerance)
+    return await cached_response(request, lambda: build_lotes(tol))
+
+
+def build_lotes(tolerance=None):
     try:
-        response = await run_in_threadpool(lambda: supabase.rpc("get_lotes_with_estado").execute())
+        response = supabase.rpc("get_lotes_with_estado").execute()
 
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
@@ -20,7 +31,7 @@ async def get_lotes():
             "features": [
                 {
                     "type": "Feature",
-                    "geometry": l["geometry"],
+                    "geometry": simplify_geometry(("lote", l["lote_id"]), l["geometry"], tolerance),
                     "properties": {
                         "lote_id": l["lote_id"],
                         "nombre": l["nombre"],
@@ -1,25 +1,45 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from src.db import supabase
 from starlette.concurrency import run_in_threadpool
+from src.utils.pagination import MAX_PAGE_SIZE, decode_cursor, ordered_page, split_page
 from datetime import datetime
+from typing import Optional
 
 router = APIRouter()
 
 
 @router.get("/") 
-async def get_notifications():
-    """Obtiene todas las notificaciones"""
+async def get_notifications(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+):
+    """
+    Obtiene todas las notificaciones.
+    Con limit pagina de la más reciente a la más antigua y devuelve
+    {"notifications": [...], "next_cursor": ...}; la página siguiente se pide con ?cursor=next_cursor.
+    """
+    # Orden estable: created_at y, para empates, notificacion_id
+    keys = ["created_at", "notificacion_id"]
     try:
-        response = await run_in_threadpool(
-            lambda: supabase.table("notificacion").select("notificacion_id, usuario_id, alerta_id, titulo, mensaje, leida, created_at").execute()
-        )
+        after = decode_cursor(cursor, len(keys)) if limit is not None and cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        query = supabase.table("notificacion").select("notificacion_id, usuario_id, alerta_id, titulo, mensaje, leida, created_at")
+        if limit is not None:
+            query = ordered_page(query, keys, limit, after)
+        response = await run_in_threadpool(query.execute)
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
 
+        rows, next_cursor = response.data or [], None
+        if limit is not None:
+            rows, next_cursor = split_page(rows, limit, keys)
+
         # Transformar los datos para que coincidan con el formato esperado por el frontend
         notifications = []
-        if response.data:
-            for notif in response.data:
+        if rows:
+            for notif in rows:
                 notifications.append({
                     "id": notif["notificacion_id"],
                     "title": notif["titulo"],
@@ -29,6 +49,8 @@ async def get_notifications():
                     "read": notif["leida"]
                 })
         
+        if limit is not None:
+            return {"notifications": notifications, "next_cursor": next_cursor}
         return notifications
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -47,9 +69,7 @@ async def create_notification(notification: dict):
             "leida": False
         }
         
-        response = await run_in_threadpool(
-            lambda: supabase.table("notificacion").insert(notificacion_data).execute()
-        )
+        response = await run_in_threadpool(supabase.table("notificacion").insert(notificacion_data).execute)
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
 
@@ -62,9 +82,7 @@ async def create_test_notification():
     """Crea una notificación de prueba"""
     # Primero, obtener un usuario existente de la base de datos
     try:
-        usuarios_response = await run_in_threadpool(
-            lambda: supabase.table("usuario").select("usuario_id").limit(1).execute()
-        )
+        usuarios_response = await run_in_threadpool(supabase.table("usuario").select("usuario_id").limit(1).execute)
         if hasattr(usuarios_response, 'error') and usuarios_response.error:
             # Si no hay usuarios, crear notificación sin usuario_id
             test_notification = {
@@ -82,9 +100,7 @@ async def create_test_notification():
                 "leida": False
             }
         
-        response = await run_in_threadpool(
-            lambda: supabase.table("notificacion").insert(test_notification).execute()
-        )
+        response = await run_in_threadpool(supabase.table("notificacion").insert(test_notification).execute)
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
 
@@ -98,10 +114,10 @@ async def mark_as_read(notif_id: str):
     """Marca una notificación como leída"""
     try:
         response = await run_in_threadpool(
-            lambda: supabase.table("notificacion")
+            supabase.table("notificacion")
             .update({"leida": True})
             .eq("notificacion_id", notif_id)
-            .execute()
+            .execute
         )
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
@@ -116,10 +132,10 @@ async def mark_all_as_read():
     """Marca todas las notificaciones como leídas"""
     try:
         response = await run_in_threadpool(
-            lambda: supabase.table("notificacion")
+            supabase.table("notificacion")
             .update({"leida": True})
             .eq("leida", False)
-            .execute()
+            .execute
         )
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
@@ -133,9 +149,7 @@ async def mark_all_as_read():
 async def delete_notification(notif_id: str):
     """Elimina una notificación"""
     try:
-        response = await run_in_threadpool(
-            lambda: supabase.table("notificacion").delete().eq("notificacion_id", notif_id).execute()
-        )
+        response = await run_in_threadpool(supabase.table("notificacion").delete().eq("notificacion_id", notif_id).execute)
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
 
@@ -1,7 +1,19 @@
 from fastapi import APIRouter, HTTPException, Query
 from src.db import supabase
 from starlette.concurrency import run_in_threadpool
+from src.utils.pagination import (
+    MAX_PAGE_SIZE, POSTGREST_MAX_ROWS, decode_cursor, keyset_after, ordered_page, split_page,
+)
+from src.utils.fieldsets import parse_fieldset
+from src.utils.single_flight import do_async
+from src.utils.fanout import fan_out
+from src.utils.timeseries import bucket_stats, lttb, parse_bucket, series_arrays
+from src.utils import reading_store
 from typing import Optional
+from datetime import datetime
+from functools import partial
+import numpy as np
+import asyncio
 
 router = APIRouter()
 
@@ -13,9 +25,7 @@ router = APIRouter()
 async def get_fincas_list():
     """Obtiene lista simple de fincas para filtros"""
     try:
-        response = await run_in_threadpool(
-            lambda: supabase.table("finca").select("finca_id, nombre").execute()
-        )
+        response = await run_in_threadpool(supabase.table("finca").select("finca_id, nombre").execute)
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
         return response.data or []
@@ -33,10 +43,10 @@ async def get_lotes_by_finca(finca_id: str = Query(...)):
     try:
         finca_id = finca_id.strip().strip("/")
         response = await run_in_threadpool(
-            lambda: supabase.table("lote")
+            supabase.table("lote")
             .select("lote_id, nombre")
             .eq("finca_id", finca_id)
-            .execute()
+            .execute
         )
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
@@ -51,94 +61,193 @@ async def get_lotes_by_finca(finca_id: str = Query(...)):
 
 # === Funciones auxiliares ===
 
-def contar_estados(fincas: list) -> dict:
-    """Cuenta los estados de frutos de toda la jerarquía"""
-    conteo = {}
-
-    def recorrer(e):
-        if isinstance(e, dict):
-            # Fruto con estado - buscar en estado_cacao o estado_cacao_id
-            if "fruto_id" in e:
-                estado_cacao = e.get("estado_cacao")
-                if estado_cacao and isinstance(estado_cacao, dict):
-                    # Si viene como objeto relacionado
-                    estado_nombre = estado_cacao.get("nombre", "Desconocido")
-                elif e.get("estado_cacao_id"):
-                    # Si solo viene el ID, usar "Desconocido" temporalmente
-                    estado_nombre = "Desconocido"
-                else:
-                    estado_nombre = "Desconocido"
-                conteo[estado_nombre] = conteo.get(estado_nombre, 0) + 1
-
-            # Recorre todos los subniveles: lote, cultivo, arbol, fruto
-            for k, v in e.items():
-                if isinstance(v, (list, dict)):
-                    recorrer(v)
-
-        elif isinstance(e, list):
-            for i in e:
-                recorrer(i)
-
-    for finca in fincas:
-        recorrer(finca)
-
-    return conteo
-
-
-def contar_estructura(fincas: list) -> dict:
-    """Cuenta todos los niveles de jerarquía"""
-    counts = {"fincas": len(fincas), "lotes": 0, "cultivos": 0, "arboles": 0, "frutos": 0}
-
-    for finca in fincas:
-        lotes = finca.get("lotes", [])
-        counts["lotes"] += len(lotes)
-        for lote in lotes:
-            cultivos = lote.get("cultivos", [])
-            counts["cultivos"] += len(cultivos)
-            for cultivo in cultivos:
-                arboles = cultivo.get("arboles", [])
-                counts["arboles"] += len(arboles)
-                for arbol in arboles:
-                    frutos = arbol.get("frutos", [])
-                    counts["frutos"] += len(frutos)
-
-    return counts
+# Niveles contados con count=exact cuando la base no tiene stats_conteos:
+# (tabla, select con los joins !inner hasta la finca, columna de finca, columna de lote)
+NIVELES = {
+    "lotes": ("lote", "lote_id", "finca_id", "lote_id"),
+    "cultivos": (
+        "cultivo",
+        "cultivo_id, lote!cultivo_lote_id_fkey!inner(finca_id)",
+        "lote.finca_id",
+        "lote_id",
+    ),
+    "arboles": (
+        "arbol",
+        "arbol_id, cultivo!arbol_cultivo_id_fkey!inner(lote_id, lote!cultivo_lote_id_fkey!inner(finca_id))",
+        "cultivo.lote.finca_id",
+        "cultivo.lote_id",
+    ),
+    "frutos": (
+        "fruto",
+        "fruto_id, arbol!fruto_arbol_id_fkey!inner(cultivo!arbol_cultivo_id_fkey!inner("
+        "lote_id, lote!cultivo_lote_id_fkey!inner(finca_id)))",
+        "arbol.cultivo.lote.finca_id",
+        "arbol.cultivo.lote_id",
+    ),
+}
+
+
+def contar(tabla: str, columnas: str, filtros: list) -> int:
+    """Cuenta filas en la base (count=exact) sin descargarlas"""
+    query = supabase.table(tabla).select(columnas, count="exact")
+    for columna, valor in filtros:
+        query = query.eq(columna, valor)
+    response = query.limit(1).execute()
+    if hasattr(response, 'error') and response.error:
+        raise HTTPException(status_code=500, detail=response.error.message)
+    return response.count or 0
+
+
+def contar_sin_funcion(finca_id: Optional[str] = None, lote_id: Optional[str] = None) -> list:
+    """
+    Los mismos conteos que contar_por_finca sin stats_conteos: count=exact por
+    finca, nivel y estado de fruto, en paralelo.
+    """
+    fincas_query = supabase.table("finca").select("finca_id, nombre")
+    if finca_id:
+        fincas_query = fincas_query.eq("finca_id", finca_id)
+    respuestas = fan_out({
+        "fincas": fincas_query.execute,
+        "estados": supabase.table("estado_cacao").select("estado_cacao_id, nombre").execute,
+    })
+    for res in respuestas.values():
+        if hasattr(res, 'error') and res.error:
+            raise HTTPException(status_code=500, detail=res.error.message)
+    fincas = respuestas["fincas"].data or []
+    estados = respuestas["estados"].data or []
+
+    consultas = {}
+    for f in fincas:
+        for nivel, (tabla, columnas, col_finca, col_lote) in NIVELES.items():
+            filtros = [(col_finca, f["finca_id"])] + ([(col_lote, lote_id)] if lote_id else [])
+            consultas[f"{f['finca_id']}:{nivel}"] = partial(contar, tabla, columnas, filtros)
+            if nivel == "frutos":
+                for e in estados:
+                    consultas[f"{f['finca_id']}:{e['estado_cacao_id']}"] = partial(
+                        contar, tabla, columnas, filtros + [("estado_cacao_id", e["estado_cacao_id"])]
+                    )
+    conteos = fan_out(consultas)
+
+    resultado = []
+    for f in fincas:
+        estructura = {"fincas": 1, **{nivel: conteos[f"{f['finca_id']}:{nivel}"] for nivel in NIVELES}}
+        conteo = {}
+        for e in estados:
+            n = conteos[f"{f['finca_id']}:{e['estado_cacao_id']}"]
+            if n:
+                conteo[e["nombre"]] = conteo.get(e["nombre"], 0) + n
+        # Frutos sin estado
+        sin_estado = estructura["frutos"] - sum(conteo.values())
+        if sin_estado:
+            conteo["Desconocido"] = sin_estado
+        resultado.append({"finca_id": f["finca_id"], "nombre": f["nombre"], "conteo": conteo, "estructura": estructura})
+    return resultado
+
+
+def contar_por_finca(finca_id: Optional[str] = None, lote_id: Optional[str] = None) -> list:
+    """
+    Conteos de la jerarquía por finca en una sola consulta: la función
+    stats_conteos (src/db/stats_conteos.sql) agrupa por finca y estado de fruto.
+    Si la función no existe en la base se cuenta con contar_sin_funcion.
+    Devuelve [{"finca_id", "nombre", "conteo", "estructura"}]; los frutos sin
+    estado cuentan como 'Desconocido'.
+    """
+    try:
+        response = supabase.rpc("stats_conteos", {"p_finca_id": finca_id, "p_lote_id": lote_id}).execute()
+    except Exception as e:
+        if "PGRST202" not in str(e) and "Could not find the function" not in str(e):
+            raise
+        print("⚠️ stats_conteos no disponible; se usan consultas count=exact por finca")
+        return contar_sin_funcion(finca_id, lote_id)
+    if hasattr(response, 'error') and response.error:
+        raise HTTPException(status_code=500, detail=response.error.message)
+
+    fincas = {}
+    for row in response.data or []:
+        finca = fincas.get(row["finca_id"])
+        if finca is None:
+            finca = fincas[row["finca_id"]] = {
+                "finca_id": row["finca_id"],
+                "nombre": row["nombre"],
+                "conteo": {},
+                "estructura": {
+                    "fincas": 1,
+                    **{nivel: row[nivel] for nivel in ("lotes", "cultivos", "arboles", "frutos")},
+                },
+            }
+        if row["estado"] and row["frutos_estado"]:
+            conteo = finca["conteo"]
+            conteo[row["estado"]] = conteo.get(row["estado"], 0) + row["frutos_estado"]
+    for finca in fincas.values():
+        # Frutos sin estado
+        sin_estado = finca["estructura"]["frutos"] - sum(finca["conteo"].values())
+        if sin_estado:
+            finca["conteo"]["Desconocido"] = sin_estado
+    return list(fincas.values())
+
+
+def sumar(dicts: list, base: dict) -> dict:
+    """Suma por clave una lista de conteos"""
+    total = dict(base)
+    for d in dicts:
+        for k, v in d.items():
+            total[k] = total.get(k, 0) + v
+    return total
+
+
+# Jerarquía finca -> lotes -> cultivos -> árboles -> frutos (con su estado)
+JERARQUIA_SELECT = """
+    finca_id,
+    nombre,
+    created_at,
+    lotes:lote!lote_finca_id_fkey (
+        lote_id,
+        nombre,
+        cultivos:cultivo!cultivo_lote_id_fkey (
+            cultivo_id,
+            nombre,
+            arboles:arbol!arbol_cultivo_id_fkey (
+                arbol_id,
+                nombre,
+                especie,
+                frutos:fruto!fruto_arbol_id_fkey (
+                    fruto_id,
+                    especie,
+                    created_at,
+                    estado_cacao_id,
+                    estado_cacao!fruto_estado_cacao_id_fkey (
+                        estado_cacao_id,
+                        nombre
+                    )
+                )
+            )
+        )
+    )
+"""
+
+
+async def consultar_jerarquia(finca_id=None, lote_id=None):
+    """
+    Fincas con lotes, cultivos, árboles y frutos (filtrable por finca y lote).
+    Las peticiones simultáneas con los mismos filtros comparten una sola consulta.
+    """
+    def consultar():
+        query = supabase.table("finca").select(JERARQUIA_SELECT)
+        # Aplicar filtros de finca y lote en la base
+        if finca_id:
+            query = query.eq("finca_id", finca_id)
+        if lote_id:
+            query = query.eq("lotes.lote_id", lote_id)
+        return run_in_threadpool(query.execute)
+
+    return await do_async(("jerarquia", finca_id, lote_id), consultar)
 
 
 @router.get("/zones/")
 async def get_zones_hierarchy():
     """Obtiene jerarquía completa para el mapa de zonas"""
     try:
-        response = await run_in_threadpool(
-            lambda: supabase.table("finca").select("""
-                finca_id,
-                nombre,
-                created_at,
-                lotes:lote!lote_finca_id_fkey (
-                    lote_id,
-                    nombre,
-                    cultivos:cultivo!cultivo_lote_id_fkey (
-                        cultivo_id,
-                        nombre,
-                        arboles:arbol!arbol_cultivo_id_fkey (
-                            arbol_id,
-                            nombre,
-                            especie,
-                            frutos:fruto!fruto_arbol_id_fkey (
-                                fruto_id,
-                                especie,
-                                created_at,
-                                estado_cacao_id,
-                                estado_cacao!fruto_estado_cacao_id_fkey (
-                                    estado_cacao_id,
-                                    nombre
-                                )
-                            )
-                        )
-                    )
-                )
-            """).execute()
-        )
+        response = await consultar_jerarquia()
 
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
@@ -148,110 +257,246 @@ async def get_zones_hierarchy():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/metrics/{arbol_id}/")
-async def get_arbol_metrics(arbol_id: str):
-    """Obtiene métricas de un árbol específico"""
-    try:
-        response = await run_in_threadpool(
-            lambda: supabase.table("metrics")
+# Columnas numéricas de la tabla metrics
+METRIC_COLUMNS = ("raw", "voltaje", "capacitancia")
+LTTB_POINTS = 600
+
+
+def ventana(query, desde=None, hasta=None):
+    """Filtra query a created_at en [desde, hasta)."""
+    if desde is not None:
+        query = query.gte("created_at", desde.isoformat())
+    if hasta is not None:
+        query = query.lt("created_at", hasta.isoformat())
+    return query
+
+
+def descargar_ventana(arbol_id, desde=None, hasta=None, page_size=POSTGREST_MAX_ROWS):
+    """
+    Todas las métricas del árbol en la ventana, en orden cronológico. Pagina por
+    clave (created_at, metric_id) y sigue mientras las páginas lleguen llenas,
+    como select_all: no depende de una fila extra que max-rows recortaría.
+    """
+    keys = ["created_at", "metric_id"]
+    rows, after = [], None
+    while True:
+        query = ventana(
+            supabase.table("metrics")
             .select("metric_id, raw, voltaje, capacitancia, created_at")
-            .eq("arbol_id", arbol_id)
-            .order("created_at", ascending=False)
-            .execute()
+            .eq("arbol_id", arbol_id),
+            desde, hasta,
         )
+        if after is not None:
+            query = keyset_after(query, keys, after, desc=False)
+        for key in keys:
+            query = query.order(key)
+        response = query.limit(page_size).execute()
         if hasattr(response, 'error') and response.error:
             raise HTTPException(status_code=500, detail=response.error.message)
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        after = [page[-1][k] for k in keys]
+
+
+def leer_serie(arbol_id, desde=None, hasta=None):
+    """
+    (tiempos en ns, {columna: valores}, filas(índices), total) de las métricas del
+    árbol en la ventana: del almacén local si está activo, si no de Supabase.
+    """
+    if reading_store.ENABLED:
+        table = reading_store.scan("metrics", arbol_id, desde, hasta)
+        t, values = reading_store.series(table)
+        return t, values, lambda idx: reading_store.rows(table, idx), table.num_rows
+    rows = descargar_ventana(arbol_id, desde, hasta)
+    t, values, order = series_arrays(rows, METRIC_COLUMNS)
+    return t, values, lambda idx: [rows[i] for i in order[idx]], len(rows)
+
+
+def reducir_metricas(arbol_id, desde=None, hasta=None, bucket=None, y="raw", points=LTTB_POINTS):
+    """Con bucket (segundos): estadísticas por intervalo; sin bucket: puntos elegidos por LTTB."""
+    t, values, filas, total = leer_serie(arbol_id, desde, hasta)
+    if bucket is not None:
+        return {"bucket": bucket, "total": total, "buckets": bucket_stats(t, values, bucket)}
+    # LTTB sobre las lecturas que tienen valor en la columna y
+    valid = np.flatnonzero(~np.isnan(values[y]))
+    x = (t[valid] - (t[valid[0]] if len(valid) else 0)) / 1e9
+    chosen = valid[lttb(x, values[y][valid], points)]
+    return {"mode": "lttb", "y": y, "total": total, "points": filas(chosen)}
 
-        return response.data or []
+
+@router.get("/metrics/{arbol_id}/")
+async def get_arbol_metrics(
+    arbol_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    desde: Optional[datetime] = Query(None, alias="from"),
+    hasta: Optional[datetime] = Query(None, alias="to"),
+    bucket: Optional[str] = Query(None, description="Intervalo de agregación: 30s, 5m, 1h, 1d..."),
+    mode: Optional[str] = Query(None, description="lttb para submuestrear la serie"),
+    y: str = Query("raw", description="Columna que guía el LTTB: raw, voltaje o capacitancia"),
+    points: int = Query(LTTB_POINTS, ge=3, le=10000),
+):
+    """
+    Obtiene métricas de un árbol específico, de la más reciente a la más antigua.
+    Con limit devuelve {"metrics": [...], "next_cursor": ...}; la página siguiente
+    se pide con ?cursor=next_cursor. from/to limitan la ventana [from, to).
+    Con bucket devuelve count y min/max/mean por intervalo; con mode=lttb,
+    a lo sumo points lecturas elegidas con LTTB, en orden cronológico.
+    """
+    if bucket is not None or mode is not None:
+        try:
+            if mode is not None and mode != "lttb":
+                raise ValueError("mode solo admite lttb")
+            if bucket is not None and mode is not None:
+                raise ValueError("use bucket o mode=lttb, no ambos")
+            if limit is not None or cursor is not None:
+                raise ValueError("bucket y mode no admiten limit ni cursor")
+            if y not in METRIC_COLUMNS:
+                raise ValueError(f"y debe ser una de: {', '.join(METRIC_COLUMNS)}")
+            segundos = parse_bucket(bucket) if bucket is not None else None
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        try:
+            try:
+                reducido = await run_in_threadpool(reducir_metricas, arbol_id, desde, hasta, segundos, y, points)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            return {
+                "arbol_id": arbol_id,
+                "from": desde.isoformat() if desde else None,
+                "to": hasta.isoformat() if hasta else None,
+                **reducido,
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    if limit is None and reading_store.ENABLED:
+        try:
+            table = await run_in_threadpool(reading_store.scan, "metrics", arbol_id, desde, hasta)
+            return [
+                {k: row[k] for k in ("metric_id", "raw", "voltaje", "capacitancia", "created_at")}
+                for row in reversed(await run_in_threadpool(reading_store.rows, table))
+            ]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    if limit is None:
+        try:
+            response = await run_in_threadpool(
+                ventana(
+                    supabase.table("metrics")
+                    .select("metric_id, raw, voltaje, capacitancia, created_at")
+                    .eq("arbol_id", arbol_id),
+                    desde, hasta,
+                )
+                .order("created_at", desc=True)
+                .execute
+            )
+            if hasattr(response, 'error') and response.error:
+                raise HTTPException(status_code=500, detail=response.error.message)
+
+            return response.data or []
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    # Orden estable: created_at y, para empates, metric_id
+    keys = ["created_at", "metric_id"]
+    try:
+        after = decode_cursor(cursor, len(keys)) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        response = await run_in_threadpool(ordered_page(
+            ventana(
+                supabase.table("metrics")
+                .select("metric_id, raw, voltaje, capacitancia, created_at")
+                .eq("arbol_id", arbol_id),
+                desde, hasta,
+            ),
+            keys, limit, after,
+        ).execute)
+        if hasattr(response, 'error') and response.error:
+            raise HTTPException(status_code=500, detail=response.error.message)
+
+        metrics, next_cursor = split_page(response.data or [], limit, keys)
+        return {"metrics": metrics, "next_cursor": next_cursor}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # src/routes/stats.py
 
+# Partes de la respuesta de /stats que se pueden pedir con ?include=
+SECCIONES = ("resumen_general", "por_finca", "fincas")
+RESUMEN = {"resumen_general", "por_finca"}
+
+
 @router.get("/")
 async def get_stats(
     finca_id: Optional[str] = Query(None),
-    lote_id: Optional[str] = Query(None)
+    lote_id: Optional[str] = Query(None),
+    include: Optional[str] = Query(None, description="Partes a devolver: resumen_general,por_finca,fincas"),
+    summary: bool = Query(False, description="Solo resumen_general y por_finca"),
 ):
-    """Obtiene estadísticas completas con filtros opcionales"""
+    """
+    Obtiene estadísticas completas con filtros opcionales.
+    Los conteos se calculan en la base con una consulta agrupada (stats_conteos).
+    Con include (o summary=true) solo se consultan y devuelven las partes pedidas;
+    sin "fincas" no se descarga el árbol completo de la jerarquía.
+    """
     try:
-        # Construir query dentro del lambda para evitar problemas de closure
-        def build_and_execute_query():
-            query = supabase.table("finca").select("""
-                finca_id,
-                nombre,
-                created_at,
-                lotes:lote!lote_finca_id_fkey (
-                    lote_id,
-                    nombre,
-                    cultivos:cultivo!cultivo_lote_id_fkey (
-                        cultivo_id,
-                        nombre,
-                        arboles:arbol!arbol_cultivo_id_fkey (
-                            arbol_id,
-                            nombre,
-                            especie,
-                            frutos:fruto!fruto_arbol_id_fkey (
-                                fruto_id,
-                                especie,
-                                created_at,
-                                estado_cacao_id,
-                                estado_cacao!fruto_estado_cacao_id_fkey (
-                                    estado_cacao_id,
-                                    nombre
-                                )
-                            )
-                        )
-                    )
-                )
-            """)
-            
-            # Aplicar filtro de finca si existe
-            if finca_id:
-                query = query.eq("finca_id", finca_id)
-            
-            return query.execute()
+        secciones = parse_fieldset(include, SECCIONES)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if secciones is None:
+        secciones = set(RESUMEN) if summary else set(SECCIONES)
+    elif summary:
+        secciones &= RESUMEN
+        if not secciones:
+            raise HTTPException(status_code=422, detail="summary=true solo admite resumen_general y por_finca")
 
-        response = await run_in_threadpool(build_and_execute_query)
-
-        if hasattr(response, "error") and response.error:
-            error_msg = response.error.message if hasattr(response.error, 'message') else str(response.error)
-            import sys
-            print(f"ERROR Supabase en /stats/: {error_msg}", file=sys.stderr)
-            raise HTTPException(status_code=500, detail=error_msg)
-
-        fincas = response.data or []
-
-        # Filtrar lote si se especifica
-        if lote_id:
-            for finca in fincas:
-                finca["lotes"] = [l for l in finca.get("lotes", []) if l["lote_id"] == lote_id]
-
-        # Calcular estadísticas
-        conteo_general = contar_estados(fincas)
-        estructura_general = contar_estructura(fincas)
-
-        # Estadísticas por finca
-        stats_por_finca = []
-        for finca in fincas:
-            conteo_finca = contar_estados([finca])
-            estructura_finca = contar_estructura([finca])
-            stats_por_finca.append({
-                "finca_id": finca["finca_id"],
-                "nombre": finca["nombre"],
-                "conteo": conteo_finca,
-                "estructura": estructura_finca,
-            })
-
-        return {
-            "resumen_general": {
-                "conteo": conteo_general,
-                "estructura": estructura_general,
-            },
-            "por_finca": stats_por_finca,
-            "fincas": fincas,
-        }
+    try:
+        # Solo se lanzan las consultas de las partes pedidas
+        consultas = {}
+        if "fincas" in secciones:
+            # Árbol completo de la jerarquía (solo para la clave "fincas" de la respuesta)
+            consultas["fincas"] = consultar_jerarquia(finca_id, lote_id)
+        if secciones & RESUMEN:
+            # Conteos agregados por finca: no dependen del número de frutos descargados
+            consultas["conteos"] = do_async(
+                ("stats.conteos", finca_id, lote_id), lambda: run_in_threadpool(contar_por_finca, finca_id, lote_id)
+            )
+        resultados = dict(zip(consultas, await asyncio.gather(*consultas.values())))
+
+        resultado = {}
+        if "conteos" in resultados:
+            stats_por_finca = resultados["conteos"]
+            if "resumen_general" in secciones:
+                # Resumen general = suma de las fincas
+                resultado["resumen_general"] = {
+                    "conteo": sumar([f["conteo"] for f in stats_por_finca], {}),
+                    "estructura": sumar(
+                        [f["estructura"] for f in stats_por_finca],
+                        {"fincas": 0, "lotes": 0, "cultivos": 0, "arboles": 0, "frutos": 0},
+                    ),
+                }
+            if "por_finca" in secciones:
+                resultado["por_finca"] = stats_por_finca
+
+        if "fincas" in resultados:
+            response = resultados["fincas"]
+            if hasattr(response, "error") and response.error:
+                error_msg = response.error.message if hasattr(response.error, 'message') else str(response.error)
+                import sys
+                print(f"ERROR Supabase en /stats/: {error_msg}", file=sys.stderr)
+                raise HTTPException(status_code=500, detail=error_msg)
+            resultado["fincas"] = response.data or []
+
+        return resultado
 
     except HTTPException:
         raise
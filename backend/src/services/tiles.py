@@ -0,0 +1,44 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+from src.services.cultivos import build_cultivos
+from src.services.lotes import build_lotes
+from src.utils.geojson_stream import COMPRESS_MIN_BYTES, compress, negotiate_encoding
+from src.utils.response_cache import _not_modified, _representation_etag
+from src.utils.vector_tiles import register_layer, has_layer, valid_tile, get_tile
+import hashlib
+
+router = APIRouter()
+
+# Capas disponibles: mismas FeatureCollections que GET /lotes y GET /cultivos
+register_layer("lotes", build_lotes)
+register_layer("cultivos", build_cultivos)
+
+
+@router.get("/{layer}/{z}/{x}/{y}.mvt")
+async def get_vector_tile(layer: str, z: int, x: int, y: int, request: Request):
+    """Tesela vectorial (MVT) de lotes o cultivos, recortada y simplificada para el zoom z"""
+    if not has_layer(layer):
+        raise HTTPException(status_code=404, detail="Capa no encontrada")
+    if not valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tesela fuera de rango")
+    try:
+        tile = await run_in_threadpool(get_tile, layer, z, x, y)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Mismas reglas que las respuestas cacheadas: un ETag fuerte por codificación
+    entry = {"etag": '"' + hashlib.sha1(tile).hexdigest() + '"', "last_modified": None}
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if len(tile) < COMPRESS_MIN_BYTES:
+        encoding = None
+    headers = {
+        "ETag": _representation_etag(entry["etag"], encoding),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        tile = compress(tile, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=tile, media_type="application/vnd.mapbox-vector-tile", headers=headers)
@@ -1,19 +1,104 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from src.utils.cluster import process_new_file
+from src.utils.jobs import submit_job, get_job
+from src.utils.telemetry_stream import TelemetryStreamParser, stream_format
 from src.db.models import Metrics
 from typing import List
 
 router = APIRouter()
 
+
+def accepted_job(telemetry, count, incremental):
+    #Encola el clustering y responde 202 con la URL de estado.
+    job = submit_job(process_new_file, telemetry, incremental=incremental, count=count)
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "job_id": job["job_id"],
+        "count": count,
+        "status_url": f"/update_clusters/jobs/{job['job_id']}",
+    })
+
+
+def update_response(resumen, count):
+    response = {"status": "ok", "count": count, "message": "Base de datos actualizada correctamente"}
+    if resumen:
+        response["clusters"] = resumen
+    return response
+
+
 # Routers
 @router.post("/")
-def update(metrics:List[Metrics]):
+def update(
+    metrics: List[Metrics],
+    incremental: bool = Query(False),
+    async_job: bool = Query(False, alias="async"),
+):
+    """
+    Procesa un lote de lecturas. Con ?async=true responde 202 con el id del trabajo
+    y el clustering corre en segundo plano (consultar /update_clusters/jobs/{id}).
+    """
+    if not metrics:
+        raise HTTPException(status_code=422, detail="El lote de métricas está vacío")
     try:
         metrics_list = [m.model_dump() for m in metrics]
 
+        if async_job:
+            return accepted_job(metrics_list, len(metrics_list), incremental)
+
         # Procesar clustering e inserción
-        process_new_file(metrics_list)
+        resumen = process_new_file(metrics_list, incremental=incremental)
+        return update_response(resumen, len(metrics_list))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/stream")
+async def update_stream(
+    request: Request,
+    incremental: bool = Query(False),
+    async_job: bool = Query(False, alias="async"),
+):
+    """
+    Igual que POST /update_clusters/ pero el cuerpo es NDJSON (application/x-ndjson)
+    o CSV (text/csv) y se procesa por bloques mientras llega, sin cargar todo el
+    JSON en memoria. Columnas: longitude, latitude, raw, voltaje, capacitancia.
+    """
+    fmt = stream_format(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Content-Type debe ser application/x-ndjson o text/csv")
 
-        return {"status": "ok", "count": len(metrics_list), "message": "Base de datos actualizada correctamente"}
+    parser = TelemetryStreamParser(fmt)
+    try:
+        async for chunk in request.stream():
+            parser.feed(chunk)
+            if parser.pending():
+                await run_in_threadpool(parser.parse_pending)
+        df = await run_in_threadpool(parser.close)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo {fmt} inválido: {e}")
+
+    if df.empty:
+        raise HTTPException(status_code=422, detail="El lote de métricas está vacío")
+    invalid = int(df[["longitude", "latitude"]].isna().any(axis=1).sum())
+    if invalid:
+        raise HTTPException(status_code=422, detail=f"{invalid} lecturas sin longitude/latitude")
+
+    try:
+        if async_job:
+            return accepted_job(df, len(df), incremental)
+
+        resumen = await run_in_threadpool(process_new_file, df, incremental=incremental)
+        return update_response(resumen, len(df))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/jobs/{job_id}")
+def get_update_job(job_id: str):
+    """Estado de un trabajo de clustering: etapa, progreso, tiempos y resultado"""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
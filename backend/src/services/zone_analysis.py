@@ -1,48 +1,109 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from src.db import supabase
-from typing import Dict, Any, List
+from src.utils.response_cache import cached_response
+from src.utils.simplify import MAX_ZOOM, resolve_tolerance, simplify_geometry
+from src.utils.spatial_index import FeatureIndex, geometry_bounds, get_index, parse_bbox, point_bounds
+from src.utils.fieldsets import parse_fieldset
+from src.utils.fanout import fan_out
+from src.utils.single_flight import shared
+from typing import Dict, Any, List, Optional
 import json
+from collections import Counter
 
 router = APIRouter()
 
+# Partes de la respuesta (?include=) y propiedades de las features (?fields=)
+SECCIONES = ("geojson", "stats", "notifications")
+RESUMEN = {"stats", "notifications"}
+CAMPOS = ("arbol_id", "nombre", "estado_arbol", "frutos", "cultivo_id", "lote")
+
 @router.get("/")
-def get_zone_analysis():
+async def get_zone_analysis(
+    request: Request,
+    zoom: Optional[int] = Query(None, ge=0, le=MAX_ZOOM),
+    tolerance: Optional[float] = Query(None, gt=0),
+    bbox: Optional[str] = Query(None, description="minx,miny,maxx,maxy (lon/lat)"),
+    finca_id: Optional[str] = Query(None),
+    lote_id: Optional[str] = Query(None),
+    include: Optional[str] = Query(None, description="Partes a devolver: geojson,stats,notifications"),
+    fields: Optional[str] = Query(None, description="Propiedades de las features, p. ej. arbol_id,nombre"),
+    summary: bool = Query(False, description="Solo stats y notifications, sin GeoJSON"),
+):
     """
-    Análisis de zonas con datos GeoJSON y generación de notificaciones
+    Análisis de zonas con datos GeoJSON y generación de notificaciones (cacheado).
+    Con zoom o tolerance los polígonos de cultivos vienen simplificados y cuantizados.
+    Con bbox, finca_id o lote_id solo se devuelven las features de esa zona.
+    Con include / summary=true solo se arman las partes pedidas y con fields las
+    features llevan solo esas propiedades (además de "tipo").
     """
+    tol = resolve_tolerance(zoom, tolerance)
     try:
-        # Obtener árboles activos con frutos usando RPC
-        arboles_response = supabase.rpc("get_arboles_with_frutos").execute()
-        
-        if hasattr(arboles_response, 'error') and arboles_response.error:
-            raise HTTPException(status_code=500, detail=f"Error al obtener árboles: {arboles_response.error}")
-        
-        arboles_data = arboles_response.data or []
+        secciones = parse_fieldset(include, SECCIONES)
+        campos = parse_fieldset(fields, CAMPOS, "fields")
+        box = parse_bbox(bbox) if bbox is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if secciones is None:
+        secciones = set(RESUMEN) if summary else set(SECCIONES)
+    elif summary:
+        secciones &= RESUMEN
+        if not secciones:
+            raise HTTPException(status_code=422, detail="summary=true solo admite stats y notifications")
 
-        # Obtener cultivos activos
-        cultivos_response = supabase.table("cultivo").select("""
-            cultivo_id,
-            nombre,
-            poligono,
-            lote_id,
-            lote:lote_id (
-                lote_id,
+    def compute():
+        return build_zone_analysis(tol, box, finca_id, lote_id, secciones, campos)
+
+    if bbox is None and finca_id is None and lote_id is None:
+        return await cached_response(request, compute)
+    # Las consultas filtradas salen del índice espacial en memoria; no se cachean
+    return await cached_response(request, compute, ttl=0)
+
+
+def load_zone_features():
+    """
+    Consulta árboles, cultivos y estados. Devuelve (features de árboles,
+    features de cultivos, {cultivo_id: (lote_id, finca_id)}).
+    """
+    try:
+        # Cultivos activos con su lote y finca
+        def consultar_cultivos():
+            return supabase.table("cultivo").select("""
+                cultivo_id,
                 nombre,
-                finca_id,
-                finca:finca_id (
+                poligono,
+                lote_id,
+                lote:lote_id (
+                    lote_id,
+                    nombre,
                     finca_id,
-                    nombre
+                    finca:finca_id (
+                        finca_id,
+                        nombre
+                    )
                 )
-            )
-        """).eq("estado", True).execute()
+            """).eq("estado", True).execute()
+
+        # Árboles activos con frutos (RPC), cultivos y estados de cacao, en paralelo;
+        # las mismas lecturas en curso desde otra petición (p. ej. /arboles) se comparten
+        respuestas = fan_out({
+            "arboles": shared("rpc:get_arboles_with_frutos", lambda: supabase.rpc("get_arboles_with_frutos").execute()),
+            "cultivos": shared("cultivo:zone-analysis", consultar_cultivos),
+            "estados": shared("estado_cacao", lambda: supabase.table("estado_cacao").select("estado_cacao_id, nombre").execute()),
+        }, "load_zone_features")
+
+        arboles_response = respuestas["arboles"]
+        if hasattr(arboles_response, 'error') and arboles_response.error:
+            raise HTTPException(status_code=500, detail=f"Error al obtener árboles: {arboles_response.error}")
+        
+        arboles_data = arboles_response.data or []
 
+        cultivos_response = respuestas["cultivos"]
         if hasattr(cultivos_response, 'error') and cultivos_response.error:
             raise HTTPException(status_code=500, detail=f"Error al obtener cultivos: {cultivos_response.error}")
 
         cultivos_data = cultivos_response.data or []
 
-        # Obtener estados de cacao
-        estados_response = supabase.table("estado_cacao").select("estado_cacao_id, nombre").execute()
+        estados_response = respuestas["estados"]
         if hasattr(estados_response, 'error') and estados_response.error:
             raise HTTPException(status_code=500, detail=f"Error al obtener estados: {estados_response.error}")
         
@@ -68,7 +129,10 @@ def get_zone_analysis():
 
         # Crear GeoJSON para cultivos
         cultivo_features = []
+        lote_por_cultivo = {}
         for cultivo in cultivos_data:
+            lote = cultivo.get("lote") or {}
+            lote_por_cultivo[str(cultivo["cultivo_id"])] = (cultivo.get("lote_id"), lote.get("finca_id"))
             if cultivo.get("poligono"):
                 feature = {
                     "type": "Feature",
@@ -82,29 +146,97 @@ def get_zone_analysis():
                 }
                 cultivo_features.append(feature)
 
-        # Combinar todas las features
-        all_features = arbol_features + cultivo_features
-        geojson = {
-            "type": "FeatureCollection",
-            "features": all_features
-        }
+        return arbol_features, cultivo_features, lote_por_cultivo
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en análisis de zonas: {str(e)}")
+
+
+def build_zone_index():
+    """Índice espacial sobre las features de árboles (puntos) y cultivos (envolventes)."""
+    arbol_features, cultivo_features, lote_por_cultivo = load_zone_features()
+    features = arbol_features + cultivo_features
+    bounds = [point_bounds(f["geometry"]) for f in arbol_features]
+    bounds += [geometry_bounds(f["geometry"]) for f in cultivo_features]
+    zonas = [lote_por_cultivo.get(f["properties"]["cultivo_id"], (None, None)) for f in features]
+    return FeatureIndex(features, bounds, [z[0] for z in zonas], [z[1] for z in zonas])
+
+
+def count_zone_features():
+    """
+    (árboles, cultivos) sin serializar features: se cuentan sobre el índice
+    espacial de zonas, que se arma con load_zone_features (las mismas features y
+    filtros de la respuesta completa) y se reutiliza hasta SPATIAL_INDEX_TTL.
+    """
+    tipos = Counter(f["properties"]["tipo"] for f in get_index("zone-analysis", build_zone_index).items)
+    return tipos["arbol"], tipos["cultivo"]
+
+
+def project_properties(features, fields):
+    """Features con solo las propiedades de fields (y "tipo"); fields None = todas."""
+    if fields is None:
+        return features
+    keep = set(fields) | {"tipo"}
+    return [
+        {**f, "properties": {k: v for k, v in f["properties"].items() if k in keep}}
+        for f in features
+    ]
+
+
+def build_zone_analysis(tolerance=None, bbox=None, finca_id=None, lote_id=None, include=None, fields=None):
+    """
+    Arma la respuesta de GET /zone-analysis, opcionalmente filtrada por bbox/finca/lote.
+    include: partes de la respuesta (None = todas); fields: propiedades de las features.
+    """
+    include = SECCIONES if include is None else include
+    try:
+        filtrado = bbox is not None or finca_id is not None or lote_id is not None
+        if "geojson" not in include and not filtrado:
+            # Solo resumen: conteos del índice, sin serializar las features
+            total_arboles, total_cultivos = count_zone_features()
+            arbol_features = cultivo_features = None
+        else:
+            if filtrado:
+                features = get_index("zone-analysis", build_zone_index).query(bbox, finca_id, lote_id)
+                arbol_features = [f for f in features if f["properties"]["tipo"] == "arbol"]
+                cultivo_features = [f for f in features if f["properties"]["tipo"] == "cultivo"]
+            else:
+                arbol_features, cultivo_features, _ = load_zone_features()
+            total_arboles, total_cultivos = len(arbol_features), len(cultivo_features)
+
+        result = {}
+        if "geojson" in include:
+            if tolerance is not None:
+                cultivo_features = [
+                    {**f, "geometry": simplify_geometry(("cultivo", f["properties"]["cultivo_id"]), f["geometry"], tolerance)}
+                    for f in cultivo_features
+                ]
+
+            # Combinar todas las features
+            result["geojson"] = {
+                "type": "FeatureCollection",
+                "features": project_properties(arbol_features + cultivo_features, fields)
+            }
 
         # Calcular estadísticas básicas
         stats = {
-            "total_arboles": len(arbol_features),
-            "total_cultivos": len(cultivo_features),
-            "total_features": len(all_features)
+            "total_arboles": total_arboles,
+            "total_cultivos": total_cultivos,
+            "total_features": total_arboles + total_cultivos
         }
+        if "stats" in include:
+            result["stats"] = stats
 
         # Generar notificaciones automáticas
-        notifications = generate_automatic_notifications(stats)
+        if "notifications" in include:
+            result["notifications"] = generate_automatic_notifications(stats)
 
-        return {
-            "geojson": geojson,
-            "stats": stats,
-            "notifications": notifications
-        }
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en análisis de zonas: {str(e)}")
 
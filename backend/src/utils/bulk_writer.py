@@ -0,0 +1,117 @@
+"""
+Escritura masiva en Supabase.
+
+Divide las filas en bloques acotados por número de filas y por tamaño del cuerpo
+JSON (PostgREST rechaza o corta peticiones muy grandes), envía los bloques en
+paralelo hasta un límite configurable y reintenta los que fallan. Con
+on_conflict los reintentos son idempotentes: un bloque que sí llegó a escribirse
+antes del error se ignora como duplicado en lugar de fallar o duplicarse.
+Con raise_errors=False los bloques que siguen fallando no cortan la carga: se
+devuelven en "failed" para que quien llama sepa qué filas no se escribieron.
+Con bisect=True un bloque que falla se parte en mitades hasta aislar las filas
+con error (tipo, llave foránea...), y el resto del bloque sí se escribe.
+"""
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from postgrest.types import ReturnMethod
+
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "1000"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(512 * 1024)))
+BULK_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", "4"))
+BULK_RETRIES = int(os.getenv("BULK_RETRIES", "3"))
+BULK_BACKOFF = 0.5  # segundos, se duplica en cada reintento
+
+
+def chunk_rows(rows, max_rows=BULK_MAX_ROWS, max_bytes=BULK_MAX_BYTES):
+    """Agrupa filas en bloques de como máximo max_rows filas y ~max_bytes de JSON."""
+    chunk, size = [], 2
+    for row in rows:
+        row_size = len(json.dumps(row, default=str)) + 1
+        if chunk and (len(chunk) >= max_rows or size + row_size > max_bytes):
+            yield chunk
+            chunk, size = [], 2
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(client, table, chunk, on_conflict, retries):
+    #Envía un bloque con reintentos y espera exponencial.
+    for attempt in range(retries + 1):
+        try:
+            query = client.table(table)
+            if on_conflict:
+                query = query.upsert(chunk, on_conflict=on_conflict, ignore_duplicates=True,
+                                     returning=ReturnMethod.minimal)
+            else:
+                query = query.insert(chunk, returning=ReturnMethod.minimal)
+            res = query.execute()
+            if hasattr(res, "error") and res.error:
+                raise Exception(res.error.message if hasattr(res.error, "message") else str(res.error))
+            return len(chunk)
+        except Exception as e:
+            if attempt == retries:
+                raise RuntimeError(f"Error insertando bloque de {len(chunk)} filas en '{table}': {e}") from e
+            time.sleep(BULK_BACKOFF * 2 ** attempt)
+
+
+def _try_chunk(client, table, chunk, on_conflict, retries, bisect=False):
+    #(filas escritas, bloques fallidos) de un bloque; un fallo definitivo no lanza excepción.
+    try:
+        return _send_chunk(client, table, chunk, on_conflict, retries), []
+    except RuntimeError as e:
+        if not bisect or len(chunk) == 1:
+            return 0, [{"rows": chunk, "error": str(e)}]
+    #Aísla las filas con error partiendo el bloque (sin reintentos: el fallo ya es definitivo)
+    mitad = len(chunk) // 2
+    written, failed = 0, []
+    for parte in (chunk[:mitad], chunk[mitad:]):
+        n, f = _try_chunk(client, table, parte, on_conflict, 0, bisect)
+        written += n
+        failed += f
+    return written, failed
+
+
+def bulk_insert(table, rows, client=None, on_conflict=None, max_rows=BULK_MAX_ROWS,
+                max_bytes=BULK_MAX_BYTES, max_workers=BULK_MAX_WORKERS, retries=BULK_RETRIES,
+                raise_errors=True, bisect=False):
+    """
+    Inserta rows en table por bloques concurrentes.
+    client: cliente de Supabase (por defecto el de la app).
+    on_conflict: columna(s) de la llave primaria; activa reintentos idempotentes.
+    raise_errors: si es False, un bloque que falla tras los reintentos no lanza
+    RuntimeError: sus filas y el error quedan en "failed" y el resto sigue.
+    bisect: parte los bloques que fallan hasta dejar en "failed" solo las filas con error.
+    Devuelve {"table", "rows", "chunks", "failed", "seconds", "rows_per_second"}.
+    """
+    if client is None:
+        from src.db import supabase as client
+
+    start = time.perf_counter()
+    chunks = list(chunk_rows(rows, max_rows, max_bytes))
+    send = lambda c: _try_chunk(client, table, c, on_conflict, retries, bisect)
+    if len(chunks) <= 1 or max_workers <= 1:
+        results = [send(c) for c in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+            results = list(pool.map(send, chunks))
+    written = sum(n for n, _ in results)
+    failed = [f for _, fallidos in results for f in fallidos]
+    if failed and raise_errors:
+        raise RuntimeError(failed[0]["error"])
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "table": table,
+        "rows": written,
+        "chunks": len(chunks),
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(written / seconds, 1) if seconds > 0 else None,
+    }
+    fallas = f", {sum(len(f['rows']) for f in failed)} filas fallidas" if failed else ""
+    print(f"{table}: {written} filas en {len(chunks)} bloques ({stats['rows_per_second']} filas/s){fallas}")
+    return stats
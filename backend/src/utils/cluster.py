@@ -1,140 +1,494 @@
 from src.db import supabase
-from sklearn.cluster import DBSCAN
+from src.utils.grid_cluster import dbscan_labels, grid_cluster_labels
+from src.utils.bulk_writer import bulk_insert
+from src.utils.response_cache import invalidate
+from src.utils import reading_store
+from concurrent.futures import ThreadPoolExecutor
+import os
 import numpy as np
-from shapely import MultiPolygon,Point
-import uuid
+import shapely
+from shapely import MultiPolygon, STRtree
 import json
 import pandas as pd
-import geopandas as gpd
 import random
+import re
+import threading
+from functools import lru_cache
+from pyproj import Transformer
+
+#Radio de 25 m en radianes (sobre la esfera de 6371 km)
+CLUSTER_EPS = 0.025/6371
+
+#Motores de clustering intercambiables; ambos producen las mismas etiquetas
+CLUSTER_ENGINES = {
+    "dbscan": dbscan_labels,
+    "grid": grid_cluster_labels,
+}
+CLUSTER_ENGINE = os.getenv("CLUSTER_ENGINE", "grid")
+
+#Sistema de referencia que se guarda con las geometrías
+CRS_4326 = {'type': 'name', 'properties': {'name': 'EPSG:4326'}}
+
+#Serializa las ejecuciones del pipeline (peticiones síncronas y trabajos en segundo plano)
+PIPELINE_LOCK = threading.Lock()
+
+def report(progress, stage, fraction):
+    #Notifica la etapa actual del pipeline si hay callback de progreso.
+    if progress is not None:
+        progress(stage, fraction)
 
 def deactivate_old_records():
     #Desactiva cultivos y árboles antiguos (estado=True -> False).
     supabase.table("cultivo").update({"estado": False}).eq("estado", True).execute()
     supabase.table("arbol").update({"estado": False}).eq("estado", True).execute()
 
-def get_lote_for_point(lotes, lon, lat):
-    #Encuentra el lote al que pertenece un punto.
-    point = Point(lon, lat)
-    for lote in lotes:
-        geom = MultiPolygon(lote["area"]["coordinates"])
-        if geom.contains(point):
-            return lote["lote_id"], lote["nombre"]
-    return None
+def build_lote_index(lotes):
+    #Construye las geometrías de los lotes una sola vez y las indexa en un STRtree.
+    geoms = np.array([MultiPolygon(lote["area"]["coordinates"]) for lote in lotes], dtype=object)
+    shapely.prepare(geoms)
+    return STRtree(geoms)
 
-def insert_new_clusters(update_telemetry):
-    #Obtener lotes activos
-    lotes = supabase.table("lote").select("*").execute().data
-    estados = supabase.table("estado_cacao").select("*").execute().data
+def get_lotes_for_points(lotes, lon, lat, lote_index=None):
+    #Encuentra el índice del lote al que pertenece cada punto (-1 si no cae en ninguno).
+    if lote_index is None:
+        lote_index = build_lote_index(lotes)
+    points = shapely.points(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    #"within" equivale a lote.contains(punto): los puntos sobre el borde no pertenecen al lote
+    point_idx, lote_idx = lote_index.query(points, predicate="within")
+    #Si varios lotes contienen el punto gana el primero de la lista, como antes
+    result = np.full(len(points), len(lotes))
+    np.minimum.at(result, point_idx, lote_idx)
+    result[result == len(lotes)] = -1
+    return result
 
-    #Asignar lote_id a cada punto nuevo
-    for d in update_telemetry:
-        lote_info = get_lote_for_point(lotes, d["longitude"], d["latitude"])
-        if lote_info:
-            d["lote_id"], d["lote_nombre"] = lote_info
-        else:
-            d["lote_id"], d["lote_nombre"] = None, "Sin lote"
+def load_telemetry(update_telemetry, lotes):
+    #Convierte las lecturas en DataFrame y asigna lote_id/lote_nombre a cada punto.
+    if isinstance(update_telemetry, pd.DataFrame):
+        df = update_telemetry.copy(deep=False)
+    else:
+        df = pd.DataFrame(update_telemetry)
 
-    df = pd.DataFrame(update_telemetry)
+    #Asignar lote_id a cada punto nuevo (una sola consulta al índice espacial)
+    lote_idx = get_lotes_for_points(lotes, df["longitude"].values, df["latitude"].values)
+    lote_ids = np.array([lote["lote_id"] for lote in lotes] + [None], dtype=object)
+    lote_nombres = np.array([lote["nombre"] for lote in lotes] + ["Sin lote"], dtype=object)
+    df["lote_id"] = lote_ids[lote_idx]
+    df["lote_nombre"] = lote_nombres[lote_idx]
     print("Datos procesados e inicializados")
-    
-    #Coordenadas
-    coords = df[["longitude","latitude"]].values
+    return df
+
+def cluster_labels(coords, engine=None):
+    #Etiqueta de cluster para cada coordenada (longitude, latitude) en grados.
     coords_rad = np.radians(coords)
 
-    # Aplicar DBSCAN 
-    db = DBSCAN(eps=0.025/6371, min_samples=1, metric="haversine").fit(coords_rad)
-    labels = db.labels_
+    # Componentes conexas del grafo de radio 25 m (DBSCAN con min_samples=1)
+    engine = engine or CLUSTER_ENGINE
+    if engine not in CLUSTER_ENGINES:
+        raise ValueError(f"Motor de clustering desconocido: {engine}")
+    labels = CLUSTER_ENGINES[engine](coords_rad, CLUSTER_EPS)
+    print(f"Clustering completo ({engine})")
+    return labels
 
-    print("DBSCAN completo")
+@lru_cache(maxsize=None)
+def get_transformer(crs_from, crs_to):
+    #Transformer de pyproj reutilizable entre llamadas (crearlo es costoso).
+    return Transformer.from_crs(crs_from, crs_to, always_xy=True)
 
-    #Filtrar datos
-    df["cluster"] = labels
-    df_grouped = df.groupby("cluster").agg({
+def bulk_uuid4(n):
+    #Genera n UUID4 en bloque: un solo os.urandom y los bits de versión/variante vectorizados.
+    raw = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    h = raw.tobytes().hex()
+    return [f"{h[i:i+8]}-{h[i+8:i+12]}-{h[i+12:i+16]}-{h[i+16:i+20]}-{h[i+20:i+32]}" for i in range(0, 32 * n, 32)]
+
+def buffer_points(lon, lat, radio=15):
+    """
+    Círculos de `radio` metros alrededor de cada punto: proyecta a EPSG:3116, aplica
+    el buffer (16 segmentos por cuadrante, como geopandas) y vuelve a EPSG:4326.
+    Devuelve (coords, offsets, centroides): los vértices del polígono i son
+    coords[offsets[i]:offsets[i+1]].
+    """
+    x, y = get_transformer(4326, 3116).transform(lon, lat)
+    polygons = shapely.buffer(shapely.points(x, y), radio, quad_segs=16)
+    coords, index = shapely.get_coordinates(polygons, return_index=True)
+    coords[:, 0], coords[:, 1] = get_transformer(3116, 4326).transform(coords[:, 0], coords[:, 1])
+    offsets = np.r_[0, np.cumsum(np.bincount(index, minlength=len(polygons)))]
+    rings = shapely.linearrings(coords, indices=index)
+    centroides = shapely.get_coordinates(shapely.centroid(shapely.polygons(rings)))
+    return coords, offsets, centroides
+
+def build_cluster_records(df, estados, numeros=None):
+    """
+    Construye los cultivos y árboles de cada cluster de df (columna "cluster").
+    numeros: dict opcional cluster -> número usado en los nombres (por defecto cluster+1).
+    Devuelve (cultivos, arboles, {cluster: arbol_id}).
+    """
+    df_grouped = df[df["cluster"] != -1].groupby("cluster").agg({  # ignorar ruido
         "longitude": "mean",
         "latitude": "mean",
         "lote_id": "first",
         "lote_nombre": "first"
     })
+    if df_grouped.empty:
+        return [], [], {}
+
+    #Crear el radio de 15m alrededor del centro de cada cluster (todo en bloque)
+    coords, offsets, centroides = buffer_points(df_grouped["longitude"].values, df_grouped["latitude"].values)
 
-    gdf = gpd.GeoDataFrame(
-        df_grouped,
-        geometry=gpd.points_from_xy(df_grouped["longitude"], df_grouped["latitude"]),
-        crs="EPSG:4326"
-    )
-
-    #Proyectar en sistema distinto, crear el radio de 15m y volver a sistema lat/lon
-    gdf = gdf.set_geometry(gdf.to_crs(3116).buffer(15).to_crs(4326))
-
-    #Crear nuevos cultivos (uno por cluster)
-    arboles_to_insert = []
-    cultivos_to_insert = []
-    for i, row in gdf.iterrows():
-        if i == -1:
-            continue  # ignorar ruido
-        cluster_id = str(uuid.uuid4())
-        cultivo = {
-            "cultivo_id": cluster_id,
-            "nombre": f"{row['lote_nombre']} - Cultivo {i+1}",
+    clusters = df_grouped.index.tolist()
+    n = len(clusters)
+    numeros = [numeros[i] for i in clusters] if numeros is not None else [i+1 for i in clusters]
+    cultivo_ids = bulk_uuid4(n)
+    arbol_ids = bulk_uuid4(n)
+    estado_ids = [e["estado_cacao_id"] for e in random.choices(estados, k=n)]
+    anillos = [coords[offsets[k]:offsets[k+1]].tolist() for k in range(n)]
+    centros = centroides.tolist()
+    crs = CRS_4326
+
+    #Crear nuevos cultivos y árboles (uno por cluster)
+    cultivos_to_insert = [
+        {
+            "cultivo_id": cultivo_id,
+            "nombre": f"{lote_nombre} - Cultivo {numero}",
             "especie": "Cacao",
-            "lote_id": row["lote_id"],
+            "lote_id": lote_id,
             "estado": True,
-            'poligono': {'type': 'MultiPolygon',
-                'crs': {'type': 'name', 'properties': {'name': 'EPSG:4326'}},
-                'coordinates':[[[list(coord) for coord in np.array(row["geometry"].exterior.coords)]]]
-            }
+            'poligono': {'type': 'MultiPolygon', 'crs': crs, 'coordinates': [[anillo]]},
         }
-        cultivos_to_insert.append(cultivo)
-
-        arbol = {
-            "arbol_id": str(uuid.uuid4()),
-            "cultivo_id": cluster_id,
-            "estado_cacao_id":estados[random.randint(0,len(estados)-1)]["estado_cacao_id"],
-            "ubicacion": {
-                'type': 'Point',
-                'crs': {'type': 'name', 'properties': {'name': 'EPSG:4326'}},
-                'coordinates': [row["geometry"].centroid.x, row["geometry"].centroid.y]
-            },
-            "nombre": f"Arbol {i+1}" if i != -1 else "Sin_cluster",
+        for cultivo_id, lote_nombre, lote_id, numero, anillo in zip(
+            cultivo_ids, df_grouped["lote_nombre"].tolist(), df_grouped["lote_id"].tolist(), numeros, anillos)
+    ]
+    arboles_to_insert = [
+        {
+            "arbol_id": arbol_id,
+            "cultivo_id": cultivo_id,
+            "estado_cacao_id": estado_id,
+            "ubicacion": {'type': 'Point', 'crs': crs, 'coordinates': centro},
+            "nombre": f"Arbol {numero}",
             "especie": "CH13",
             "estado": True,
         }
-        arboles_to_insert.append(arbol)
-        
-    if cultivos_to_insert:
-        print("Insertando cultivos")
-        supabase.table("cultivo").insert(cultivos_to_insert).execute()
+        for arbol_id, cultivo_id, estado_id, centro, numero in zip(arbol_ids, cultivo_ids, estado_ids, centros, numeros)
+    ]
+    return cultivos_to_insert, arboles_to_insert, dict(zip(clusters, arbol_ids))
 
-    if arboles_to_insert:
-        print("Insertando arboles")
-        supabase.table("arbol").insert(arboles_to_insert).execute()
+def build_metric_records(df, arbol_ids=None):
+    #Filas de la tabla metrics a partir de las columnas de df; arbol_ids (opcional) asocia cada lectura a su árbol.
+    columnas = ["raw", "voltaje", "capacitancia", "latitude", "longitude"]
+    valores = df.reindex(columns=columnas).astype(object)
+    valores = valores.where(valores.notna(), None)
+    metrics_to_insert = [
+        {"metric_id": metric_id, **dict(zip(columnas, fila))}
+        for metric_id, fila in zip(bulk_uuid4(len(df)), zip(*(valores[c].tolist() for c in columnas)))
+    ]
+    if arbol_ids is not None:
+        for metric, arbol_id in zip(metrics_to_insert, arbol_ids):
+            metric["arbol_id"] = arbol_id
+    return metrics_to_insert
 
-    # Insertar las métricas nuevas
-    metrics_to_insert = []
-    for d in update_telemetry:
-        metric = {
-            "metric_id": str(uuid.uuid4()),
-            "raw": d.get("raw"),
-            "voltaje": d.get("voltaje"),
-            "capacitancia": d.get("capacitancia"),
-            "latitude": d.get("latitude"),
-            "longitude": d.get("longitude"),
-        }
-        metrics_to_insert.append(metric)
+def store_readings(kind, rows):
+    #Copia las lecturas ya escritas al almacén columnar local (si está activo); un fallo no corta el pipeline.
+    if not reading_store.ENABLED:
+        return
+    try:
+        reading_store.append(kind, rows)
+    except Exception as e:
+        print(f"No se pudieron guardar {len(rows)} lecturas en el almacén local: {e}")
+
+def write_records(cultivos_to_insert, arboles_to_insert, metrics_to_insert):
+    """
+    Inserta cultivos, árboles y métricas por bloques concurrentes.
+    cultivo -> arbol van en orden por la llave foránea; metrics se escribe en paralelo
+    salvo que traiga arbol_id (modo incremental), en cuyo caso espera a los árboles.
+    Devuelve las estadísticas de escritura de cada tabla.
+    """
+    stats = []
+
+    def write_arboles():
+        if cultivos_to_insert:
+            print("Insertando cultivos")
+            stats.append(bulk_insert("cultivo", cultivos_to_insert, client=supabase, on_conflict="cultivo_id"))
+        if arboles_to_insert:
+            print("Insertando arboles")
+            stats.append(bulk_insert("arbol", arboles_to_insert, client=supabase, on_conflict="arbol_id"))
+
+    def write_metrics():
+        if metrics_to_insert:
+            print("Insertando metrics")
+            stats.append(bulk_insert("metrics", metrics_to_insert, client=supabase, on_conflict="metric_id"))
+            store_readings("metrics", metrics_to_insert)
+
+    if metrics_to_insert and "arbol_id" in metrics_to_insert[0]:
+        write_arboles()
+        write_metrics()
+    else:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            pendiente = pool.submit(write_arboles)
+            write_metrics()
+            pendiente.result()
+    return stats
+
+def insert_new_clusters(update_telemetry, progress=None):
+    #Obtener lotes activos
+    report(progress, "lotes", 0.1)
+    lotes = supabase.table("lote").select("*").execute().data
+    estados = supabase.table("estado_cacao").select("*").execute().data
+
+    df = load_telemetry(update_telemetry, lotes)
     
-    if metrics_to_insert:
-        print("Insertando metrics")
-        supabase.table("metrics").insert(metrics_to_insert).execute()
+    #Coordenadas
+    coords = df[["longitude","latitude"]].values
+
+    #Filtrar datos
+    report(progress, "clustering", 0.2)
+    df["cluster"] = cluster_labels(coords)
+    report(progress, "registros", 0.5)
+    cultivos_to_insert, arboles_to_insert, _ = build_cluster_records(df, estados)
+
+    # Insertar las métricas nuevas
+    metrics_to_insert = build_metric_records(df)
+    report(progress, "escritura", 0.7)
+    escritura = write_records(cultivos_to_insert, arboles_to_insert, metrics_to_insert)
+    return {
+        "cultivos": len(cultivos_to_insert),
+        "arboles": len(arboles_to_insert),
+        "metrics": len(metrics_to_insert),
+        "escritura": escritura,
+    }
+
+# ---------- INCREMENTAL ----------
+def select_all(table, columns, page_size=1000, in_=None, **filters):
+    #Lee todas las filas de una tabla paginando con range() (PostgREST limita max-rows).
+    #in_: (columna, valores) opcional; la primera columna debe ser única para que el orden sea estable.
+    rows = []
+    while True:
+        query = supabase.table(table).select(columns)
+        for field, value in filters.items():
+            query = query.eq(field, value)
+        if in_ is not None:
+            query = query.in_(*in_)
+        page = query.order(columns.split(",")[0].strip()).range(len(rows), len(rows) + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+
+def cluster_number(nombre):
+    #Número de un árbol "Arbol N" (None si el nombre no sigue ese formato).
+    match = re.fullmatch(r"Arbol (\d+)", (nombre or "").strip())
+    return int(match.group(1)) if match else None
+
+def get_ultimo_numero():
+    #Mayor número de cluster usado hasta ahora (activos o desactivados), agregado en la base.
+    try:
+        return supabase.rpc("max_arbol_numero").execute().data or 0
+    except Exception as e:
+        if "PGRST202" not in str(e) and "Could not find the function" not in str(e):
+            raise
+        #Sin la función (src/db/max_arbol_numero.sql): se leen solo los nombres
+        print("⚠️ max_arbol_numero no disponible; se leen los nombres de los árboles")
+        numeros = (cluster_number(a.get("nombre")) for a in select_all("arbol", "arbol_id, nombre"))
+        return max((n for n in numeros if n is not None), default=0)
+
+def get_active_clusters():
+    """
+    Árboles activos (uno por cluster) con su centroide como [longitude, latitude],
+    y el mayor número de cluster usado hasta ahora (activos o desactivados).
+    """
+    arboles = select_all("arbol", "arbol_id, cultivo_id, ubicacion", estado=True)
+    activos = []
+    for a in arboles:
+        ubicacion = a.get("ubicacion")
+        if isinstance(ubicacion, str):
+            ubicacion = json.loads(ubicacion)
+        if not ubicacion or not ubicacion.get("coordinates"):
+            continue  # sin ubicación no se puede emparejar
+        activos.append({
+            "arbol_id": a["arbol_id"],
+            "cultivo_id": a["cultivo_id"],
+            "coordinates": ubicacion["coordinates"][:2],
+        })
+    return activos, get_ultimo_numero()
+
+def get_cluster_readings(arbol_ids, chunk=200):
+    #Coordenadas de las lecturas ya guardadas de los árboles dados (DataFrame arbol_id, longitude, latitude).
+    rows = []
+    for i in range(0, len(arbol_ids), chunk):
+        rows += select_all(
+            "metrics", "metric_id, arbol_id, longitude, latitude",
+            in_=("arbol_id", arbol_ids[i:i + chunk]),
+        )
+    return pd.DataFrame(rows, columns=["metric_id", "arbol_id", "longitude", "latitude"])
+
+def update_cluster_geometries(componentes, df):
+    """
+    Recalcula el polígono del cultivo y la ubicación del árbol de cada cluster que
+    cambió, con el mismo criterio que la carga completa: círculo de 15 m alrededor
+    del promedio de todas sus lecturas (las guardadas de los árboles del componente
+    más las nuevas). componentes: {label: [clusters existentes, el primero sobrevive]}.
+    Devuelve cuántos clusters se actualizaron.
+    """
+    if not componentes:
+        return 0
+    ids = [c["arbol_id"] for existentes in componentes.values() for c in existentes]
+    guardadas = get_cluster_readings(ids)
+    por_arbol = {k: g for k, g in guardadas.groupby("arbol_id")}
+    #Lecturas nuevas agrupadas una sola vez por cluster
+    nuevas = {k: g for k, g in df[["cluster", "longitude", "latitude"]].groupby("cluster")}
+
+    labels, lon, lat = [], [], []
+    for label, existentes in componentes.items():
+        partes = [nuevas[label][["longitude", "latitude"]]]
+        for c in existentes:
+            previas = por_arbol.get(c["arbol_id"])
+            if previas is not None and previas[["longitude", "latitude"]].notna().all(axis=1).any():
+                partes.append(previas[["longitude", "latitude"]])
+            else:
+                #Sin lecturas guardadas: el centroide actual cuenta como un punto
+                partes.append(pd.DataFrame([c["coordinates"]], columns=["longitude", "latitude"]))
+        puntos = pd.concat(partes).astype(float)
+        labels.append(label)
+        lon.append(puntos["longitude"].mean())
+        lat.append(puntos["latitude"].mean())
+
+    coords, offsets, centroides = buffer_points(np.array(lon), np.array(lat))
+
+    def actualizar(k):
+        survivor = componentes[labels[k]][0]
+        anillo = coords[offsets[k]:offsets[k+1]].tolist()
+        supabase.table("cultivo").update(
+            {"poligono": {'type': 'MultiPolygon', 'crs': CRS_4326, 'coordinates': [[anillo]]}}
+        ).eq("cultivo_id", survivor["cultivo_id"]).execute()
+        supabase.table("arbol").update(
+            {"ubicacion": {'type': 'Point', 'crs': CRS_4326, 'coordinates': centroides[k].tolist()}}
+        ).eq("arbol_id", survivor["arbol_id"]).execute()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(actualizar, range(len(labels))))
+    return len(labels)
+
+def reassign_metrics(componentes):
+    #Las lecturas de los árboles absorbidos en una fusión pasan al árbol que sobrevive (también en el almacén local).
+    destino = {}
+    for existentes in componentes.values():
+        if len(existentes) > 1:
+            supabase.table("metrics").update({"arbol_id": existentes[0]["arbol_id"]}).in_(
+                "arbol_id", [c["arbol_id"] for c in existentes[1:]]
+            ).execute()
+            destino.update({c["arbol_id"]: existentes[0]["arbol_id"] for c in existentes[1:]})
+    if destino and reading_store.ENABLED:
+        try:
+            reading_store.reassign("metrics", destino)
+        except Exception as e:
+            #El almacén quedaría con lecturas bajo el árbol absorbido: se vacía para no servirlas así
+            print(f"No se pudieron reasignar lecturas en el almacén local ({e}); se borra metrics, rellénelo con backfill")
+            reading_store.clear("metrics")
+
+def deactivate_clusters(clusters):
+    #Desactiva solo los cultivos y árboles absorbidos por una fusión.
+    if not clusters:
+        return
+    supabase.table("arbol").update({"estado": False}).in_("arbol_id", [c["arbol_id"] for c in clusters]).execute()
+    supabase.table("cultivo").update({"estado": False}).in_("cultivo_id", [c["cultivo_id"] for c in clusters]).execute()
+
+def update_clusters_incremental(update_telemetry, progress=None):
+    """
+    Empareja las lecturas nuevas con los centroides de los clusters activos:
+    - componente con un cluster existente: se extiende (las métricas apuntan a su árbol)
+    - componente con varios clusters existentes: se fusionan en el primero, sus métricas
+      pasan a ese árbol y el resto se desactiva
+    - componente sin clusters existentes: se inserta como cluster nuevo, numerado
+      después del mayor número ya usado
+    Los clusters extendidos o fusionados recalculan su polígono y su centroide.
+    Las escrituras dependen del tamaño del lote de lecturas, no del tamaño de la finca.
+    """
+    report(progress, "lotes", 0.0)
+    lotes = supabase.table("lote").select("*").execute().data
+    estados = supabase.table("estado_cacao").select("*").execute().data
+    activos, ultimo_numero = get_active_clusters()
+
+    df = load_telemetry(update_telemetry, lotes)
+    n_activos = len(activos)
+
+    #Los centroides existentes entran al clustering como puntos ancla
+    anclas = np.array([a["coordinates"] for a in activos], dtype=float).reshape(-1, 2)
+    coords = np.vstack([anclas, df[["longitude","latitude"]].values])
+    report(progress, "clustering", 0.2)
+    labels = cluster_labels(coords)
+    labels_anclas = labels[:n_activos]
+    df["cluster"] = labels[n_activos:]
+
+    #Clusters existentes por componente (en orden, el primero sobrevive a la fusión)
+    anclas_por_label = {}
+    for idx, label in enumerate(labels_anclas):
+        anclas_por_label.setdefault(label, []).append(activos[idx])
+
+    arbol_por_label = {}
+    cambiados = {}
+    absorbidos = []
+    nuevos = []
+    for label in np.unique(df["cluster"].values):
+        existentes = anclas_por_label.get(label)
+        if not existentes:
+            nuevos.append(label)
+            continue
+        arbol_por_label[label] = existentes[0]["arbol_id"]
+        cambiados[label] = existentes
+        absorbidos.extend(existentes[1:])
+
+    #Numerar los clusters nuevos a continuación del mayor número usado (no se reutilizan)
+    report(progress, "registros", 0.5)
+    numeros = {label: ultimo_numero + k + 1 for k, label in enumerate(nuevos)}
+    df_nuevos = df[df["cluster"].isin(nuevos)]
+    cultivos_to_insert, arboles_to_insert, arbol_por_cluster = build_cluster_records(df_nuevos, estados, numeros)
+    arbol_por_label.update(arbol_por_cluster)
+
+    arbol_ids = [arbol_por_label[label] for label in df["cluster"].values]
+    metrics_to_insert = build_metric_records(df, arbol_ids)
+
+    report(progress, "geometrias", 0.6)
+    actualizados = update_cluster_geometries(cambiados, df)
+    report(progress, "desactivando", 0.65)
+    reassign_metrics(cambiados)
+    deactivate_clusters(absorbidos)
+    report(progress, "escritura", 0.7)
+    escritura = write_records(cultivos_to_insert, arboles_to_insert, metrics_to_insert)
+    print(f"Clusters extendidos: {len(arbol_por_label) - len(nuevos)}, fusionados: {len(absorbidos)}, nuevos: {len(nuevos)}")
+    return {
+        "extendidos": len(arbol_por_label) - len(nuevos),
+        "fusionados": len(absorbidos),
+        "nuevos": len(nuevos),
+        "geometrias": actualizados,
+        "cultivos": len(cultivos_to_insert),
+        "arboles": len(arboles_to_insert),
+        "metrics": len(metrics_to_insert),
+        "escritura": escritura,
+    }
 
 # ---------- MAIN ----------
-def process_new_file(update_telemetry):
+def process_new_file(update_telemetry, incremental=False, progress=None):
     """
-    update_telemetry: lista de diccionarios con:
+    update_telemetry: lista de diccionarios (o DataFrame con esas columnas) con:
         {"longitude": ..., "latitude": ..., "voltaje": ..., "capacitancia": ..., "raw": ...}
+    incremental: si es True, extiende/fusiona los clusters activos en lugar de reconstruir todo.
+    progress: callback opcional progress(etapa, fraccion) para reportar avance.
+    Devuelve el resumen de lo escrito.
     """
-    deactivate_old_records()
-    insert_new_clusters(update_telemetry)
-    print("Base de datos actualizada con nuevos clusters y árboles.")
+    #Una sola ejecución a la vez: las fases de desactivación/inserción no se intercalan
+    with PIPELINE_LOCK:
+        try:
+            if incremental:
+                resumen = update_clusters_incremental(update_telemetry, progress)
+                print("Base de datos actualizada de forma incremental.")
+                return resumen
+            report(progress, "desactivando", 0.0)
+            deactivate_old_records()
+            resumen = insert_new_clusters(update_telemetry, progress)
+            print("Base de datos actualizada con nuevos clusters y árboles.")
+            return resumen
+        finally:
+            #Aunque falle a mitad, lo ya escrito invalida las respuestas cacheadas del mapa
+            invalidate("clustering")
 
 if __name__ == "__main__":
     # Supongamos que leemos un JSON con nuevas mediciones
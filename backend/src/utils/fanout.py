@@ -0,0 +1,60 @@
+"""
+Consultas independientes en paralelo, con el tiempo de cada una.
+
+fan_out() lanza a la vez las consultas síncronas que no dependen entre sí (RPC,
+selects) y espera a todas: la latencia pasa a ser la de la más lenta en lugar
+de la suma. Los tiempos se imprimen y, si la respuesta se está calculando
+dentro de cached_response, salen en la cabecera Server-Timing.
+"""
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "8"))
+
+_pool = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fanout")
+_timings = contextvars.ContextVar("server_timing", default=None)
+
+
+def collect():
+    """Empieza a juntar tiempos en el contexto actual; devuelve el dict {nombre: ms}."""
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def server_timing(timings):
+    """{nombre: ms} -> valor de la cabecera Server-Timing."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def fan_out(consultas, label=None):
+    """
+    {nombre: función sin argumentos} -> {nombre: resultado}, ejecutadas en paralelo.
+    Si alguna falla se propaga su excepción (después de esperar a las demás).
+    """
+    futures = {name: _pool.submit(_timed, fn) for name, fn in consultas.items()}
+    results, timings, error = {}, {}, None
+    for name, future in futures.items():
+        try:
+            results[name], timings[name] = future.result()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+    prefix = f"{label}." if label else ""
+    collected = _timings.get()
+    if collected is not None:
+        for name, ms in timings.items():
+            collected[prefix + name] = ms
+    if label:
+        print(f"{label}: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()))
+    return results
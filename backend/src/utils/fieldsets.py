@@ -0,0 +1,27 @@
+"""
+Selección de partes de una respuesta (?include=) y de propiedades (?fields=).
+
+Los dos parámetros son listas separadas por comas. Los endpoints usan el
+conjunto resultante para decidir qué consultar y qué serializar, así que las
+partes que no se piden no se descargan de la base ni viajan en la respuesta.
+"""
+
+
+def parse_fieldset(text, allowed=None, name="include"):
+    """
+    'a,b,c' -> {"a", "b", "c"}; None si text es None (se usa el valor por defecto).
+    Con allowed, ValueError si se pide un nombre que no existe.
+    """
+    if text is None:
+        return None
+    names = {n.strip() for n in text.split(",") if n.strip()}
+    if not names:
+        raise ValueError(f"{name} no puede estar vacío")
+    if allowed is not None:
+        unknown = names - set(allowed)
+        if unknown:
+            raise ValueError(
+                f"{name} desconocido: {', '.join(sorted(unknown))} "
+                f"(válidos: {', '.join(allowed)})"
+            )
+    return names
@@ -0,0 +1,146 @@
+"""
+Serialización y compresión de las respuestas GeoJSON.
+
+El payload se codifica por partes: las listas grandes (features de una
+FeatureCollection, árboles) se emiten en bloques de STREAM_BATCH_FEATURES
+elementos, cada bloque serializado en C con orjson. Así no pasa por
+jsonable_encoder ni se arma una copia intermedia del árbol de dicts, y las
+geometrías que llegan de Supabase se escriben tal cual, sin recorrerlas en
+Python. Los números de NumPy salen como números; un valor que no sea JSON es
+un error (TypeError), no se convierte a texto.
+
+La compresión se negocia con Accept-Encoding (br si está instalado brotli,
+si no gzip).
+"""
+import gzip
+import json
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+import numpy as np
+from fastapi.responses import StreamingResponse
+
+# orjson para serializar en C (opcional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
+# brotli para Content-Encoding: br (opcional)
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except Exception:
+    BROTLI_AVAILABLE = False
+
+STREAM_BATCH_FEATURES = 500
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _default(obj):
+    #Valores que no son JSON nativo; cualquier otro tipo es un error de serialización.
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return str(obj)
+    raise TypeError(f"Tipo no serializable a JSON: {type(obj).__name__}")
+
+
+def dumps(obj):
+    """JSON compacto en bytes."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def iter_json(payload, depth=0):
+    """
+    Bytes de payload por partes. Los dicts de los dos primeros niveles se abren
+    clave por clave y sus listas se emiten por bloques; el resto se serializa entero.
+    """
+    if isinstance(payload, dict) and depth < 2:
+        yield b"{"
+        for i, (key, value) in enumerate(payload.items()):
+            yield (b"," if i else b"") + dumps(str(key)) + b":"
+            yield from iter_json(value, depth + 1)
+        yield b"}"
+    elif isinstance(payload, list) and len(payload) > STREAM_BATCH_FEATURES:
+        yield b"["
+        for start in range(0, len(payload), STREAM_BATCH_FEATURES):
+            # Cada bloque se serializa como lista y se le quitan los corchetes
+            block = dumps(payload[start:start + STREAM_BATCH_FEATURES])[1:-1]
+            yield (b"," if start else b"") + block
+        yield b"]"
+    else:
+        yield dumps(payload)
+
+
+def encode(payload):
+    """Cuerpo completo de payload, armado con iter_json."""
+    return b"".join(iter_json(payload))
+
+
+def negotiate_encoding(accept_encoding):
+    """Mejor Content-Encoding soportado según Accept-Encoding ("br", "gzip" o None)."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    supported = ["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"]
+    candidates = [(weights.get(e, weights.get("*", 0.0)), -i, e) for i, e in enumerate(supported)]
+    q, _, encoding = max(candidates)
+    return encoding if q > 0 else None
+
+
+def compress(body, encoding):
+    """body comprimido con encoding ("br" o "gzip")."""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def iter_compressed(chunks, encoding):
+    #Compresión incremental de un iterable de bytes.
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+
+
+def streaming_json_response(request, payload, headers=None):
+    """StreamingResponse que codifica (y comprime, si se negocia) payload mientras se envía."""
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    chunks = iter_json(payload)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        chunks = iter_compressed(chunks, encoding)
+    return StreamingResponse(chunks, media_type="application/json", headers=headers)
@@ -0,0 +1,251 @@
+"""
+Clustering por grilla para el grafo de radio eps con la métrica haversine.
+
+Con min_samples=1, DBSCAN equivale a las componentes conexas del grafo en el que
+dos puntos están unidos si su distancia haversine es <= eps. Aquí ese grafo se
+resuelve sin BallTree:
+
+1. Se proyectan los puntos a un plano local (equirectangular) en radianes.
+2. Se agrupan en celdas de lado eps/sqrt(2): todos los puntos de una celda quedan
+   a distancia <= eps y forman parte de la misma componente.
+3. Dos celdas vecinas se unen si existe un par de puntos (uno en cada celda) con
+   distancia haversine <= eps, evaluada con la misma fórmula que usa sklearn.
+4. Las uniones se resuelven con un union-find vectorizado (enganche al menor +
+   pointer jumping).
+
+Las etiquetas se numeran en el orden de aparición del primer punto de cada
+componente, igual que DBSCAN, así que el resultado es idéntico al de
+DBSCAN(eps, min_samples=1, metric="haversine").
+"""
+import numpy as np
+
+# Holgura relativa para que la proyección nunca descarte pares válidos
+MARGIN = 1e-6
+# Pares candidatos evaluados por bloque en la verificación exhaustiva
+CHUNK_PAIRS = 2_000_000
+# Latitud máxima (rad) en la que la proyección local sigue siendo estable
+MAX_ABS_LAT = np.radians(89.0)
+
+
+def dbscan_labels(coords_rad, eps):
+    #Etiquetas con el DBSCAN de sklearn (referencia y respaldo).
+    from sklearn.cluster import DBSCAN
+    return DBSCAN(eps=eps, min_samples=1, metric="haversine").fit(coords_rad).labels_
+
+
+def _rdist(a, b):
+    #Distancia haversine reducida, con el mismo orden de operaciones que sklearn.
+    sin_0 = np.sin(0.5 * (a[:, 0] - b[:, 0]))
+    sin_1 = np.sin(0.5 * (a[:, 1] - b[:, 1]))
+    return sin_0 * sin_0 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * sin_1 * sin_1
+
+
+def _expand_ranges(starts, counts):
+    #Índices planos de varios rangos [start, start+count) y el rango al que pertenece cada uno.
+    seg = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets, seg
+
+
+def _run_starts(values):
+    #Inicio de cada corrida de valores iguales en un array ordenado.
+    return np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+
+
+def _compress(parent):
+    #Pointer jumping hasta que cada nodo apunta directamente a su raíz.
+    while True:
+        nxt = parent[parent]
+        if np.array_equal(nxt, parent):
+            return parent
+        parent = nxt
+
+
+def _union(parent, a, b):
+    #Union-find vectorizado: engancha siempre la raíz mayor a la menor.
+    while len(a):
+        ra, rb = parent[a], parent[b]
+        mask = ra != rb
+        if not mask.any():
+            break
+        a, b = a[mask], b[mask]
+        lo = np.minimum(ra[mask], rb[mask])
+        hi = np.maximum(ra[mask], rb[mask])
+        np.minimum.at(parent, hi, lo)
+        parent = _compress(parent)
+    return parent
+
+
+class _Grid:
+    #Puntos proyectados y agrupados por celda (cada celda es un rango contiguo de order).
+
+    def __init__(self, coords_rad, eps):
+        self.coords = coords_rad
+        self.r_eps = np.sin(0.5 * eps) ** 2
+
+        # Proyección local: y = lat, x = lon * cos(lat) con el menor coseno del conjunto,
+        # de modo que la distancia proyectada nunca supera a la haversine
+        cos_lat = np.cos(coords_rad[:, 0])
+        cos_min, cos_max = cos_lat.min(), cos_lat.max()
+        self.x = coords_rad[:, 1] * cos_min
+        self.y = coords_rad[:, 0]
+
+        # Lado de celda: el diámetro real de una celda queda por debajo de eps
+        self.reach = eps * (1 + MARGIN)
+        self.side = eps / (np.sqrt(2) * (cos_max / cos_min)) / (1 + MARGIN)
+        self.r = int(np.ceil(self.reach / self.side))
+
+        # Índices de celda trasladados a enteros no negativos (iy con r celdas de margen)
+        ix = np.floor(self.x / self.side).astype(np.int64)
+        iy = np.floor(self.y / self.side).astype(np.int64)
+        self.ix_min, self.iy_min = ix.min(), iy.min() - self.r
+        ix -= self.ix_min
+        iy -= self.iy_min
+        self.width = iy.max() + self.r + 1
+        point_keys = ix * self.width + iy
+
+        self.order = np.argsort(point_keys, kind="stable")
+        sorted_keys = point_keys[self.order]
+        self.cell_start = _run_starts(sorted_keys)
+        self.cell_keys = sorted_keys[self.cell_start]
+        self.cell_count = np.diff(np.r_[self.cell_start, len(sorted_keys)])
+        self.cell_ix = self.cell_keys // self.width
+        self.cell_iy = self.cell_keys % self.width
+        self.cell_of_point = np.empty(len(point_keys), dtype=np.int64)
+        self.cell_of_point[self.order] = np.repeat(np.arange(len(self.cell_keys)), self.cell_count)
+
+    def offsets(self):
+        #Desplazamientos (semiplano positivo) entre celdas que pueden tener puntos a <= eps.
+        result = []
+        for dx in range(0, self.r + 1):
+            for dy in range(-self.r, self.r + 1):
+                if dx == 0 and dy <= 0:
+                    continue
+                gap = self.side * np.hypot(max(abs(dx) - 1, 0), max(abs(dy) - 1, 0))
+                if gap <= self.reach:
+                    result.append((dx, dy))
+        return result
+
+    def neighbours(self, dx, dy):
+        #Pares (celda, celda vecina en dx, dy) que existen en la grilla.
+        target = self.cell_keys + dx * self.width + dy
+        pos = np.minimum(np.searchsorted(self.cell_keys, target), len(self.cell_keys) - 1)
+        found = self.cell_keys[pos] == target
+        return np.flatnonzero(found), pos[found]
+
+    def border_points(self, cells, dx, dy):
+        #Puntos de cada celda cercanos (<= reach) al rectángulo de la celda vecina.
+        flat, seg = _expand_ranges(self.cell_start[cells], self.cell_count[cells])
+        pts = self.order[flat]
+        x0 = (self.cell_ix[cells][seg] + dx[seg] + self.ix_min) * self.side
+        y0 = (self.cell_iy[cells][seg] + dy[seg] + self.iy_min) * self.side
+        gx = np.maximum(np.maximum(x0 - self.x[pts], self.x[pts] - (x0 + self.side)), 0)
+        gy = np.maximum(np.maximum(y0 - self.y[pts], self.y[pts] - (y0 + self.side)), 0)
+        dist = np.hypot(gx, gy)
+        keep = dist <= self.reach
+        return pts[keep], seg[keep], dist[keep]
+
+    def link(self, parent, pair_a, pair_b, dx, dy):
+        #Une cada par de celdas (pair_b = pair_a + (dx, dy)) que tenga algún par de puntos a <= eps.
+        pa, sa, da = self.border_points(pair_a, dx, dy)
+        pb, sb, db = self.border_points(pair_b, -dx, -dy)
+
+        # Pasada rápida: se prueba solo el punto de cada lado más cercano a la otra celda
+        def closest(pts, seg, dist):
+            rep = np.full(len(pair_a), -1)
+            if len(pts):
+                starts = _run_starts(seg)
+                mins = np.minimum.reduceat(dist, starts)
+                pos = np.flatnonzero(dist == np.repeat(mins, np.diff(np.r_[starts, len(seg)])))
+                first = pos[_run_starts(seg[pos])]
+                rep[seg[first]] = pts[first]
+            return rep
+
+        rep_a = closest(pa, sa, da)
+        rep_b = closest(pb, sb, db)
+        ok = (rep_a >= 0) & (rep_b >= 0)
+        hit = np.zeros(len(pair_a), dtype=bool)
+        hit[ok] = _rdist(self.coords[rep_a[ok]], self.coords[rep_b[ok]]) <= self.r_eps
+        parent = _union(parent, pair_a[hit], pair_b[hit])
+
+        # Verificación exhaustiva, por bloques, de los pares de celdas que siguen separados
+        pending = np.flatnonzero(ok & (parent[pair_a] != parent[pair_b]))
+        if not len(pending):
+            return parent
+        keep_a = np.isin(sa, pending)
+        keep_b = np.isin(sb, pending)
+        pa, sa = pa[keep_a], sa[keep_a]
+        pb, sb = pb[keep_b], sb[keep_b]
+        na = np.bincount(sa, minlength=len(pair_a))[pending]
+        nb = np.bincount(sb, minlength=len(pair_a))[pending]
+        start_a = np.searchsorted(sa, pending)
+        start_b = np.searchsorted(sb, pending)
+        sizes = na * nb
+        cum = np.cumsum(sizes)
+        total = int(cum[-1])
+        for t0 in range(0, total, CHUNK_PAIRS):
+            t = np.arange(t0, min(t0 + CHUNK_PAIRS, total))
+            p = np.searchsorted(cum, t, side="right")
+            local = t - (cum[p] - sizes[p])
+            ca, cb = pair_a[pending[p]], pair_b[pending[p]]
+            alive = parent[ca] != parent[cb]
+            if not alive.any():
+                continue
+            p, local, ca, cb = p[alive], local[alive], ca[alive], cb[alive]
+            u = pa[start_a[p] + local // nb[p]]
+            v = pb[start_b[p] + local % nb[p]]
+            close = _rdist(self.coords[u], self.coords[v]) <= self.r_eps
+            parent = _union(parent, ca[close], cb[close])
+        return parent
+
+
+def grid_cluster_labels(coords_rad, eps):
+    """
+    Componentes conexas del grafo de radio eps (haversine, radianes).
+    coords_rad: array (n, 2) con el mismo orden de columnas que recibe DBSCAN;
+    la primera columna es la que la fórmula haversine trata como latitud.
+    """
+    coords_rad = np.ascontiguousarray(coords_rad, dtype=float)
+    n = len(coords_rad)
+    if n == 0:
+        return np.empty(0, dtype=int)
+
+    # Fuera del rango en que la proyección local es válida se usa DBSCAN
+    if (not np.isfinite(coords_rad).all()
+            or np.abs(coords_rad[:, 0]).max() > MAX_ABS_LAT
+            or np.ptp(coords_rad[:, 1]) > np.pi):
+        return dbscan_labels(coords_rad, eps)
+
+    grid = _Grid(coords_rad, eps)
+    n_cells = len(grid.cell_keys)
+    parent = np.arange(n_cells)
+
+    # Primero las celdas adyacentes y luego las más lejanas: así la mayoría de
+    # pares a dos celdas ya están unidos cuando les toca y no se revisan
+    offsets = grid.offsets()
+    adjacent = [o for o in offsets if max(abs(o[0]), abs(o[1])) == 1]
+    farther = [o for o in offsets if max(abs(o[0]), abs(o[1])) > 1]
+    for group in (adjacent, farther):
+        pair_a, pair_b, pair_dx, pair_dy = [], [], [], []
+        for dx, dy in group:
+            a, b = grid.neighbours(dx, dy)
+            alive = parent[a] != parent[b]
+            pair_a.append(a[alive])
+            pair_b.append(b[alive])
+            pair_dx.append(np.full(alive.sum(), dx))
+            pair_dy.append(np.full(alive.sum(), dy))
+        if pair_a:
+            pair_a = np.concatenate(pair_a)
+            if len(pair_a):
+                parent = grid.link(parent, pair_a, np.concatenate(pair_b),
+                                   np.concatenate(pair_dx), np.concatenate(pair_dy))
+
+    # Etiqueta de cada punto = raíz de su celda, numerada por primera aparición
+    # (order es estable: el primer punto de cada celda es el de menor índice)
+    cell_first = grid.order[grid.cell_start]
+    root_first = np.full(n_cells, n)
+    np.minimum.at(root_first, parent, cell_first)
+    roots = np.flatnonzero(parent == np.arange(n_cells))
+    label_of_root = np.empty(n_cells, dtype=int)
+    label_of_root[roots[np.argsort(root_first[roots])]] = np.arange(len(roots))
+    return label_of_root[parent[grid.cell_of_point]]
@@ -0,0 +1,111 @@
+"""
+Trabajos en segundo plano para el pipeline de clustering.
+
+Los trabajos se ejecutan en un único hilo trabajador, uno detrás de otro, así
+que dos cargas simultáneas nunca intercalan sus fases de desactivación e
+inserción. El estado (etapa, progreso, tiempos, resultado) vive en memoria del
+proceso y se consulta por id.
+"""
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Trabajos terminados que se conservan para consulta
+MAX_FINISHED_JOBS = 200
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clustering-job")
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _prune():
+    #Descarta los trabajos terminados más antiguos (se llama con _lock tomado).
+    finished = [job_id for job_id, job in _jobs.items() if job["status"] in ("done", "error")]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del _jobs[job_id]
+
+
+class _Progress:
+    #Callback de progreso del pipeline: registra etapa, fracción y tiempo por etapa.
+
+    def __init__(self, job):
+        self.job = job
+        self.stage_started = None
+
+    def __call__(self, stage, fraction):
+        now = time.perf_counter()
+        with _lock:
+            previous = self.job["stage"]
+            if stage != previous:
+                if previous and self.stage_started is not None:
+                    self.job["timings"][previous] = round(now - self.stage_started, 3)
+                self.stage_started = now
+            self.job["stage"] = stage
+            self.job["progress"] = round(fraction, 3)
+
+    def finish(self):
+        if self.job["stage"] and self.stage_started is not None:
+            self.job["timings"][self.job["stage"]] = round(time.perf_counter() - self.stage_started, 3)
+
+
+def submit_job(fn, *args, count=None, **kwargs):
+    """
+    Encola fn(*args, progress=callback, **kwargs) y devuelve una copia del trabajo.
+    El valor de retorno de fn queda en "result".
+    """
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "status": "queued",
+        "stage": None,
+        "progress": 0.0,
+        "count": count,
+        "timings": {},
+        "result": None,
+        "error": None,
+        "created_at": _now(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    with _lock:
+        _jobs[job["job_id"]] = job
+        _prune()
+
+    def run():
+        progress = _Progress(job)
+        start = time.perf_counter()
+        with _lock:
+            job["status"] = "running"
+            job["started_at"] = _now()
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            with _lock:
+                job["status"] = "done"
+                job["progress"] = 1.0
+                job["result"] = result
+        except Exception as e:
+            with _lock:
+                job["status"] = "error"
+                job["error"] = str(e)
+        finally:
+            with _lock:
+                progress.finish()
+                job["timings"]["total"] = round(time.perf_counter() - start, 3)
+                job["finished_at"] = _now()
+
+    _executor.submit(run)
+    return get_job(job["job_id"])
+
+
+def get_job(job_id):
+    #Copia del estado de un trabajo (None si no existe o ya se descartó).
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {**job, "timings": dict(job["timings"])}
@@ -0,0 +1,74 @@
+"""
+Paginación por cursor (keyset).
+
+El cursor es opaco para el cliente: codifica en base64 los valores de la
+clave de orden de la última fila entregada. La página siguiente se pide con un
+filtro "después de esta clave" en lugar de un OFFSET, así que el costo por
+página no crece con el historial. La clave de orden siempre termina en una
+columna única (el id) para que el orden sea estable aunque haya empates.
+"""
+import json
+import base64
+
+# Filas que PostgREST devuelve como máximo por consulta (max-rows por defecto)
+POSTGREST_MAX_ROWS = 1000
+# Se piden limit + 1 filas para saber si hay otra página: deben caber en max-rows
+MAX_PAGE_SIZE = POSTGREST_MAX_ROWS - 1
+
+
+def encode_cursor(values):
+    """Cursor opaco a partir de los valores de la clave de orden."""
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """Valores de la clave de orden guardados en cursor; ValueError si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("cursor inválido")
+    return values
+
+
+def _quote(value):
+    #Valor entre comillas para los filtros or=(...) de PostgREST.
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def keyset_after(query, columns, values, desc=True):
+    """
+    Agrega a query el filtro de filas posteriores a values en el orden
+    (columns, desc): a < va OR (a = va AND b < vb) ... (con > si es ascendente).
+    """
+    op = "lt" if desc else "gt"
+    parts = []
+    for i, column in enumerate(columns):
+        conditions = [f"{c}.eq.{_quote(v)}" for c, v in zip(columns[:i], values[:i])]
+        conditions.append(f"{column}.{op}.{_quote(values[i])}")
+        parts.append(conditions[0] if len(conditions) == 1 else f"and({','.join(conditions)})")
+    return query.or_(",".join(parts))
+
+
+def ordered_page(query, columns, limit, after=None, desc=True):
+    """
+    Ordena query por columns, deja solo las filas posteriores a after (valores
+    de un cursor ya decodificado) y pide limit + 1 filas: la fila extra solo
+    indica si hay una página siguiente.
+    """
+    if after is not None:
+        query = keyset_after(query, columns, after, desc)
+    for column in columns:
+        query = query.order(column, desc=desc)
+    return query.limit(limit + 1)
+
+
+def split_page(rows, limit, columns):
+    """(filas de la página, next_cursor o None) a partir de las limit + 1 filas pedidas."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][c] for c in columns])
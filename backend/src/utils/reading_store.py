@@ -0,0 +1,338 @@
+"""
+Almacén local columnar de lecturas históricas de sensores.
+
+Las lecturas que se escriben en Supabase (metrics por árbol y fruto_metric por
+fruto) también se agregan aquí, en segmentos Arrow IPC inmutables:
+
+    READING_STORE_DIR/<tipo>/<AAAA-MM-DD>/seg-<ns>-<id>.arrow
+
+Cada segmento guarda las lecturas de un día ordenadas por entidad (árbol o
+fruto) y fecha, y en sus metadatos el rango de filas de cada entidad. Para
+leer, los segmentos se abren con memory-map y se recortan con slices (sin
+copiar) a la entidad pedida; solo se abren los días dentro del rango.
+
+Cuando un día pasa de READING_STORE_MAX_SEGMENTS segmentos se compacta en uno
+solo, que lista en sus metadatos los segmentos que reemplaza: esos se ignoran
+al leer aunque sigan en disco (p. ej. si no se pudieron borrar). Reasignar
+lecturas a otra entidad (fusión de clusters) reescribe de la misma forma los
+días afectados.
+
+El almacén está apagado salvo que se configure READING_STORE_DIR (y pyarrow
+esté instalado). Como solo ve lo que se escribe desde que se activa, se llena
+con lo que ya hay en la base con:
+
+    python -m src.utils.reading_store backfill [metrics|fruto_metric]
+    python -m src.utils.reading_store compact [metrics|fruto_metric]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+# pyarrow para los segmentos (opcional)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    PYARROW_AVAILABLE = True
+except Exception:
+    PYARROW_AVAILABLE = False
+
+READING_STORE_DIR = os.getenv("READING_STORE_DIR", "")
+ENABLED = bool(READING_STORE_DIR) and PYARROW_AVAILABLE
+READING_STORE_MAX_SEGMENTS = int(os.getenv("READING_STORE_MAX_SEGMENTS", "16"))  # por día, antes de compactar
+READING_STORE_CACHE_SIZE = int(os.getenv("READING_STORE_CACHE_SIZE", "256"))     # segmentos abiertos en memoria
+
+# Tipo de lectura -> columna de la entidad a la que pertenece
+KINDS = {"metrics": "arbol_id", "fruto_metric": "fruto_id"}
+VALUE_COLUMNS = ["raw", "voltaje", "capacitancia"]
+
+_segments = OrderedDict()  # ruta -> (tabla memory-mapped, {entidad: (inicio, filas)}, reemplazados); LRU
+_lock = threading.Lock()
+_write_lock = threading.Lock()  # compactaciones y reasignaciones, una a la vez
+
+
+def _schema(kind):
+    return pa.schema([
+        (KINDS[kind], pa.string()),
+        ("metric_id", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        *[(c, pa.float64()) for c in VALUE_COLUMNS],
+    ])
+
+
+def _kind_dir(kind):
+    if kind not in KINDS:
+        raise ValueError(f"Tipo de lectura desconocido: {kind}")
+    return os.path.join(READING_STORE_DIR, kind)
+
+
+def _timestamp(value):
+    #datetime/texto -> Timestamp en UTC (las fechas sin zona se toman como UTC).
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+def _write_segment(kind, day, frame, replaces=()):
+    #Escribe un segmento ya ordenado; aparece de forma atómica (os.replace). replaces: segmentos que sustituye.
+    entity = KINDS[kind]
+    ids = frame[entity].to_numpy()
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=int)
+    sizes = np.diff(np.r_[starts, len(ids)])
+    # Rango de filas de cada entidad (las lecturas sin entidad quedan al final, sin rango)
+    offsets = {ids[s]: [int(s), int(n)] for s, n in zip(starts, sizes) if ids[s] is not None}
+
+    table = pa.Table.from_pandas(frame, schema=_schema(kind), preserve_index=False)
+    table = table.replace_schema_metadata({"offsets": json.dumps(offsets), "replaces": json.dumps(sorted(replaces))})
+
+    directory = os.path.join(_kind_dir(kind), day)
+    os.makedirs(directory, exist_ok=True)
+    name = f"seg-{time.time_ns()}-{uuid.uuid4().hex[:8]}.arrow"
+    tmp = os.path.join(directory, "." + name)
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, os.path.join(directory, name))
+
+
+def append(kind, rows, now=None):
+    """
+    Agrega lecturas (dicts con la entidad, metric_id, created_at y las columnas
+    de valores) en un segmento por día. Las filas sin created_at toman now
+    (por defecto, el momento actual). Devuelve el número de filas escritas.
+    """
+    if not ENABLED or len(rows) == 0:
+        return 0
+    entity = KINDS[kind]
+    frame = pd.DataFrame(rows).reindex(columns=[entity, "metric_id", "created_at", *VALUE_COLUMNS])
+    frame[entity] = frame[entity].map(lambda v: None if v is None or v != v else str(v))
+    frame["metric_id"] = frame["metric_id"].map(lambda v: None if v is None or v != v else str(v))
+    created = pd.to_datetime(frame["created_at"], utc=True, format="ISO8601")
+    frame["created_at"] = created.fillna(_timestamp(now or datetime.now(timezone.utc))).dt.as_unit("us")
+    for c in VALUE_COLUMNS:
+        frame[c] = pd.to_numeric(frame[c], errors="coerce")
+
+    frame = frame.sort_values([entity, "created_at"], kind="stable", na_position="last")
+    days = []
+    for day, group in frame.groupby(frame["created_at"].dt.strftime("%Y-%m-%d"), sort=True):
+        _write_segment(kind, day, group.reset_index(drop=True))
+        days.append(day)
+    compact(kind, days)
+    return len(frame)
+
+
+def _open(path):
+    #Segmento memory-mapped (los archivos no cambian: se abren una vez y quedan en el LRU).
+    with _lock:
+        cached = _segments.get(path)
+        if cached is not None:
+            _segments.move_to_end(path)
+            return cached
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata or {}
+    segment = (table, json.loads(metadata.get(b"offsets", b"{}")), set(json.loads(metadata.get(b"replaces", b"[]"))))
+    with _lock:
+        _segments[path] = segment
+        _segments.move_to_end(path)
+        while len(_segments) > READING_STORE_CACHE_SIZE:
+            _segments.popitem(last=False)
+    return segment
+
+
+def _day_segments(directory, attempts=3):
+    """
+    (nombres en disco, [(nombre, tabla, offsets) vigentes]) de un día: los
+    segmentos que una compactación ya reemplazó se ignoran.
+    """
+    for attempt in range(attempts):
+        try:
+            names = sorted(n for n in os.listdir(directory) if n.endswith(".arrow") and not n.startswith("."))
+            opened = {n: _open(os.path.join(directory, n)) for n in names}
+        except FileNotFoundError:
+            # Una compactación borró un segmento entre el listado y la apertura: se vuelve a listar
+            if attempt == attempts - 1:
+                raise
+            continue
+        replaced = set().union(*(segment[2] for segment in opened.values()))
+        return names, [(n, *opened[n][:2]) for n in names if n not in replaced]
+
+
+def _rewrite_day(kind, directory, remap=None):
+    #Junta los segmentos vigentes de un día en uno solo (aplicando remap a la entidad) y borra los anteriores.
+    names, segments = _day_segments(directory)
+    if not segments:
+        return 0
+    entity = KINDS[kind]
+    frame = pa.concat_tables([table for _, table, _ in segments]).to_pandas()
+    if remap:
+        frame[entity] = frame[entity].map(lambda v: remap.get(v, v))
+    frame = frame.sort_values([entity, "created_at"], kind="stable", na_position="last").reset_index(drop=True)
+    _write_segment(kind, os.path.basename(directory), frame, replaces=names)
+    for name in names:
+        path = os.path.join(directory, name)
+        with _lock:
+            _segments.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # p. ej. abierto en otro proceso (Windows); queda reemplazado y se ignora
+    return len(frame)
+
+
+def compact(kind, days=None, max_segments=None):
+    """
+    Compacta en un solo segmento cada día de kind (o solo los de days) que tenga
+    más de max_segments (por defecto READING_STORE_MAX_SEGMENTS) segmentos
+    vigentes. Devuelve cuántos días compactó.
+    """
+    if not ENABLED:
+        return 0
+    if max_segments is None:
+        max_segments = READING_STORE_MAX_SEGMENTS
+    root = _kind_dir(kind)
+    directories = _days(kind) if days is None else [os.path.join(root, day) for day in days]
+    compacted = 0
+    with _write_lock:
+        for directory in directories:
+            if os.path.isdir(directory) and len(_day_segments(directory)[1]) > max_segments:
+                _rewrite_day(kind, directory)
+                compacted += 1
+    return compacted
+
+
+def reassign(kind, mapping):
+    """
+    Pasa las lecturas de las entidades de mapping ({anterior: nueva}) a la nueva,
+    reescribiendo (y compactando) solo los días con lecturas de alguna anterior.
+    Devuelve cuántos días reescribió.
+    """
+    if not ENABLED or not mapping:
+        return 0
+    mapping = {str(k): str(v) for k, v in mapping.items()}
+    rewritten = 0
+    with _write_lock:
+        for directory in _days(kind):
+            _, segments = _day_segments(directory)
+            if any(old in offsets for _, _, offsets in segments for old in mapping):
+                _rewrite_day(kind, directory, mapping)
+                rewritten += 1
+    return rewritten
+
+
+def _days(kind, start=None, end=None):
+    #Directorios de día que pueden tener lecturas en [start, end).
+    root = _kind_dir(kind)
+    if not os.path.isdir(root):
+        return []
+    first = start.strftime("%Y-%m-%d") if start is not None else None
+    last = end.strftime("%Y-%m-%d") if end is not None else None
+    return [
+        os.path.join(root, day) for day in sorted(os.listdir(root))
+        if (first is None or day >= first) and (last is None or day <= last)
+    ]
+
+
+def scan(kind, entity_id=None, start=None, end=None):
+    """
+    Tabla Arrow con las lecturas de kind (de entity_id si se da) con created_at
+    en [start, end), ordenada por created_at. Los recortes por entidad no copian
+    datos: apuntan al archivo mapeado en memoria.
+    """
+    if not ENABLED:
+        raise RuntimeError("El almacén de lecturas no está activo (READING_STORE_DIR)")
+    start = _timestamp(start) if start is not None else None
+    end = _timestamp(end) if end is not None else None
+
+    parts = []
+    for directory in _days(kind, start, end):
+        for _, table, offsets in _day_segments(directory)[1]:
+            if entity_id is not None:
+                span = offsets.get(str(entity_id))
+                if span is None:
+                    continue
+                table = table.slice(*span)
+            parts.append(table)
+    if not parts:
+        return _schema(kind).empty_table()
+    table = pa.concat_tables(parts)
+
+    if start is not None or end is not None:
+        created = table.column("created_at")
+        mask = None
+        if start is not None:
+            mask = pc.greater_equal(created, pa.scalar(start, type=created.type))
+        if end is not None:
+            before = pc.less(created, pa.scalar(end, type=created.type))
+            mask = before if mask is None else pc.and_(mask, before)
+        table = table.filter(mask)
+    # Un solo recorte de una entidad ya viene en orden; si no, se ordena (copia)
+    if table.num_rows > 1 and not (entity_id is not None and len(parts) == 1):
+        table = table.take(pc.sort_indices(table, sort_keys=[("created_at", "ascending")]))
+    return table
+
+
+def series(table):
+    """(created_at en ns desde la época, {columna: valores float con NaN}) de una tabla de scan()."""
+    t = table.column("created_at").cast(pa.int64()).to_numpy().astype(np.int64) * 1000
+    values = {
+        c: table.column(c).to_numpy().astype(float) if table.num_rows else np.empty(0)
+        for c in VALUE_COLUMNS
+    }
+    return t, values
+
+
+def rows(table, indices=None):
+    """Filas (dicts, created_at en ISO 8601) de table, o solo las de indices."""
+    if indices is not None:
+        table = table.take(pa.array(indices, type=pa.int64()))
+    out = table.to_pylist()
+    for row in out:
+        row["created_at"] = row["created_at"].isoformat()
+    return out
+
+
+def clear(kind):
+    """Borra todos los segmentos de kind."""
+    shutil.rmtree(_kind_dir(kind), ignore_errors=True)
+    with _lock:
+        for path in [p for p in _segments if p.startswith(_kind_dir(kind) + os.sep)]:
+            del _segments[path]
+
+
+def backfill(kind, page_size=1000):
+    """Reconstruye kind desde la tabla de Supabase del mismo nombre, paginando con range()."""
+    from src.db import supabase
+
+    entity = KINDS[kind]
+    keys = ["created_at", entity] + (["metric_id"] if kind == "metrics" else [])
+    columns = ", ".join(dict.fromkeys([entity, *keys, *VALUE_COLUMNS]))
+    clear(kind)
+    total = 0
+    while True:
+        query = supabase.table(kind).select(columns)
+        for key in keys:
+            query = query.order(key)
+        page = query.range(total, total + page_size - 1).execute().data or []
+        total += append(kind, page)
+        print(f"{kind}: {total} lecturas")
+        if len(page) < page_size:
+            return total
+
+
+if __name__ == "__main__":
+    if not ENABLED:
+        raise SystemExit("Configure READING_STORE_DIR (y instale pyarrow) para usar el almacén")
+    if len(sys.argv) < 2 or sys.argv[1] not in ("backfill", "compact"):
+        raise SystemExit("Uso: python -m src.utils.reading_store backfill|compact [metrics|fruto_metric]")
+    for kind in sys.argv[2:] or list(KINDS):
+        if sys.argv[1] == "backfill":
+            backfill(kind)
+        else:
+            print(f"{kind}: {compact(kind, max_segments=1)} días compactados")
@@ -0,0 +1,201 @@
+"""
+Caché en memoria de las respuestas de los endpoints del mapa.
+
+Cada respuesta se guarda ya serializada, con su clave (ruta + parámetros de la
+consulta), su ETag y su Last-Modified:
+
+- Dentro de CACHE_TTL se sirve directamente.
+- Pasado el TTL y hasta CACHE_STALE_TTL segundos más, se sirve la copia vieja y
+  se recalcula en segundo plano (stale-while-revalidate).
+- Más allá de eso se recalcula antes de responder.
+
+El pipeline de clustering y la limpieza llaman a invalidate() después de
+escribir, así que los datos nuevos se ven de inmediato sin esperar al TTL.
+Otros cachés derivados pueden suscribirse con add_invalidation_listener().
+
+Las variantes comprimidas (gzip/br) se generan la primera vez que se piden y
+se guardan junto al cuerpo. Con CACHE_TTL=0 no se cachea nada y la respuesta
+se transmite a medida que se codifica.
+
+Las peticiones simultáneas con la misma clave que tienen que calcular la
+respuesta (o refrescarla) comparten un solo cálculo.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlencode
+from fastapi import Response
+from starlette.concurrency import run_in_threadpool
+from src.utils.fanout import collect, server_timing
+from src.utils.single_flight import do_async
+from src.utils.geojson_stream import (
+    COMPRESS_MIN_BYTES, compress, encode, negotiate_encoding, streaming_json_response,
+)
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", "600"))
+
+_entries = {}
+_lock = threading.Lock()
+_generation = 0
+_listeners = []
+_refreshing = set()
+_tasks = set()
+
+
+def add_invalidation_listener(fn):
+    """Registra fn() para que se ejecute cada vez que se invalida la caché."""
+    _listeners.append(fn)
+    return fn
+
+
+def invalidate(reason=None):
+    """Descarta todas las respuestas guardadas y avisa a los listeners."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.clear()
+    for fn in list(_listeners):
+        try:
+            fn()
+        except Exception as e:
+            print(f"Error en listener de invalidación: {e}")
+    print(f"Caché de respuestas invalidada{f' ({reason})' if reason else ''}")
+
+
+def cache_key(request):
+    #Ruta + parámetros ordenados, para que ?a=1&b=2 y ?b=2&a=1 compartan entrada.
+    params = sorted(request.query_params.multi_items())
+    return request.url.path + ("?" + urlencode(params) if params else "")
+
+
+def _store(key, body, generation):
+    #Guarda el cuerpo salvo que haya habido una invalidación mientras se calculaba.
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    now = time.time()
+    with _lock:
+        previous = _entries.get(key)
+        # Si el contenido no cambió se conserva la fecha de modificación anterior
+        last_modified = previous["last_modified"] if previous and previous["etag"] == etag else now
+        entry = {
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.monotonic(),
+            "encoded": {},
+        }
+        if generation == _generation:
+            _entries[key] = entry
+    return entry
+
+
+async def _compute(key, compute):
+    #Un solo cálculo por clave y generación: las peticiones que llegan mientras
+    #tanto lo esperan (las posteriores a una invalidación no se suman a uno viejo).
+    generation = _generation
+
+    async def run():
+        body = await run_in_threadpool(lambda: encode(compute()))
+        return _store(key, body, generation)
+
+    return await do_async(("response", key, generation), run)
+
+
+async def _refresh(key, compute):
+    try:
+        await _compute(key, compute)
+    except Exception as e:
+        print(f"Error refrescando {key} en segundo plano: {e}")
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def _representation_etag(etag, encoding):
+    #ETag distinto por codificación: los bytes enviados no son los mismos.
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def _not_modified(request, entry):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        etags = {_representation_etag(entry["etag"], e) for e in (None, "gzip", "br")}
+        return "*" in tags or bool(tags & etags)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(entry["last_modified"]) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _response(request, entry, cache_status, timings=None):
+    body = entry["body"]
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if len(body) < COMPRESS_MIN_BYTES:
+        encoding = None
+    headers = {
+        "ETag": _representation_etag(entry["etag"], encoding),
+        "Last-Modified": formatdate(entry["last_modified"], usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Cache": cache_status,
+    }
+    if timings:
+        headers["Server-Timing"] = server_timing(timings)
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        # La variante comprimida se calcula una vez y queda en la entrada
+        if encoding not in entry["encoded"]:
+            entry["encoded"][encoding] = await run_in_threadpool(compress, body, encoding)
+        body = entry["encoded"][encoding]
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def cached_response(request, compute, ttl=None, stale_ttl=None):
+    """
+    Respuesta JSON cacheada para request.
+    compute: función síncrona (se ejecuta en el threadpool) que devuelve el payload.
+    Responde 304 si If-None-Match / If-Modified-Since coinciden con la copia servida.
+    Las respuestas calculadas en esta petición llevan Server-Timing con los
+    tiempos de las consultas hechas con fan_out().
+    """
+    ttl = CACHE_TTL if ttl is None else ttl
+    stale_ttl = CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+    if ttl <= 0:
+        timings = collect()
+        payload = await do_async(
+            ("payload", cache_key(request), _generation), lambda: run_in_threadpool(compute)
+        )
+        headers = {"Cache-Control": "no-cache", "X-Cache": "BYPASS"}
+        if timings:
+            headers["Server-Timing"] = server_timing(timings)
+        return streaming_json_response(request, payload, headers)
+
+    key = cache_key(request)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is not None:
+        age = time.monotonic() - entry["stored_at"]
+        if age <= ttl:
+            return await _response(request, entry, "HIT")
+        if age <= ttl + stale_ttl:
+            with _lock:
+                start = key not in _refreshing
+                _refreshing.add(key)
+            if start:
+                task = asyncio.create_task(_refresh(key, compute))
+                _tasks.add(task)
+                task.add_done_callback(_tasks.discard)
+            return await _response(request, entry, "STALE")
+
+    timings = collect()
+    entry = await _compute(key, compute)
+    return await _response(request, entry, "MISS", timings)
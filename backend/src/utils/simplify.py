@@ -0,0 +1,115 @@
+"""
+Simplificación de polígonos según el nivel de zoom.
+
+Con ?zoom=z los endpoints del mapa devuelven los polígonos simplificados a la
+tolerancia de un píxel en ese zoom (teselas de 256 px) y con las coordenadas
+cuantizadas a los decimales que esa tolerancia justifica. Con ?tolerance=t
+(en grados) se usa esa tolerancia directamente.
+
+La simplificación preserva la topología de cada polígono (no crea
+autointersecciones ni elimina anillos) y la cuantización se hace con
+set_precision, que también mantiene la geometría válida. El resultado conserva
+el tipo de la geometría original (un MultiPolygon sigue siendo MultiPolygon) y
+su miembro crs. El resultado de cada geometría se memoriza por nivel y se
+vacía al invalidar la caché de respuestas.
+"""
+import math
+import threading
+import numpy as np
+import shapely
+from shapely.geometry import shape, mapping
+from src.utils.response_cache import add_invalidation_listener
+
+MAX_ZOOM = 22
+
+_memo = {}  # (clave, tolerancia) -> (geometría original, geometría simplificada)
+_lock = threading.Lock()
+
+
+@add_invalidation_listener
+def clear():
+    """Vacía la memoria de geometrías simplificadas."""
+    with _lock:
+        _memo.clear()
+
+
+def tolerance_for_zoom(zoom):
+    """Grados que ocupa un píxel en el zoom dado (teselas de 256 px, en el ecuador)."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def resolve_tolerance(zoom=None, tolerance=None):
+    """Tolerancia pedida: tolerance si viene, si no la del zoom; None = sin simplificar."""
+    if tolerance is not None:
+        # Tres cifras significativas: tolerancias casi iguales comparten nivel en caché
+        return float(f"{tolerance:.3g}")
+    if zoom is not None:
+        return tolerance_for_zoom(zoom)
+    return None
+
+
+def decimals_for(tolerance):
+    """Decimales que se conservan para una tolerancia (uno más que su orden de magnitud)."""
+    return max(0, min(9, math.ceil(-math.log10(tolerance)) + 1))
+
+
+def _polygons(geom):
+    #Polígonos sueltos de geom (también dentro de multipolígonos y colecciones).
+    return [p for part in shapely.get_parts(geom) for p in shapely.get_parts(part) if p.geom_type == "Polygon"]
+
+
+def _same_type(geom, geom_type):
+    """
+    geom con el tipo de la geometría original: simplify/set_precision pueden dejar un
+    MultiPolygon de una parte como Polygon, partir un Polygon o devolver una
+    GeometryCollection. None si no queda ningún polígono.
+    """
+    if geom.geom_type == geom_type or geom_type not in ("Polygon", "MultiPolygon"):
+        return geom
+    polygons = _polygons(geom)
+    if not polygons:
+        return None
+    if geom_type == "MultiPolygon":
+        return shapely.MultiPolygon(polygons)
+    # Un Polygon que quedó partido conserva su parte más grande
+    return max(polygons, key=lambda p: p.area)
+
+
+def _simplify(geometry, tolerance):
+    geom = shape(geometry)
+    simplified = shapely.simplify(geom, tolerance, preserve_topology=True)
+    decimals = decimals_for(tolerance)
+    result = _same_type(shapely.set_precision(simplified, 10.0 ** -decimals), geom.geom_type)
+    if result is None or result.is_empty:
+        # Polígono más chico que la grilla: se conserva su versión solo simplificada
+        result = _same_type(simplified, geom.geom_type)
+    if result is None or result.is_empty:
+        return geometry
+    # Redondeo explícito para que el JSON no arrastre restos binarios (6.2000000000000002)
+    result = shapely.transform(result, lambda c: np.round(c, decimals))
+    simplified = mapping(result)
+    if "crs" in geometry:
+        simplified["crs"] = geometry["crs"]
+    return simplified
+
+
+def simplify_geometry(key, geometry, tolerance):
+    """
+    Geometría GeoJSON simplificada y cuantizada para tolerance (None = sin cambios).
+    key identifica la geometría (p. ej. ("cultivo", cultivo_id)) para reutilizar el
+    resultado mientras la geometría original no cambie.
+    """
+    if tolerance is None or not geometry:
+        return geometry
+    with _lock:
+        memo = _memo.get((key, tolerance))
+    if memo is not None and memo[0] == geometry:
+        return memo[1]
+    try:
+        simplified = _simplify(geometry, tolerance)
+    except Exception as e:
+        print(f"No se pudo simplificar {key}: {e}")
+        return geometry
+    with _lock:
+        _memo[(key, tolerance)] = (geometry, simplified)
+    return simplified
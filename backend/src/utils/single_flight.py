@@ -0,0 +1,71 @@
+"""
+Single-flight: lecturas idénticas en curso al mismo tiempo se resuelven con una
+sola llamada.
+
+Cada lectura se identifica con una clave (la consulta y sus parámetros).
+Mientras hay una llamada en curso para una clave, quien pida la misma clave
+espera esa llamada y recibe el mismo resultado ya decodificado (o la misma
+excepción) en lugar de lanzar otra. No es una caché: al terminar la llamada la
+clave se libera y la siguiente petición vuelve a consultar.
+
+- do / shared: funciones síncronas (código que corre en hilos).
+- do_async: corrutinas (handlers y cached_response).
+
+El resultado se comparte entre todos los que esperaban: no se debe modificar.
+"""
+import asyncio
+import threading
+
+_lock = threading.Lock()
+_calls = {}    # clave -> _Call en curso (hilos)
+_futures = {}  # (loop, clave) -> Future en curso
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def do(key, fn):
+    """Resultado de fn(); si ya hay una llamada en curso con key, espera y devuelve la suya."""
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = fn()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.done.set()
+
+
+def shared(key, fn):
+    """fn envuelta con do(key, fn), p. ej. para pasarla a fan_out()."""
+    return lambda: do(key, fn)
+
+
+async def do_async(key, fn):
+    """
+    await fn() (fn devuelve un awaitable); si ya hay uno en curso con key, espera
+    el mismo. Si quien espera se cancela, la llamada compartida sigue para los demás.
+    """
+    slot = (asyncio.get_running_loop(), key)
+    future = _futures.get(slot)
+    if future is None:
+        future = asyncio.ensure_future(fn())
+        _futures[slot] = future
+        future.add_done_callback(lambda f: _futures.pop(slot, None) if _futures.get(slot) is f else None)
+    return await asyncio.shield(future)
@@ -0,0 +1,141 @@
+"""
+Índices espaciales en memoria para filtrar por bbox, finca y lote.
+
+Cada índice guarda los elementos ya armados de una respuesta (árboles,
+features de cultivos...) junto con su envolvente, su lote_id y su finca_id, y
+un STRtree sobre las envolventes. Una consulta devuelve los elementos cuya
+envolvente toca el bbox pedido, en el orden original.
+
+Los índices se construyen la primera vez que se piden y se reconstruyen cuando
+se invalida la caché de respuestas (escrituras del pipeline) o cuando superan
+SPATIAL_INDEX_TTL segundos, para recoger cambios hechos por fuera de la API.
+"""
+import os
+import json
+import time
+import threading
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import shape
+from src.utils.response_cache import add_invalidation_listener
+
+SPATIAL_INDEX_TTL = float(os.getenv("SPATIAL_INDEX_TTL", "600"))
+
+_indexes = {}  # nombre -> (FeatureIndex, momento de construcción)
+_lock = threading.Lock()
+_build_locks = {}
+_generation = 0
+
+
+@add_invalidation_listener
+def clear():
+    """Descarta todos los índices; se reconstruyen en la próxima consulta."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _indexes.clear()
+
+
+def parse_bbox(text):
+    """'minx,miny,maxx,maxy' (lon/lat) -> tupla de floats; ValueError si no es válido."""
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in text.split(","))
+    except Exception:
+        raise ValueError("bbox debe ser minx,miny,maxx,maxy")
+    if not all(np.isfinite([minx, miny, maxx, maxy])) or minx > maxx or miny > maxy:
+        raise ValueError("bbox inválido: se espera minx <= maxx y miny <= maxy")
+    return minx, miny, maxx, maxy
+
+
+def point_bounds(ubicacion):
+    """Envolvente (x, y, x, y) de un Point GeoJSON (dict o texto); NaN si no hay ubicación."""
+    try:
+        if isinstance(ubicacion, str):
+            ubicacion = json.loads(ubicacion)
+        x, y = ubicacion["coordinates"][:2]
+        return (float(x), float(y), float(x), float(y))
+    except Exception:
+        return (np.nan,) * 4
+
+
+def geometry_bounds(geometry):
+    """Envolvente (minx, miny, maxx, maxy) de una geometría GeoJSON; NaN si no se puede leer."""
+    try:
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+        return shape(geometry).bounds
+    except Exception:
+        return (np.nan,) * 4
+
+
+class FeatureIndex:
+    """
+    Elementos con envolvente, lote y finca, consultables por bbox/finca_id/lote_id.
+    Con keys (ids únicos) también se pueden recorrer por páginas en orden de clave.
+    """
+
+    def __init__(self, items, bounds, lote_ids, finca_ids, keys=None):
+        self.items = items
+        bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+        self.located = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        self.tree = STRtree(shapely.box(*bounds[self.located].T))
+        self.lote_ids = np.array([None if v is None else str(v) for v in lote_ids], dtype=object)
+        self.finca_ids = np.array([None if v is None else str(v) for v in finca_ids], dtype=object)
+        if keys is not None:
+            self.keys = np.array([str(k) for k in keys], dtype=object)
+            self.key_order = np.argsort(self.keys, kind="stable")
+            self.sorted_keys = self.keys[self.key_order]
+
+    def _select(self, bbox=None, finca_id=None, lote_id=None):
+        #Índices (en orden original) que cumplen los filtros.
+        if bbox is not None:
+            idx = np.sort(self.located[self.tree.query(shapely.box(*bbox))])
+        else:
+            idx = np.arange(len(self.items))
+        if finca_id is not None:
+            idx = idx[self.finca_ids[idx] == str(finca_id)]
+        if lote_id is not None:
+            idx = idx[self.lote_ids[idx] == str(lote_id)]
+        return idx
+
+    def query(self, bbox=None, finca_id=None, lote_id=None):
+        """Elementos que cumplen todos los filtros dados, en el orden original."""
+        return [self.items[i] for i in self._select(bbox, finca_id, lote_id)]
+
+    def page(self, limit, after=None, bbox=None, finca_id=None, lote_id=None):
+        """
+        Hasta limit elementos con clave mayor que after, en orden de clave, y la
+        clave del último si quedan más (None si es la última página).
+        """
+        start = np.searchsorted(self.sorted_keys, str(after), side="right") if after is not None else 0
+        order = self.key_order[start:]
+        if bbox is not None or finca_id is not None or lote_id is not None:
+            keep = np.zeros(len(self.items), dtype=bool)
+            keep[self._select(bbox, finca_id, lote_id)] = True
+            order = order[keep[order]]
+        chosen = order[:limit + 1]
+        last = self.keys[chosen[limit - 1]] if len(chosen) > limit else None
+        return [self.items[i] for i in chosen[:limit]], last
+
+
+def get_index(name, build):
+    """Índice name; build() devuelve un FeatureIndex y solo se llama si hace falta reconstruir."""
+    with _lock:
+        cached = _indexes.get(name)
+        lock = _build_locks.setdefault(name, threading.Lock())
+    if cached is not None and time.monotonic() - cached[1] <= SPATIAL_INDEX_TTL:
+        return cached[0]
+    with lock:
+        with _lock:
+            cached = _indexes.get(name)
+            generation = _generation
+        if cached is not None and time.monotonic() - cached[1] <= SPATIAL_INDEX_TTL:
+            return cached[0]
+        start = time.perf_counter()
+        index = build()
+        with _lock:
+            if generation == _generation:
+                _indexes[name] = (index, time.monotonic())
+        print(f"Índice espacial '{name}': {len(index.items)} elementos en {time.perf_counter() - start:.3f}s")
+        return index
@@ -1,8 +1,24 @@
+"""
+Cliente de Supabase de la app, sobre conexiones HTTP compartidas.
+
+Un solo cliente (supabase) con un único pool httpx de conexiones keep-alive
+(HTTP/2 si está instalado h2), con límites y timeouts configurables por
+entorno. Los handlers async lo usan con run_in_threadpool(query.execute), así
+que toda la app comparte el mismo pool y los mismos límites.
+"""
 import os
 from pathlib import Path
+import httpx
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+# h2 para HTTP/2 (opcional)
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except Exception:
+    H2_AVAILABLE = False
+
 # Cargar el archivo .env desde el directorio backend
 backend_dir = Path(__file__).parent.parent.parent
 load_dotenv(backend_dir / ".env")
@@ -13,5 +29,40 @@ SUPABASE_KEY = os.getenv("VITE_SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABAS
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("❌ Faltan variables de entorno SUPABASE_URL o SUPABASE_SERVICE_ROLE_KEY")
 
-# Cliente único de Supabase para toda la app
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "120"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "10"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1").lower() not in ("0", "false", "no") and H2_AVAILABLE
+
+LIMITS = httpx.Limits(
+    max_connections=SUPABASE_MAX_CONNECTIONS,
+    max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+    keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+)
+TIMEOUT = httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT)
+
+
+def _pooled(session):
+    #Reemplazo de la sesión de PostgREST (misma URL y cabeceras) con el pool configurado.
+    return type(session)(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=TIMEOUT,
+        limits=LIMITS,
+        http2=SUPABASE_HTTP2,
+        follow_redirects=True,
+    )
+
+
+# Cliente único de Supabase para toda la app (sesión de PostgREST con pool)
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+_session = supabase.postgrest.session
+supabase.postgrest.session = _pooled(_session)
+_session.close()
+
+
+def close_clients():
+    """Cierra las conexiones abiertas (al apagar la app)."""
+    supabase.postgrest.session.close()
@@ -0,0 +1,132 @@
+"""
+Lectura en streaming de telemetría en NDJSON o CSV.
+
+El cuerpo se acumula en bloques acotados (cortados en el último salto de línea)
+y cada bloque se convierte directamente en columnas de NumPy con un parser
+columnar en C (pyarrow para NDJSON, el parser C de pandas para CSV), sin crear
+un dict de Python por lectura. Al cerrar se devuelve un DataFrame con las
+columnas que espera el pipeline de clustering.
+"""
+import io
+import os
+import numpy as np
+import pandas as pd
+
+# pyarrow para NDJSON columnar (opcional)
+try:
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+    PYARROW_AVAILABLE = True
+except Exception:
+    PYARROW_AVAILABLE = False
+
+COLUMNS = ["longitude", "latitude", "raw", "voltaje", "capacitancia"]
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(4 * 1024 * 1024)))
+
+CONTENT_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+    "application/csv": "csv",
+}
+
+
+def stream_format(content_type):
+    """Formato ("ndjson" o "csv") según el Content-Type; None si no es soportado."""
+    if not content_type:
+        return None
+    return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+class TelemetryStreamParser:
+    """
+    Convierte un cuerpo NDJSON/CSV recibido por partes en columnas numéricas.
+    Uso: feed(bytes) por cada parte, parse_pending() cuando pending() es True,
+    y close() al final para obtener el DataFrame.
+    """
+
+    def __init__(self, fmt, chunk_bytes=STREAM_CHUNK_BYTES):
+        if fmt not in ("ndjson", "csv"):
+            raise ValueError(f"Formato no soportado: {fmt}")
+        self.fmt = fmt
+        self.chunk_bytes = chunk_bytes
+        self.buffer = bytearray()
+        self.columns = {c: [] for c in COLUMNS}
+        self.header = None
+        self.rows = 0
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def pending(self):
+        return len(self.buffer) >= self.chunk_bytes
+
+    def parse_pending(self):
+        #Procesa todas las líneas completas del buffer y deja el resto para la siguiente parte.
+        cut = self.buffer.rfind(b"\n")
+        if cut < 0:
+            return
+        block = bytes(self.buffer[:cut + 1])
+        del self.buffer[:cut + 1]
+        self._parse_block(block)
+
+    def close(self):
+        #Procesa lo que queda y devuelve el DataFrame (longitude, latitude, raw, voltaje, capacitancia).
+        if self.buffer.strip():
+            self._parse_block(bytes(self.buffer))
+        self.buffer = bytearray()
+        data = {
+            c: np.concatenate(parts) if parts else np.empty(0, dtype=float)
+            for c, parts in self.columns.items()
+        }
+        return pd.DataFrame(data, columns=COLUMNS)
+
+    def _append(self, block_columns):
+        #Agrega un bloque de columnas; las que faltan se rellenan con NaN.
+        n = len(next(iter(block_columns.values()))) if block_columns else 0
+        for c in COLUMNS:
+            values = block_columns.get(c)
+            self.columns[c].append(np.full(n, np.nan) if values is None else np.asarray(values, dtype=float))
+        self.rows += n
+
+    def _parse_block(self, block):
+        if self.fmt == "ndjson":
+            self._parse_ndjson(block)
+        else:
+            self._parse_csv(block)
+
+    def _parse_ndjson(self, block):
+        if PYARROW_AVAILABLE:
+            schema = pa.schema([(c, pa.float64()) for c in COLUMNS])
+            table = pa_json.read_json(
+                io.BytesIO(block),
+                parse_options=pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore"),
+            )
+            self._append({c: table.column(c).to_numpy(zero_copy_only=False) for c in COLUMNS})
+        else:
+            # Sin pyarrow: parser de pandas (más lento, construye objetos intermedios)
+            df = pd.read_json(io.BytesIO(block), lines=True, dtype=False)
+            self._append({c: pd.to_numeric(df[c], errors="coerce").values for c in COLUMNS if c in df})
+
+    def _parse_csv(self, block):
+        if self.header is None:
+            # La primera línea define el orden de columnas si es una cabecera
+            first = block.split(b"\n", 1)[0].decode("utf-8").strip()
+            names = [n.strip().lower() for n in first.split(",")]
+            if set(names) & set(COLUMNS):
+                self.header = names
+                block = block[len(first.encode("utf-8")):].lstrip(b"\r\n")
+            else:
+                self.header = COLUMNS
+        if not block.strip():
+            return
+        df = pd.read_csv(
+            io.BytesIO(block),
+            header=None,
+            names=self.header,
+            usecols=[c for c in self.header if c in COLUMNS],
+            dtype={c: float for c in self.header if c in COLUMNS},
+            engine="c",
+        )
+        self._append({c: df[c].values for c in df.columns})
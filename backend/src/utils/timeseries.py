@@ -0,0 +1,126 @@
+"""
+Reducción de series de tiempo de sensores para graficar.
+
+- bucket_stats: agrupa las lecturas en intervalos fijos alineados a la época
+  (los mismos intervalos para cualquier ventana) y devuelve count y
+  min/max/mean por columna.
+- lttb: Largest-Triangle-Three-Buckets; elige los puntos que conservan la forma
+  visual de la serie (picos y valles) para dibujarla con pocos puntos.
+
+Todo se calcula con NumPy sobre la ventana ya descargada.
+"""
+import re
+import numpy as np
+import pandas as pd
+
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+MAX_BUCKETS = 10000
+
+
+def parse_bucket(text):
+    """'30s', '5m', '1h', '1d' o segundos ('300') -> segundos; ValueError si no es válido."""
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd]?)\s*", str(text))
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError("bucket debe ser un entero positivo con unidad s, m, h o d (p. ej. 5m)")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2) or "s"]
+
+
+def series_arrays(rows, columns, time_column="created_at"):
+    """
+    (tiempos en ns desde la época, {columna: valores float}, orden) de rows en
+    orden cronológico; orden[i] es la posición en rows del i-ésimo punto.
+    Los valores vacíos o no numéricos quedan como NaN.
+    """
+    frame = pd.DataFrame(rows, columns=[time_column, *columns])
+    t = pd.to_datetime(frame[time_column], utc=True, format="ISO8601").dt.tz_convert(None)
+    t = t.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    order = np.argsort(t, kind="stable")
+    values = {
+        c: pd.to_numeric(frame[c], errors="coerce").to_numpy(dtype=float)[order]
+        for c in columns
+    }
+    return t[order], values, order
+
+
+def _iso(ns):
+    return pd.Timestamp(int(ns), tz="UTC").isoformat()
+
+
+def _clean(array):
+    #NaN (intervalo sin valores) -> None en el JSON.
+    return [None if np.isnan(v) else float(v) for v in array]
+
+
+def bucket_stats(t, values, bucket_seconds):
+    """
+    Una entrada por intervalo con lecturas: {"start", "count", columna: {"min", "max", "mean"}}.
+    t en ns y ordenado; los intervalos empiezan en múltiplos de bucket_seconds.
+    """
+    if len(t) == 0:
+        return []
+    width = np.int64(bucket_seconds) * 1_000_000_000
+    idx = np.floor_divide(t, width)
+    starts = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+    if len(starts) > MAX_BUCKETS:
+        raise ValueError(f"la ventana tiene más de {MAX_BUCKETS} intervalos; use un bucket mayor")
+    counts = np.diff(np.r_[starts, len(t)])
+
+    columns = {}
+    for name, v in values.items():
+        valid = ~np.isnan(v)
+        n_valid = np.add.reduceat(valid.astype(np.int64), starts)
+        sums = np.add.reduceat(np.where(valid, v, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(n_valid > 0, sums / np.maximum(n_valid, 1), np.nan)
+        columns[name] = (
+            _clean(np.fmin.reduceat(v, starts)),
+            _clean(np.fmax.reduceat(v, starts)),
+            _clean(means),
+        )
+
+    return [
+        {
+            "start": _iso(idx[s] * width),
+            "count": int(counts[i]),
+            **{
+                name: {"min": mins[i], "max": maxs[i], "mean": means[i]}
+                for name, (mins, maxs, means) in columns.items()
+            },
+        }
+        for i, s in enumerate(starts)
+    ]
+
+
+def lttb(x, y, threshold):
+    """
+    Índices (crecientes) de los threshold puntos que elige LTTB sobre (x, y).
+    Siempre conserva el primero y el último; con threshold >= len(x) devuelve todos.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Límites de los threshold - 2 intervalos interiores
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    # Promedio de cada intervalo (con sumas acumuladas); el del último es el punto final
+    cx, cy = np.r_[0.0, np.cumsum(x)], np.r_[0.0, np.cumsum(y)]
+    sizes = edges[1:] - edges[:-1]
+    avg_x = np.r_[(cx[edges[1:]] - cx[edges[:-1]]) / sizes, x[-1]]
+    avg_y = np.r_[(cy[edges[1:]] - cy[edges[:-1]]) / sizes, y[-1]]
+
+    chosen = np.empty(threshold, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Área (x2) del triángulo entre el punto elegido antes, cada candidato y el promedio siguiente
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        chosen[i + 1] = a
+    return chosen
@@ -0,0 +1,114 @@
+"""
+Ubicación aproximada de los árboles sin coordenadas.
+
+Un árbol sin ubicacion se dibuja en el centroide (promedio de vértices) de su
+cultivo más un desplazamiento determinístico derivado de su id, con el mismo
+hash que usa el frontend (frontend-vite/src/hooks/geoUtils.ts):
+
+    hash = (hash << 5) - hash + charCode; hash |= 0; return Math.abs(hash)
+
+El hash se calcula vectorizado con NumPy para todos los ids a la vez y los
+desplazamientos se memorizan por (id, delta), ya que solo dependen del id; la
+memoria se vacía cuando se invalida la caché de respuestas. Los centroides solo
+se calculan para los cultivos que tienen árboles sin ubicación.
+"""
+import threading
+import numpy as np
+from src.utils.response_cache import add_invalidation_listener
+
+_lock = threading.Lock()
+_offsets = {}  # (arbol_id, delta) -> (lat_offset, lng_offset)
+
+
+@add_invalidation_listener
+def clear():
+    """Vacía la memoria de desplazamientos."""
+    with _lock:
+        _offsets.clear()
+
+
+def _code_units(strings):
+    #Matriz (n, max_len) con las unidades UTF-16 de cada string (como charCodeAt) y sus largos.
+    units = np.frombuffer("".join(strings).encode("utf-16-le"), dtype="<u2").astype(np.uint64)
+    if len(units) == sum(map(len, strings)):
+        lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    else:
+        # Hay caracteres fuera del BMP (dos unidades UTF-16 cada uno)
+        lengths = np.array([len(s.encode("utf-16-le")) // 2 for s in strings], dtype=np.int64)
+    rows = np.repeat(np.arange(len(strings)), lengths)
+    cols = np.arange(len(units)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    matrix = np.zeros((len(strings), lengths.max(initial=0)), dtype=np.uint64)
+    matrix[rows, cols] = units
+    return matrix, lengths
+
+
+def _hash_matrix(matrix, lengths):
+    #simpleHash del frontend sobre cada fila: aritmética int32 con desborde y Math.abs.
+    h = np.zeros(len(matrix), dtype=np.uint64)
+    for j in range(matrix.shape[1]):
+        step = (h * np.uint64(31) + matrix[:, j]) & np.uint64(0xFFFFFFFF)
+        h = np.where(j < lengths, step, h)
+    signed = h.astype(np.int64)
+    signed[signed >= 2 ** 31] -= 2 ** 32
+    return np.abs(signed)
+
+
+def js_hash(strings):
+    """simpleHash(str) del frontend para cada string."""
+    matrix, lengths = _code_units(strings)
+    return _hash_matrix(matrix, lengths)
+
+
+def js_hash_reversed(strings):
+    """simpleHash(str.split("").reverse().join()) del frontend: invierte y une con comas."""
+    matrix, lengths = _code_units(strings)
+    n, width = matrix.shape
+    rows = np.arange(n)[:, None]
+    cols = np.arange(width)[None, :]
+    # Carácter i del string invertido = carácter (largo - 1 - i) del original
+    reversed_matrix = np.where(cols < lengths[:, None],
+                               matrix[rows, np.clip(lengths[:, None] - 1 - cols, 0, None)], 0)
+    joined = np.full((n, max(2 * width - 1, 0)), ord(","), dtype=np.uint64)
+    joined[:, 0::2] = reversed_matrix
+    return _hash_matrix(joined, np.maximum(2 * lengths - 1, 0))
+
+
+def offsets(arbol_ids, delta):
+    """
+    (lat_offsets, lng_offsets) para cada id, igual que getOffsetFromHash del frontend.
+    Solo se calculan los ids que no estén ya memorizados.
+    """
+    with _lock:
+        missing = list({i for i in arbol_ids if (i, delta) not in _offsets})
+    if missing:
+        h1 = js_hash(missing)
+        h2 = js_hash_reversed(missing)
+        lat = ((h1 % 1000) / 1000 - 0.5) * delta
+        lng = ((h2 % 1000) / 1000 - 0.5) * delta
+        with _lock:
+            _offsets.update(zip(((i, delta) for i in missing), zip(lat.tolist(), lng.tolist())))
+    with _lock:
+        pairs = [_offsets[(i, delta)] for i in arbol_ids]
+    return [p[0] for p in pairs], [p[1] for p in pairs]
+
+
+def _centroid(ring):
+    xs = [p[0] for p in ring]
+    ys = [p[1] for p in ring]
+    return (sum(xs) / len(xs), sum(ys) / len(ys))
+
+
+def cultivo_centroids(cultivos, ids=None):
+    """
+    {cultivo_id: (lng, lat)} con el promedio de vértices del anillo exterior,
+    solo de los cultivos en ids (por defecto, todos).
+    """
+    result = {}
+    for c in cultivos:
+        if ids is not None and c["cultivo_id"] not in ids:
+            continue
+        try:
+            result[c["cultivo_id"]] = _centroid(c["poligono"]["coordinates"][0])
+        except Exception:
+            continue
+    return result
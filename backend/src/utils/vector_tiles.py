@@ -0,0 +1,171 @@
+"""
+Teselas vectoriales (Mapbox Vector Tile) de los polígonos de lotes y cultivos.
+
+Cada capa se carga una sola vez desde su fuente (una FeatureCollection),
+se proyecta a Web Mercator y se indexa en un STRtree. Para servir una tesela
+z/x/y se consultan solo las geometrías que la tocan, se recortan al borde de la
+tesela (más un margen), se simplifican a ~1 unidad de la grilla de la tesela
+y se codifican en protobuf.
+
+Las teselas generadas quedan en una caché LRU. Tanto la caché como los índices
+de las capas se descartan cuando se invalida la caché de respuestas (por
+ejemplo, después de reescribir los clusters).
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import shape
+from src.utils.response_cache import add_invalidation_listener
+
+# mapbox-vector-tile para codificar las teselas (opcional)
+try:
+    import mapbox_vector_tile
+    from mapbox_vector_tile.encoder import on_invalid_geometry_make_valid
+    MVT_AVAILABLE = True
+except Exception:
+    MVT_AVAILABLE = False
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # en unidades de la grilla de la tesela
+TILE_CACHE_SIZE = int(os.getenv("TILE_CACHE_SIZE", "2048"))
+MAX_ZOOM = 22
+
+EARTH_RADIUS = 6378137.0
+WORLD_HALF = np.pi * EARTH_RADIUS
+MAX_LAT = 85.0511287798
+
+_layers = {}        # nombre -> función que devuelve la FeatureCollection
+_indexes = {}       # nombre -> (geometrías, propiedades, STRtree)
+_tiles = OrderedDict()
+_lock = threading.Lock()
+_layer_locks = {}
+_generation = 0
+
+
+@add_invalidation_listener
+def clear():
+    """Descarta las teselas generadas y los índices de las capas."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _tiles.clear()
+        _indexes.clear()
+
+
+def register_layer(name, loader):
+    """Registra una capa; loader() devuelve una FeatureCollection en EPSG:4326."""
+    _layers[name] = loader
+    _layer_locks[name] = threading.Lock()
+
+
+def has_layer(name):
+    return name in _layers
+
+
+def _to_mercator(coords):
+    #Coordenadas (lon, lat) en grados -> metros Web Mercator (EPSG:3857).
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(np.clip(coords[:, 1], -MAX_LAT, MAX_LAT))
+    return np.column_stack([lon * EARTH_RADIUS, np.log(np.tan(np.pi / 4 + lat / 2)) * EARTH_RADIUS])
+
+
+def _property(value):
+    #Los atributos MVT son escalares; lo demás se guarda como JSON.
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _layer_index(name):
+    #Índice espacial de la capa, construido la primera vez que se pide.
+    with _lock:
+        index = _indexes.get(name)
+    if index is not None:
+        return index
+    with _layer_locks[name]:
+        with _lock:
+            index = _indexes.get(name)
+        if index is not None:
+            return index
+        generation = _generation
+        geometries, properties = [], []
+        for feature in _layers[name]().get("features", []):
+            if not feature.get("geometry"):
+                continue
+            try:
+                geom = shapely.transform(shape(feature["geometry"]), _to_mercator)
+            except Exception:
+                continue
+            geometries.append(geom)
+            properties.append({k: _property(v) for k, v in (feature.get("properties") or {}).items()})
+        index = (np.array(geometries, dtype=object), properties, STRtree(geometries))
+        with _lock:
+            # Si se invalidó mientras se cargaba, se usa pero no se guarda
+            if generation == _generation:
+                _indexes[name] = index
+        print(f"Índice de teselas '{name}': {len(geometries)} geometrías")
+        return index
+
+
+def tile_bounds(z, x, y):
+    """Límites (minx, miny, maxx, maxy) en metros Web Mercator de la tesela z/x/y."""
+    size = 2 * WORLD_HALF / 2 ** z
+    minx = -WORLD_HALF + x * size
+    maxy = WORLD_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _render(name, z, x, y):
+    geometries, properties, tree = _layer_index(name)
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    unit = (maxx - minx) / TILE_EXTENT
+    pad = TILE_BUFFER * unit
+    clip = (minx - pad, miny - pad, maxx + pad, maxy + pad)
+
+    features = []
+    for i in tree.query(shapely.box(*clip)):
+        geom = shapely.clip_by_rect(geometries[i], *clip)
+        if geom.is_empty:
+            continue
+        # Una unidad de la grilla de la tesela: los detalles menores no se verían
+        geom = geom.simplify(unit, preserve_topology=True)
+        if geom.is_empty:
+            continue
+        features.append({"geometry": geom, "properties": properties[i]})
+
+    return mapbox_vector_tile.encode(
+        [{"name": name, "features": features}],
+        default_options={
+            "quantize_bounds": (minx, miny, maxx, maxy),
+            "extents": TILE_EXTENT,
+            "on_invalid_geometry": on_invalid_geometry_make_valid,
+        },
+    )
+
+
+def get_tile(name, z, x, y):
+    """Bytes MVT de la tesela z/x/y de la capa name (desde la caché si ya se generó)."""
+    if not MVT_AVAILABLE:
+        raise RuntimeError("mapbox-vector-tile no está instalado")
+    key = (name, z, x, y)
+    with _lock:
+        tile = _tiles.get(key)
+        if tile is not None:
+            _tiles.move_to_end(key)
+            return tile
+        generation = _generation
+    tile = _render(name, z, x, y)
+    with _lock:
+        if generation == _generation:
+            _tiles[key] = tile
+        while len(_tiles) > TILE_CACHE_SIZE:
+            _tiles.popitem(last=False)
+    return tile
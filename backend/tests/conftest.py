@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# Los módulos crean el cliente de Supabase al importarse; las pruebas no lo usan
+os.environ.setdefault("VITE_SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("VITE_SUPABASE_SERVICE_ROLE_KEY", "test-service-role-key")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
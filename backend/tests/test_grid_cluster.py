@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from src.utils.grid_cluster import dbscan_labels, grid_cluster_labels
+
+pytest.importorskip("sklearn")
+
+# Radio de 25 m en radianes, el mismo del pipeline
+EPS = 0.025 / 6371
+CENTRO = np.radians([-75.5, 6.2])
+
+
+def dispersos(rng):
+    # Puntos sueltos a escala de decenas de metros: componentes que cruzan celdas
+    return CENTRO + rng.uniform(-1, 1, size=(800, 2)) * EPS * 30
+
+
+def grupos(rng):
+    # Grupos densos con puntos entre ellos
+    return np.vstack([
+        c + rng.normal(scale=EPS, size=(200, 2))
+        for c in CENTRO + rng.uniform(-1, 1, size=(10, 2)) * EPS * 40
+    ])
+
+
+def borde(rng):
+    # Pares a distancia cercana a eps (justo dentro / justo fuera), en ambos ejes
+    return np.vstack([
+        [CENTRO + [i * EPS * 5, 0], CENTRO + [i * EPS * 5 + d * EPS / np.cos(CENTRO[1]), 0]]
+        for i, d in enumerate(np.linspace(0.99, 1.01, 21))
+    ] + [
+        [CENTRO + [0, i * EPS * 5], CENTRO + [0, i * EPS * 5 + d * EPS]]
+        for i, d in enumerate(np.linspace(0.99, 1.01, 21))
+    ])
+
+
+@pytest.mark.parametrize("caso", [dispersos, grupos, borde], ids=lambda c: c.__name__)
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_grid_cluster_matches_dbscan(caso, seed):
+    """El motor por grilla da exactamente las mismas etiquetas que DBSCAN(min_samples=1)."""
+    coords = caso(np.random.default_rng(seed))
+    assert np.array_equal(grid_cluster_labels(coords, EPS), dbscan_labels(coords, EPS))
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.services import zone_analysis
+from src.utils import spatial_index
+
+CRS = {"type": "name", "properties": {"name": "EPSG:4326"}}
+ANILLO = [[-75.0, 6.0], [-74.99, 6.0], [-74.99, 6.01], [-75.0, 6.0]]
+
+ARBOLES = [
+    {"arbol_id": "a1", "nombre": "Arbol 1", "cultivo_id": "c1", "estado_arbol": "e1",
+     "ubicacion": {"type": "Point", "crs": CRS, "coordinates": [-75.0, 6.0]}, "frutos": []},
+    {"arbol_id": "a2", "nombre": "Arbol 2", "cultivo_id": "c1", "estado_arbol": "e1",
+     "ubicacion": {"type": "Point", "crs": CRS, "coordinates": [-74.995, 6.005]}, "frutos": []},
+    # Sin ubicación: no es feature
+    {"arbol_id": "a3", "nombre": "Arbol 3", "cultivo_id": "c2", "estado_arbol": "e1", "ubicacion": None, "frutos": []},
+]
+CULTIVOS = [
+    {"cultivo_id": "c1", "nombre": "Cultivo 1", "lote_id": "l1",
+     "lote": {"lote_id": "l1", "nombre": "Lote 1", "finca_id": "f1"},
+     "poligono": {"type": "MultiPolygon", "crs": CRS, "coordinates": [[ANILLO]]}},
+    # Sin polígono: no es feature
+    {"cultivo_id": "c2", "nombre": "Cultivo 2", "lote_id": "l1",
+     "lote": {"lote_id": "l1", "nombre": "Lote 1", "finca_id": "f1"}, "poligono": None},
+]
+
+
+class Consulta:
+    def __init__(self, data):
+        self.data = data
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return SimpleNamespace(data=self.data, error=None, count=None)
+
+
+class Supabase:
+    def rpc(self, name, *args, **kwargs):
+        assert name == "get_arboles_with_frutos"
+        return Consulta(ARBOLES)
+
+    def table(self, name):
+        return Consulta({"cultivo": CULTIVOS, "estado_cacao": [{"estado_cacao_id": "e1", "nombre": "Maduro"}]}[name])
+
+
+@pytest.fixture(autouse=True)
+def supabase(monkeypatch):
+    monkeypatch.setattr(zone_analysis, "supabase", Supabase())
+    spatial_index.clear()
+
+
+def test_summary_counts_match_full_response():
+    completa = zone_analysis.build_zone_analysis()
+    resumen = zone_analysis.build_zone_analysis(include={"stats", "notifications"})
+
+    tipos = [f["properties"]["tipo"] for f in completa["geojson"]["features"]]
+    assert "geojson" not in resumen
+    assert resumen["stats"] == completa["stats"]
+    assert resumen["stats"] == {
+        "total_arboles": tipos.count("arbol"),
+        "total_cultivos": tipos.count("cultivo"),
+        "total_features": len(tipos),
+    }
+    assert resumen["stats"]["total_arboles"] == 2
+    assert resumen["stats"]["total_cultivos"] == 1